@@ -0,0 +1,40 @@
+# Rebuild the daily_totals rollup from user_meals.
+#   python backfill_daily_totals.py                 # everything
+#   python backfill_daily_totals.py --since 2024-01-01
+import argparse
+import asyncio
+import datetime as dt
+from sqlalchemy import select, delete, func
+from database.config import engine, Base, async_session
+from database.models import UserMeal, DailyTotal
+from database.crud import dialect_insert
+
+
+async def go(since: dt.date | None):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    day = func.date(UserMeal.time_of_meal)
+    src = select(
+        UserMeal.user_id, day,
+        func.sum(UserMeal.total_calories), func.sum(UserMeal.total_protein),
+        func.sum(UserMeal.total_carbs), func.sum(UserMeal.total_fats),
+        func.count()
+    ).group_by(UserMeal.user_id, day)
+    wipe = delete(DailyTotal)
+    if since:
+        src = src.where(UserMeal.time_of_meal >= dt.datetime.combine(since, dt.time.min))
+        wipe = wipe.where(DailyTotal.date >= since)
+    async with async_session() as db:
+        # one transaction: readers never see a half-built rollup
+        await db.execute(wipe)
+        res = await db.execute(dialect_insert(db, DailyTotal).from_select(
+            ["user_id", "date", "total_calories", "total_protein",
+             "total_carbs", "total_fats", "meal_count"], src))
+        await db.commit()
+        print(f"daily_totals rebuilt: {res.rowcount} rows")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--since", type=dt.date.fromisoformat)
+    asyncio.run(go(ap.parse_args().since))
@@ -0,0 +1,107 @@
+# bench/analytics_bench.py
+# Nightly weekly-analytics job on a synthetic meal history: the old
+# per-user N+1 aggregation vs the set-based refresh_weekly_analytics.
+# Defaults to a throwaway SQLite file; point DATABASE_URL at Postgres to
+# run the same schema there.
+#
+#   python -m bench.analytics_bench --meals 1000000 --users 20000
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+import datetime as dt
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:////tmp/analytics_bench.db")
+
+from sqlalchemy import select, func, and_, insert, delete  # noqa: E402
+from database.config import engine, Base, async_session  # noqa: E402
+from database.models import FoodItem, UserMeal, WeeklyAnalytics  # noqa: E402
+from workers.analytics import refresh_weekly_analytics  # noqa: E402
+import backfill_daily_totals  # noqa: E402
+
+
+async def seed(meals: int, users: int, days: int, rng: random.Random):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    food_id = uuid.uuid4()
+    now = dt.datetime.utcnow()
+    async with async_session() as db:
+        await db.execute(insert(FoodItem), [{"id": food_id, "name": "rice", "calories": 130,
+                                             "protein": 2.7, "carbs": 28, "fats": 0.3}])
+        batch = []
+        for i in range(meals):
+            grams = rng.uniform(50, 400)
+            batch.append({
+                "id": uuid.uuid4(), "user_id": f"user{rng.randrange(users):07d}",
+                "food_id": food_id, "weight_in_grams": grams,
+                "total_calories": 1.3 * grams, "total_protein": 0.027 * grams,
+                "total_carbs": 0.28 * grams, "total_fats": 0.003 * grams,
+                "time_of_meal": now - dt.timedelta(minutes=rng.randrange(days * 1440)),
+            })
+            if len(batch) == 50_000:
+                await db.execute(insert(UserMeal), batch)
+                batch.clear()
+        if batch:
+            await db.execute(insert(UserMeal), batch)
+        await db.commit()
+
+
+async def legacy_n_plus_1(max_users: int) -> tuple[float, int]:
+    # the pre-rewrite job: one aggregate over user_meals per user
+    # (read side only; it also appended duplicate rows every night)
+    t = time.perf_counter()
+    n = 0
+    async with async_session() as db:
+        users = (await db.execute(select(UserMeal.user_id).distinct().limit(max_users))).scalars().all()
+        base = dt.date.today() - dt.timedelta(days=6)
+        for user_id in users:
+            stmt = select(
+                func.date(UserMeal.time_of_meal), func.sum(UserMeal.total_calories),
+                func.sum(UserMeal.total_protein), func.sum(UserMeal.total_carbs),
+                func.sum(UserMeal.total_fats)
+            ).where(and_(UserMeal.user_id == user_id,
+                         func.date(UserMeal.time_of_meal) >= base)
+                    ).group_by(func.date(UserMeal.time_of_meal))
+            (await db.execute(stmt)).all()
+            n += 1
+    return time.perf_counter() - t, n
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--meals", type=int, default=1_000_000)
+    ap.add_argument("--users", type=int, default=20_000)
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--legacy-users", type=int, default=2_000,
+                    help="users timed on the N+1 path (extrapolated to all)")
+    ap.add_argument("--skip-seed", action="store_true")
+    args = ap.parse_args()
+    rng = random.Random(42)
+
+    if not args.skip_seed:
+        t = time.perf_counter()
+        await seed(args.meals, args.users, args.days, rng)
+        print(f"seeded {args.meals} meals in {time.perf_counter() - t:.1f}s")
+        t = time.perf_counter()
+        await backfill_daily_totals.go(None)
+        print(f"daily_totals backfill {time.perf_counter() - t:.1f}s")
+
+    secs, n = await legacy_n_plus_1(args.legacy_users)
+    print(f"legacy N+1: {n} users in {secs:.2f}s -> ~{secs / n * args.users:.1f}s for {args.users} users")
+
+    async with async_session() as db:
+        await db.execute(delete(WeeklyAnalytics))
+        await db.commit()
+    for run in (1, 2):
+        stats = await refresh_weekly_analytics()
+        async with async_session() as db:
+            rows = await db.scalar(select(func.count()).select_from(WeeklyAnalytics))
+        print(f"set-based run {run}: {stats} -> {rows} weekly_analytics rows")
+    print("dry run:", await refresh_weekly_analytics(dry_run=True))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+# bench/decode_bench.py
+# Decode latency and peak memory: full-resolution PIL decode (what the
+# image endpoints used to do) vs ml.preprocess.decode_image, on a
+# synthetic 12 MP phone JPEG with an EXIF rotation.
+#
+#   python -m bench.decode_bench [--image photo.jpg] [--runs 20]
+import argparse
+import io
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+from ml.preprocess import decode_image
+
+
+def phone_jpeg(width=4032, height=3024) -> bytes:
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    # smooth gradients + noise compress like a photo, unlike pure noise
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], -1)
+    arr = np.clip(base + rng.integers(-20, 20, base.shape), 0, 255).astype(np.uint8)
+    img = Image.fromarray(arr)
+    exif = img.getexif()
+    exif[0x0112] = 6   # orientation: rotate 90 CW
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90, exif=exif)
+    return out.getvalue()
+
+
+def decode_full(data: bytes) -> np.ndarray:
+    from PIL import Image
+    return np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+MODES = {"full": decode_full, "preprocess": decode_image}
+
+
+def run_mode(mode: str, path: str, runs: int):
+    with open(path, "rb") as f:
+        data = f.read()
+    fn = MODES[mode]
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    lat = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        arr = fn(data)
+        lat.append(time.perf_counter() - t)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+    lat.sort()
+    print(f"{mode:>10}: shape={arr.shape} p50={lat[len(lat) // 2] * 1000:.1f} ms "
+          f"max={lat[-1] * 1000:.1f} ms peak_rss_delta={peak / 1024:.1f} MiB "
+          f"array={arr.nbytes / 2**20:.2f} MiB")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--image")
+    ap.add_argument("--runs", type=int, default=20)
+    ap.add_argument("--mode", choices=MODES)
+    args = ap.parse_args()
+    if args.mode:   # child process: one mode, so peak RSS is not shared
+        return run_mode(args.mode, args.image, args.runs)
+
+    path = args.image
+    if not path:
+        path = "/tmp/decode_bench_12mp.jpg"
+        with open(path, "wb") as f:
+            f.write(phone_jpeg())
+    for mode in MODES:
+        subprocess.run([sys.executable, "-m", "bench.decode_bench", "--mode", mode,
+                        "--image", path, "--runs", str(args.runs)], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# bench/detector_compare.py
+# Accuracy / latency of scanner detector backends on a folder of fixture
+# images (default: the frontend's sample photos). Each config is
+# backend[:model[:quantize]]; the first one is the reference the others
+# are scored against: per image, boxes of the same class with IoU >= 0.5
+# are matched, giving recall (reference boxes found), precision, mean IoU
+# and mean |confidence difference|. Latency is one image per call; the
+# batch run gives images/s at --batch. The INT8 calibration set defaults
+# to the same images, so use a held-out --calibration folder for numbers
+# that mean something on real traffic.
+#
+#   python -m bench.detector_compare
+#   python -m bench.detector_compare --configs torch:yolov8x.pt onnx:yolov8x.pt onnx:yolov8s.pt:static --threads 4
+#   python -m bench.detector_compare --configs onnx:yolov8s.pt:none onnx:yolov8s.pt:static --min-recall 0.9
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from ml.detectors import IMAGE_SUFFIXES, box_iou, load_detector
+from ml.preprocess import decode_image
+
+DEFAULT_IMAGES = os.path.join(os.path.dirname(__file__), "..", "..", "frontendfinal", "src")
+
+
+def percentiles(samples: list[float]) -> dict:
+    p50, p95, p99 = (round(float(v) * 1000, 1) for v in np.percentile(samples, (50, 95, 99)))
+    return {"p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+
+
+def detect(detector, images: list):
+    batch = detector.prepare(images)
+    return detector.decode(detector.infer(batch), batch)
+
+
+def agreement(ref, other, iou: float = 0.5) -> dict:
+    # greedy same-class matching, most confident reference box first
+    matched, ious, dconf = 0, [], []
+    for r, o in zip(ref, other):
+        free = np.ones(len(o.cls), dtype=bool)
+        for i in np.argsort(-r.conf):
+            cand = np.flatnonzero(free & (o.cls == r.cls[i]))
+            if not cand.size:
+                continue
+            overlap = box_iou(r.xyxyn[i], o.xyxyn[cand])
+            best = overlap.argmax()
+            if overlap[best] >= iou:
+                free[cand[best]] = False
+                matched += 1
+                ious.append(overlap[best])
+                dconf.append(abs(r.conf[i] - o.conf[cand[best]]))
+    n_ref, n_other = sum(len(r.cls) for r in ref), sum(len(o.cls) for o in other)
+    return {"ref_boxes": n_ref, "boxes": n_other,
+            "recall": round(matched / n_ref, 3) if n_ref else 1.0,
+            "precision": round(matched / n_other, 3) if n_other else 1.0,
+            "mean_iou": round(float(np.mean(ious)), 3) if ious else None,
+            "mean_conf_diff": round(float(np.mean(dconf)), 3) if dconf else None}
+
+
+def run(config: str, images: list, args) -> tuple[dict, list]:
+    backend, model, quantize = (config.split(":") + [None, None])[:3]
+    t = time.perf_counter()
+    detector = load_detector(backend, model or args.model, args.threads, args.conf,
+                             quantize=quantize or args.quantize, calibration=args.calibration)
+    loaded = time.perf_counter() - t
+    result = detect(detector, images)   # warm-up, and the boxes that get scored
+    single = []
+    for _ in range(args.repeat):
+        for img in images:
+            t = time.perf_counter()
+            detect(detector, [img])
+            single.append(time.perf_counter() - t)
+    batch = [images[i % len(images)] for i in range(args.batch)]
+    t = time.perf_counter()
+    for _ in range(args.repeat):
+        detect(detector, batch)
+    per_s = args.batch * args.repeat / (time.perf_counter() - t)
+    return {"config": config, "load_s": round(loaded, 2), **percentiles(single),
+            f"batch{args.batch}_img_s": round(per_s, 1)}, result
+
+
+def main(args) -> int:
+    paths = sorted(os.path.join(args.images, f) for f in os.listdir(args.images)
+                   if f.lower().endswith(IMAGE_SUFFIXES))
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(decode_image(f.read()))
+    print(f"{len(images)} images from {args.images}, threads={args.threads}, conf={args.conf}")
+    rows, reference, failed = [], None, False
+    for config in args.configs:
+        row, result = run(config, images, args)
+        if reference is None:
+            reference = result
+            row["vs"] = "reference"
+        else:
+            row.update(agreement(reference, result))
+            failed |= row["recall"] < args.min_recall
+        rows.append(row)
+        print(json.dumps(row))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(rows, f, indent=1)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--configs", nargs="+", default=["torch", "onnx:yolov8x.pt:none", "onnx"],
+                    help="backend[:model[:quantize]], the first is the reference")
+    ap.add_argument("--images", default=DEFAULT_IMAGES)
+    ap.add_argument("--calibration", default=None, help="INT8 calibration images (default: --images)")
+    ap.add_argument("--model", default="yolov8x.pt")
+    ap.add_argument("--quantize", default="static")
+    ap.add_argument("--threads", type=int, default=os.cpu_count())
+    ap.add_argument("--conf", type=float, default=0.25)
+    ap.add_argument("--repeat", type=int, default=10)
+    ap.add_argument("--batch", type=int, default=8)
+    ap.add_argument("--min-recall", type=float, default=0.0, help="exit 1 below this vs the reference")
+    ap.add_argument("--out", help="write the rows as JSON")
+    args = ap.parse_args()
+    args.calibration = args.calibration or args.images
+    sys.exit(main(args))
@@ -0,0 +1,168 @@
+# bench/explain_check.py
+# Query-plan regression check for the per-user reads. Runs the real CRUD
+# functions and the weekly analytics job (dry run) against a small seeded
+# database, captures every SELECT they send, EXPLAINs it, and fails
+# (exit 1) when
+#   - a watched table is read by a full table scan, or
+#   - an expected index lookup is missing, e.g. today's meals must be an
+#     (user_id, time_of_meal) range, not user_id plus a per-row date().
+# On Postgres seq scans are disabled for the check, so tiny tables still
+# show which index the planner *can* use.
+#
+#   python -m bench.explain_check                       # throwaway SQLite
+#   DATABASE_URL=postgresql+asyncpg://... python -m bench.explain_check
+import asyncio
+import datetime as dt
+import os
+import sys
+import uuid
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:////tmp/explain_check.db")
+
+from sqlalchemy import event, insert, text  # noqa: E402
+from database.config import engine, Base, async_session  # noqa: E402
+from database.models import FoodItem, UserMeal, SavedMeal, DailyTotal  # noqa: E402
+from database.crud import (get_today_meals, get_today_totals, get_progress,  # noqa: E402
+                           get_meals_page, get_saved_meals, get_weekly_analytics)
+from workers.analytics import refresh_weekly_analytics  # noqa: E402
+from utils import get_zone  # noqa: E402
+
+WATCHED = ("user_meals", "saved_meals", "daily_totals", "weekly_analytics")
+USER = "user-1"
+BERLIN = get_zone("Europe/Berlin")
+
+
+async def seed():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    food_id = uuid.uuid4()
+    now = dt.datetime.utcnow()
+    async with async_session() as db:
+        await db.execute(insert(FoodItem), [{"id": food_id, "name": "rice", "calories": 130,
+                                             "protein": 2.7, "carbs": 28, "fats": 0.3}])
+        meals = [{"id": uuid.uuid4(), "user_id": f"user-{u}", "food_id": food_id,
+                  "weight_in_grams": 100, "total_calories": 130, "total_protein": 2.7,
+                  "total_carbs": 28, "total_fats": 0.3, "time_of_meal": now - dt.timedelta(hours=h)}
+                 for u in range(20) for h in range(0, 24 * 10, 5)]
+        await db.execute(insert(UserMeal), meals)
+        days = {}
+        for m in meals:
+            key = (m["user_id"], m["time_of_meal"].date())
+            days[key] = days.get(key, 0) + 1
+        await db.execute(insert(DailyTotal), [{
+            "user_id": u, "date": d, "total_calories": 130 * n, "total_protein": 2.7 * n,
+            "total_carbs": 28 * n, "total_fats": 0.3 * n, "meal_count": n} for (u, d), n in days.items()])
+        await db.execute(insert(SavedMeal), [{"id": uuid.uuid4(), "user_id": f"user-{u}", "meal_name": "lunch",
+                                              "list_of_food_ids": [{"food_id": str(food_id), "grams": 100}]}
+                                             for u in range(20)])
+        await db.commit()
+    await refresh_weekly_analytics()
+
+
+async def second_page(db):
+    _, cursor = await get_meals_page(db, USER, 5)
+    return await get_meals_page(db, USER, 5, cursor)
+
+
+# (label, call, [(table, index or None for any, columns the lookup must use)])
+CHECKS = [
+    ("get_today_meals", lambda db: get_today_meals(db, USER),
+     [("user_meals", "ix_user_meals_user_time", ("user_id", "time_of_meal"))]),
+    ("get_today_meals tz", lambda db: get_today_meals(db, USER, BERLIN),
+     [("user_meals", "ix_user_meals_user_time", ("user_id", "time_of_meal"))]),
+    ("get_today_totals tz", lambda db: get_today_totals(db, USER, BERLIN),
+     [("user_meals", "ix_user_meals_user_time", ("user_id", "time_of_meal"))]),
+    ("get_progress", lambda db: get_progress(db, USER, 30),
+     [("daily_totals", None, ("user_id", "date"))]),
+    ("get_progress tz", lambda db: get_progress(db, USER, 30, BERLIN),
+     [("user_meals", "ix_user_meals_user_time", ("user_id", "time_of_meal"))]),
+    ("get_meals_page", second_page,
+     [("user_meals", "ix_user_meals_user_time", ("user_id",))]),
+    ("get_saved_meals", lambda db: get_saved_meals(db, USER),
+     [("saved_meals", "ix_saved_meals_user_created", ("user_id",))]),
+    ("get_weekly_analytics", lambda db: get_weekly_analytics(db, USER),
+     [("weekly_analytics", "uq_weekly_analytics_user_date", ("user_id",))]),
+    ("refresh_weekly_analytics", lambda db: refresh_weekly_analytics(dry_run=True, chunk_users=7),
+     [("daily_totals", None, ("user_id", "date")),
+      ("weekly_analytics", "uq_weekly_analytics_user_date", ("user_id",))]),
+]
+
+
+async def explain(statements) -> list[list[str]]:
+    # one list of plan nodes per statement
+    plans = []
+    async with engine.connect() as conn:
+        sqlite = conn.dialect.name == "sqlite"
+        if not sqlite:
+            await conn.execute(text("SET enable_seqscan = off"))
+        for statement, params in statements:
+            prefix = "EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN "
+            rows = (await conn.exec_driver_sql(prefix + statement, params)).all()
+            if sqlite:
+                plans.append([r[-1] for r in rows])
+            else:
+                plan = "\n".join(r[0] for r in rows)
+                plans.append(plan.split("->"))
+        await conn.rollback()
+    return plans
+
+
+def full_scans(node: str) -> list[str]:
+    node = node.strip()
+    return [t for t in WATCHED
+            if (node.startswith(f"SCAN {t}") and "USING" not in node) or f"Seq Scan on {t}" in node]
+
+
+def index_condition(node: str, table: str, index: str | None) -> str | None:
+    # the lookup condition of an index search on `table`, else None
+    node = node.strip()
+    if node.startswith(f"SEARCH {table} "):          # SQLite
+        if index and index not in node:
+            return None
+        return node[node.find("("):]
+    if "Index Cond:" in node:                           # Postgres
+        head = node.split("\n", 1)[0]
+        if (index and index not in head) or (not index and table not in head):
+            return None
+        return node.split("Index Cond:", 1)[1]
+    return None
+
+
+async def main() -> int:
+    await seed()
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    failures = 0
+    for label, call, expected in CHECKS:
+        captured.clear()
+        event.listen(engine.sync_engine, "before_cursor_execute", capture)
+        try:
+            async with async_session() as db:
+                await call(db)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", capture)
+        plans = await explain(list(captured))
+        problems = []
+        for (statement, _), plan in zip(captured, plans):
+            for node in plan:
+                for table in full_scans(node):
+                    problems.append(f"full scan of {table}: {node.strip()}")
+        for table, index, cols in expected:
+            conds = [c for plan in plans for node in plan
+                     if (c := index_condition(node, table, index)) is not None]
+            if not any(all(col in c for col in cols) for c in conds):
+                problems.append(f"no {index or 'index'} lookup on {table} using {', '.join(cols)}")
+        print(f"{'ok  ' if not problems else 'FAIL'} {label}  ({len(captured)} statements)")
+        for p in problems:
+            print(f"     {p}")
+        failures += bool(problems)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
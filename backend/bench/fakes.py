@@ -0,0 +1,130 @@
+# bench/fakes.py
+# In-process stand-ins for the services the API talks to, so benches run
+# without a Redis server: MemoryRedis covers the redis.asyncio calls the
+# backend makes (get/set/mget/incr/delete with expiry, sadd/smembers,
+# pipelines, publish, channel and pattern subscriptions).
+import asyncio
+import fnmatch
+import time
+
+
+class MemoryRedis:
+    def __init__(self):
+        self.data: dict[str, tuple[float | None, str]] = {}   # key -> (expires, value)
+        self.subscribers: list["MemoryPubSub"] = []
+
+    async def get(self, key: str):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value, ex: int | None = None, nx: bool = False):
+        if nx and await self.get(key) is not None:
+            return None
+        self.data[key] = (time.monotonic() + ex if ex else None, value)
+        return True
+
+    async def delete(self, *keys) -> int:
+        return sum(self.data.pop(k, None) is not None for k in keys)
+
+    async def mget(self, *keys):
+        return [await self.get(k) for k in keys]
+
+    async def incr(self, key: str) -> int:
+        current = await self.get(key)   # drops it if expired
+        expires = self.data[key][0] if current is not None else None
+        value = int(current or 0) + 1
+        self.data[key] = (expires, str(value))
+        return value
+
+    async def sadd(self, key: str, *members) -> int:
+        current = await self.get(key) or set()
+        added = {m.encode() if isinstance(m, str) else m for m in members} - current
+        self.data[key] = (self.data[key][0] if key in self.data else None, current | added)
+        return len(added)
+
+    async def smembers(self, key: str) -> set:
+        return set(await self.get(key) or ())
+
+    async def expire(self, key: str, seconds: int) -> bool:
+        if key not in self.data:
+            return False
+        self.data[key] = (time.monotonic() + seconds, self.data[key][1])
+        return True
+
+    def pipeline(self, transaction: bool = True):
+        return MemoryPipeline(self)
+
+    async def publish(self, channel: str, message: str) -> int:
+        return sum(sub.deliver(channel, message) for sub in list(self.subscribers))
+
+    def pubsub(self):
+        return MemoryPubSub(self)
+
+
+class MemoryPipeline:
+    # queues calls, runs them in order on execute()
+    def __init__(self, redis: MemoryRedis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+        return lambda *args, **kwargs: self.calls.append((method, args, kwargs)) or self
+
+    async def execute(self):
+        calls, self.calls = self.calls, []
+        return [await method(*args, **kwargs) for method, args, kwargs in calls]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.calls = []
+
+
+class MemoryPubSub:
+    def __init__(self, redis: MemoryRedis):
+        self.redis = redis
+        self.channels: set[str] = set()
+        self.patterns: set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+        self._attach()
+
+    async def psubscribe(self, pattern: str):
+        self.patterns.add(pattern)
+        self._attach()
+
+    def _attach(self):
+        if self not in self.redis.subscribers:
+            self.redis.subscribers.append(self)
+
+    def deliver(self, channel: str, message: str) -> int:
+        n = 0
+        if channel in self.channels:
+            self.queue.put_nowait({"type": "message", "channel": channel, "data": message})
+            n += 1
+        for pattern in self.patterns:
+            if fnmatch.fnmatchcase(channel, pattern):
+                self.queue.put_nowait({"type": "pmessage", "pattern": pattern,
+                                       "channel": channel, "data": message})
+                n += 1
+        return n
+
+    async def listen(self):
+        while True:
+            yield await self.queue.get()
+
+    async def reset(self):
+        if self in self.redis.subscribers:
+            self.redis.subscribers.remove(self)
+        self.channels.clear()
+        self.patterns.clear()
@@ -0,0 +1,93 @@
+# bench/history_bench.py
+# One power user's multi-year meal history: OFFSET paging vs the keyset
+# pages behind GET /meals, and peak Python memory of GET /meals/export's
+# streamed chunks vs loading every row first.
+# Defaults to a throwaway SQLite file; point DATABASE_URL at Postgres to
+# run the same schema there.
+#
+#   python -m bench.history_bench --meals 500000
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+import uuid
+import datetime as dt
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:////tmp/history_bench.db")
+
+from sqlalchemy import insert  # noqa: E402
+from database.config import engine, Base, async_session  # noqa: E402
+from database.models import FoodItem, UserMeal  # noqa: E402
+from database.crud import meal_rows, get_meals_page  # noqa: E402
+from main import _export_chunks  # noqa: E402
+
+USER = "power-user"
+
+
+async def seed(meals: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    food_id = uuid.uuid4()
+    start = dt.datetime.utcnow() - dt.timedelta(days=5 * 365)
+    async with async_session() as db:
+        await db.execute(insert(FoodItem), [{"id": food_id, "name": "rice", "calories": 130,
+                                             "protein": 2.7, "carbs": 28, "fats": 0.3}])
+        for lo in range(0, meals, 50_000):
+            await db.execute(insert(UserMeal), [{
+                "id": uuid.uuid4(), "user_id": USER, "food_id": food_id, "weight_in_grams": 100,
+                "total_calories": 130, "total_protein": 2.7, "total_carbs": 28, "total_fats": 0.3,
+                "time_of_meal": start + dt.timedelta(minutes=5 * i),
+            } for i in range(lo, min(lo + 50_000, meals))])
+        await db.commit()
+
+
+async def paging(meals: int, limit: int = 50):
+    async with async_session() as db:
+        for depth in (0, meals // 2, meals - limit):
+            t = time.perf_counter()
+            await db.execute(meal_rows(USER).offset(depth).limit(limit))
+            t_offset = time.perf_counter() - t
+            # keyset: the cursor of the row just before `depth`
+            cursor = None
+            if depth:
+                _, cursor = await get_meals_page(db, USER, depth)
+            t = time.perf_counter()
+            await get_meals_page(db, USER, limit, cursor)
+            t_keyset = time.perf_counter() - t
+            print(f"page at row {depth:>8}: OFFSET {t_offset * 1000:8.1f} ms   keyset {t_keyset * 1000:6.1f} ms")
+
+
+async def export():
+    tracemalloc.start()
+    t = time.perf_counter()
+    size = 0
+    async for chunk in _export_chunks(USER, "csv"):
+        size += len(chunk)
+    t_stream = time.perf_counter() - t
+    _, peak_stream = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    t = time.perf_counter()
+    async with async_session() as db:
+        rows = (await db.execute(meal_rows(USER))).all()
+    t_all = time.perf_counter() - t
+    _, peak_all = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"export streamed  {size / 1e6:7.1f} MB csv in {t_stream:5.1f}s, peak {peak_stream / 1e6:6.1f} MB")
+    print(f"load all rows    {len(rows):>10} rows in {t_all:5.1f}s, peak {peak_all / 1e6:6.1f} MB")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--meals", type=int, default=500_000)
+    args = ap.parse_args()
+    t = time.perf_counter()
+    await seed(args.meals)
+    print(f"seeded {args.meals} meals in {time.perf_counter() - t:.1f}s")
+    await paging(args.meals)
+    await export()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
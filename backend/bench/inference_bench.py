@@ -0,0 +1,67 @@
+# bench/inference_bench.py
+# Throughput / latency of the micro-batching scan pool for max_batch 1..16.
+# Uses the SCANNER_BACKEND / SCANNER_MODEL detector (YOLO on PyTorch by
+# default, SCANNER_FAKE_MODEL=1 for the stand-in), e.g.
+#
+#   SCANNER_FAKE_MODEL=1 SCANNER_FAKE_LATENCY_MS=40 python -m bench.inference_bench
+#   python -m bench.inference_bench --image ../frontendfinal/src/download.jpg
+#   SCANNER_BACKEND=onnx SCANNER_MODEL=yolov8s.pt python -m bench.inference_bench
+import argparse
+import asyncio
+import os
+import time
+from ml import scanner
+from ml.inference import InferencePool, InferenceBusy
+from ml.preprocess import decode_image
+
+
+async def drive(pool: InferencePool, payload: bytes, clients: int, requests: int):
+    lat, rejected = [], 0
+
+    async def client(n):
+        nonlocal rejected
+        for _ in range(n):
+            t = time.perf_counter()
+            try:
+                await pool.submit(payload)
+                lat.append(time.perf_counter() - t)
+            except InferenceBusy:
+                rejected += 1
+
+    t = time.perf_counter()
+    await asyncio.gather(*(client(requests // clients) for _ in range(clients)))
+    wall = time.perf_counter() - t
+    lat.sort()
+    pick = lambda p: round(lat[min(len(lat) - 1, int(len(lat) * p))] * 1000, 1)
+    return {"req_s": round(len(lat) / wall, 1), "p50_ms": pick(0.5),
+            "p99_ms": pick(0.99), "rejected": rejected}
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--image", default=os.path.join(
+        os.path.dirname(__file__), "..", "..", "frontendfinal", "src", "download.jpg"))
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--requests", type=int, default=256)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--threads", type=int, default=os.cpu_count())
+    ap.add_argument("--max-wait-ms", type=float, default=10)
+    args = ap.parse_args()
+    with open(args.image, "rb") as f:
+        payload = decode_image(f.read())
+
+    print(f"backend={scanner.BACKEND} model={scanner.MODEL_NAME} "
+          f"workers={args.workers} clients={args.clients}")
+    for max_batch in (1, 2, 4, 8, 16):
+        pool = InferencePool(scanner.scan_batch, initializer=scanner.init_worker,
+                             initargs=(args.threads,), workers=args.workers,
+                             max_batch=max_batch, max_wait_ms=args.max_wait_ms,
+                             max_queue=args.clients * 2)
+        await pool.start()
+        await pool.submit(payload)   # warm-up: spawn + weight load
+        print(f"batch={max_batch:>2}", await drive(pool, payload, args.clients, args.requests))
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+# bench/ingest_bench.py
+# Catalog import throughput: writes an OpenFoodFacts-style CSV of --rows
+# foods (some repeated barcodes, some invalid rows), imports it into an
+# empty food_items, then imports it again (unchanged rows are not
+# written). Prints rows/s, rejects and peak RSS; run with a larger --rows
+# to see memory stay flat.
+# Defaults to a throwaway SQLite file; point DATABASE_URL at Postgres to
+# run the same schema there.
+#
+#   python -m bench.ingest_bench --rows 200000
+import argparse
+import asyncio
+import gzip
+import os
+import random
+import resource
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:////tmp/ingest_bench.db")
+
+from database.config import engine, Base  # noqa: E402
+from database.ingest import ingest, read_records, text_stream  # noqa: E402
+
+WORDS = ("oat", "milk", "greek", "yogurt", "chicken", "rice", "bean", "lentil", "tofu", "apple",
+         "banana", "bread", "whole", "wheat", "cheddar", "salmon", "almond", "butter", "pasta", "kale")
+
+
+def write_csv(path: str, rows: int, rng: random.Random):
+    with gzip.open(path, "wt", newline="") as f:
+        f.write("code,product_name,energy-kcal_100g,proteins_100g,carbohydrates_100g,fat_100g,ingredients_text\n")
+        for i in range(rows):
+            r = rng.random()
+            code = "" if r < 0.1 else str(rng.randrange(i + 1)) if r < 0.11 else str(i)   # some repeats
+            name = " ".join(rng.sample(WORDS, 3)) + f" {i}"
+            p, c, fat = rng.uniform(0, 30), rng.uniform(0, 70), rng.uniform(0, 30)
+            kcal = 4 * p + 4 * c + 9 * fat
+            if rng.random() < 0.01:
+                kcal = "n/a"   # rejected
+            f.write(f'{code},"{name}",{kcal},{p:.1f},{c:.1f},{fat:.1f},"{"water, salt, " * 20}"\n')
+
+
+async def run(path: str, batch: int):
+    with open(path, "rb") as f:
+        stats = await ingest(read_records(text_stream(f, path), "csv"), batch)
+    stats.pop("reject_samples")
+    print(f"{stats['rows_per_s']:>8} rows/s  {stats}")
+
+
+async def main(args):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    path = "/tmp/ingest_bench.csv.gz"
+    t = time.perf_counter()
+    write_csv(path, args.rows, random.Random(0))
+    print(f"wrote {args.rows} rows ({os.path.getsize(path) / 1e6:.1f} MB gzipped) "
+          f"in {time.perf_counter() - t:.1f}s")
+    print("first import (inserts):")
+    await run(path, args.batch)
+    print("second import (unchanged):")
+    await run(path, args.batch)
+    print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--batch", type=int, default=2000)
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,75 @@
+# bench/neighbors_bench.py
+# KD-tree recommendations over a synthetic catalog: build time, then
+# similar() and fill_gap() latency on the built trees, with a delta of
+# foods added and edited after the build, and after a background rebuild.
+#
+#   python -m bench.neighbors_bench --foods 1000000
+import argparse
+import time
+import uuid
+import numpy as np
+from nutrition.matrix import CatalogMatrix
+from nutrition.neighbors import FoodRecommender, REBUILD_AFTER
+from bench.planner_bench import fake_catalog
+
+
+def timed(fn, args_list) -> np.ndarray:
+    out = []
+    for args in args_list:
+        t = time.perf_counter()
+        fn(*args)
+        out.append(time.perf_counter() - t)
+    return np.array(out) * 1e6
+
+
+def report(label: str, us: np.ndarray):
+    print(f"{label:28s} p50 {np.percentile(us, 50):7.1f} us  p99 {np.percentile(us, 99):7.1f} us")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--foods", type=int, default=1_000_000)
+    ap.add_argument("--queries", type=int, default=2000)
+    args = ap.parse_args()
+    rng = np.random.default_rng(0)
+    foods = fake_catalog(args.foods, rng)
+    matrix = CatalogMatrix()
+    matrix.load(foods)
+    rec = FoodRecommender(matrix)
+    t = time.perf_counter()
+    rec.build()
+    print(f"{args.foods} foods, trees built in {time.perf_counter() - t:.2f}s")
+
+    def run(label: str):
+        ids = [(foods[i]["id"],) for i in rng.integers(0, len(foods), args.queries)]
+        gaps = [(rng.uniform(0, 1, 4) * [1200, 90, 140, 40],) for _ in range(args.queries)]
+        report(f"similar k=10 {label}", timed(rec.similar, ids))
+        report(f"fill_gap k=5 {label}", timed(rec.fill_gap, gaps))
+
+    run("(built)")
+
+    # a delta just under the rebuild threshold: new foods plus edits
+    extra = fake_catalog(REBUILD_AFTER // 2, rng)
+    for f in extra:
+        f["id"] = uuid.uuid4()
+        matrix.add(f)
+        foods.append(f)
+    for i in rng.integers(0, args.foods, REBUILD_AFTER // 2 - 1).tolist():
+        f = dict(foods[i], protein=foods[i]["protein"] + 1)
+        matrix.add(f)
+        rec.mark_edited(matrix.row_of(f["id"]))
+    print(f"delta {rec.stats()['delta_rows']} rows")
+    run("(delta)")
+
+    for f in fake_catalog(16, rng):
+        matrix.add(f)
+        foods.append(f)
+    rec.fill_gap([500, 30, 60, 10])   # crosses the threshold, starts a rebuild
+    t = time.perf_counter()
+    rec._builder.join()
+    print(f"background rebuild {time.perf_counter() - t:.2f}s, now {rec.stats()}")
+    run("(rebuilt)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# bench/nutrition_bench.py
+# 1M profiles: the old per-request /nutrition arithmetic (one Python call
+# per profile) vs nutrition.engine.compute_targets on columns, plus the
+# object-list wrapper used by /nutrition/batch.
+#
+#   python -m bench.nutrition_bench --profiles 1000000
+import argparse
+import time
+from types import SimpleNamespace
+import numpy as np
+from nutrition.engine import compute_targets, nutrition_targets
+
+
+def per_request(user) -> dict:
+    # the pre-engine /nutrition handler body
+    h = user.height / 100
+    bmi = round(user.weight / (h**2), 2)
+    if user.gender == "male":
+        bmr = 10*user.weight + 6.25*user.height - 5*user.age + 5
+    else:
+        bmr = 10*user.weight + 6.25*user.height - 5*user.age - 161
+    multiplier = {"low": 1.2, "medium": 1.55, "high": 1.9}
+    calories = round(bmr * multiplier.get(user.activity, 1.2))
+    if user.goal == "weight_loss":
+        calories -= 400
+    elif user.goal == "muscle_gain":
+        calories += 400
+    return {"bmi": bmi, "bmr": round(bmr), "daily_calories": calories}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--profiles", type=int, default=1_000_000)
+    args = ap.parse_args()
+    n = args.profiles
+    rng = np.random.default_rng(0)
+    cols = {
+        "age": rng.integers(18, 80, n),
+        "height": rng.uniform(150, 200, n).round(1),
+        "weight": rng.uniform(45, 130, n).round(1),
+        "gender": rng.choice(["male", "female"], n),
+        "activity": rng.choice(["low", "medium", "high"], n),
+        "goal": rng.choice(["weight_loss", "muscle_gain", "maintain"], n),
+    }
+    profiles = [SimpleNamespace(**dict(zip(cols, row)))
+                for row in zip(*(c.tolist() for c in cols.values()))]
+
+    t = time.perf_counter()
+    old = [per_request(p) for p in profiles]
+    t_old = time.perf_counter() - t
+
+    t = time.perf_counter()
+    new = compute_targets(**cols)
+    t_cols = time.perf_counter() - t
+
+    t = time.perf_counter()
+    nutrition_targets(profiles)
+    t_objs = time.perf_counter() - t
+
+    mismatches = sum(o["daily_calories"] != new["daily_calories"][i] or o["bmr"] != new["bmr"][i]
+                     for i, o in enumerate(old))
+    print(f"{n} profiles")
+    print(f"per-request loop     {t_old:7.3f}s")
+    print(f"compute_targets      {t_cols:7.3f}s  ({t_old / t_cols:.0f}x)")
+    print(f"nutrition_targets    {t_objs:7.3f}s  (objects in, dicts out)")
+    print(f"calorie/BMR mismatches vs per-request: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# bench/offload_check.py
+# Event-loop responsiveness check: /foods latency with the API idle, then
+# again while upload clients keep the decode/CPU pools and the scanner
+# saturated with 12 MP photos. Exits 1 when the loaded p99 is more than
+# --max-factor times the idle p99 (and more than --slack-ms above it),
+# i.e. when CPU-bound work has crept back onto the event loop.
+#
+#   python -m bench.offload_check
+#   python -m bench.offload_check --uploaders 16 --seconds 10
+import argparse
+import asyncio
+import io
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:////tmp/offload_check.db")
+os.environ.setdefault("SCANNER_FAKE_MODEL", "1")
+os.environ.setdefault("SCANNER_FAKE_LATENCY_MS", "40")
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from bench.fakes import MemoryRedis  # noqa: E402
+from bench.search_bench import make_catalog, make_queries, percentiles  # noqa: E402
+from database.config import engine, Base, async_session  # noqa: E402
+from database.models import FoodItem  # noqa: E402
+import main  # noqa: E402
+
+UPLOAD_PATHS = ("/analyze", "/predict-weight", "/classify-food")
+
+
+def photo(seed: int, size=(4000, 3000)) -> bytes:
+    # smooth gradients plus noise: a realistic JPEG size for 12 MP
+    h = np.random.default_rng(seed)
+    small = h.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    img = Image.fromarray(small).resize(size, Image.BICUBIC)
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    buf = io.BytesIO()
+    Image.blend(img, noise, 0.15).save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+async def seed(foods: int, rng: random.Random):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_session() as db:
+        await db.execute(insert(FoodItem), make_catalog(foods, rng))
+        await db.commit()
+
+
+async def probe(client, queries, seconds: float, interval: float = 0.01) -> list[float]:
+    # one client on a fixed schedule, like a user typing in the search box.
+    # Latency counts from the scheduled send time, so a stalled loop that
+    # wakes the client late is measured rather than hidden
+    latencies = []
+    start = time.perf_counter()
+    for k in range(int(seconds / interval)):
+        scheduled = start + k * interval
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        r = await client.get("/foods", params={"query": random.choice(queries)})
+        r.raise_for_status()
+        latencies.append(time.perf_counter() - scheduled)
+    return latencies
+
+
+async def uploader(client, photos, stop: asyncio.Event, counts: dict):
+    i = 0
+    while not stop.is_set():
+        # drop cached results, so every upload is decoded and inferred
+        main.result_cache.clear()
+        path = UPLOAD_PATHS[i % len(UPLOAD_PATHS)]
+        r = await client.post(path, files={"file": ("photo.jpg", photos[i % len(photos)], "image/jpeg")})
+        counts[r.status_code] = counts.get(r.status_code, 0) + 1
+        i += 1
+
+
+async def run(args) -> int:
+    rng = random.Random(0)
+    main.manager.redis = main.catalog_cache.redis = None
+    main.result_cache.redis = MemoryRedis()
+    await seed(args.foods, rng)
+    photos = [photo(s) for s in range(8)]
+    print(f"{len(photos)} photos, {sum(map(len, photos)) / len(photos) / 1e6:.1f} MB each")
+    queries = make_queries(500, rng)
+
+    await main.on_start()
+    try:
+        await main.app.state.warmup_task
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://check", timeout=120) as client:
+            idle = await probe(client, queries, args.seconds)
+            stop, counts = asyncio.Event(), {}
+            uploads = [asyncio.create_task(uploader(client, photos, stop, counts))
+                       for _ in range(args.uploaders)]
+            await asyncio.sleep(1)   # let the pools fill up
+            loaded = await probe(client, queries, args.seconds)
+            stop.set()
+            await asyncio.gather(*uploads)
+            stats = (await client.get("/executors/stats")).json()["data"]
+    finally:
+        await main.on_stop()
+
+    idle_p, loaded_p = percentiles(idle), percentiles(loaded)
+    print(f"/foods idle    {idle_p}  ({len(idle)} requests)")
+    print(f"/foods loaded  {loaded_p}  ({len(loaded)} requests)")
+    print(f"uploads by status: {counts}")
+    for name, s in stats.items():
+        print(f"pool {name}: {s}")
+    limit = max(idle_p["p99_ms"] * args.max_factor, idle_p["p99_ms"] + args.slack_ms)
+    ok = loaded_p["p99_ms"] <= limit
+    print(f"{'ok  ' if ok else 'FAIL'} loaded p99 {loaded_p['p99_ms']} ms (limit {limit:.2f} ms)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--foods", type=int, default=20_000)
+    ap.add_argument("--uploaders", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=5)
+    ap.add_argument("--max-factor", type=float, default=3.0)
+    ap.add_argument("--slack-ms", type=float, default=10.0)
+    sys.exit(asyncio.run(run(ap.parse_args())))
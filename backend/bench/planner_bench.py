@@ -0,0 +1,66 @@
+# bench/planner_bench.py
+# Meal plans over a synthetic catalog: cold (uncached) plan latency for
+# random targets and exclusions, how close the plans land on target, and
+# the cached-hit cost.
+#
+#   python -m bench.planner_bench --foods 100000 --plans 200
+import argparse
+import time
+import uuid
+import numpy as np
+from nutrition.matrix import CatalogMatrix, MACROS
+from nutrition.planner import plan_meals
+
+WORDS = ["chicken", "beef", "pork", "rice", "oat", "bean", "egg", "milk", "apple",
+         "peanut", "salmon", "tofu", "bread", "pasta", "cheese", "yogurt", "potato"]
+
+
+def fake_catalog(n: int, rng) -> list[dict]:
+    protein = rng.uniform(0, 35, n)
+    carbs = rng.uniform(0, 80, n)
+    fats = rng.uniform(0, 40, n)
+    calories = 4 * protein + 4 * carbs + 9 * fats
+    names = [" ".join(rng.choice(WORDS, 2)) + f" {i}" for i in range(n)]
+    return [{"id": uuid.uuid4(), "name": names[i], "calories": float(calories[i]),
+             "protein": float(protein[i]), "carbs": float(carbs[i]), "fats": float(fats[i])}
+            for i in range(n)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--foods", type=int, default=100_000)
+    ap.add_argument("--plans", type=int, default=200)
+    args = ap.parse_args()
+    rng = np.random.default_rng(0)
+    foods = fake_catalog(args.foods, rng)
+    matrix = CatalogMatrix()
+    t = time.perf_counter()
+    matrix.load(foods)
+    print(f"{args.foods} foods, matrix built in {time.perf_counter() - t:.2f}s")
+
+    lat, err = [], []
+    for _ in range(args.plans):
+        cal = rng.uniform(1500, 3200)
+        targets = {"calories": cal, "protein": cal * 0.3 / 4,
+                   "carbs": cal * 0.45 / 4, "fats": cal * 0.25 / 9}
+        exclude_ids = [foods[i]["id"] for i in rng.integers(0, args.foods, 20)]
+        exclude_terms = list(rng.choice(WORDS, 2))
+        favorites = [foods[i]["id"] for i in rng.integers(0, args.foods, 10)]
+        t = time.perf_counter()
+        plan = plan_meals(matrix, targets, exclude_ids, exclude_terms, favorites)
+        lat.append(time.perf_counter() - t)
+        err.append(max(abs(plan["totals"][m] - targets[m]) / targets[m] for m in MACROS))
+        assert not any(term in item["name"] for item in plan["items"] for term in exclude_terms)
+
+    t = time.perf_counter()
+    plan_meals(matrix, targets, exclude_ids, exclude_terms, favorites)
+    hit = time.perf_counter() - t
+
+    ms = np.array(lat) * 1000
+    print(f"cold plan  p50 {np.percentile(ms, 50):6.1f} ms  p99 {np.percentile(ms, 99):6.1f} ms")
+    print(f"worst macro miss  p50 {np.percentile(err, 50):.1%}  p99 {np.percentile(err, 99):.1%}")
+    print(f"cached plan {hit * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
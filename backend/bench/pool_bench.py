@@ -0,0 +1,68 @@
+# bench/pool_bench.py
+# A load spike against a deliberately small pool: many concurrent
+# requests each holding a connection for a short query, sampled through
+# database.pool.pool_status to show checked-out, waiting and wait time.
+# Defaults to a throwaway SQLite file; point DATABASE_URL at Postgres to
+# run the same load there.
+#
+#   python -m bench.pool_bench --requests 500 --pool-size 5 --hold-ms 20
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:////tmp/pool_bench.db")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=500)
+    ap.add_argument("--pool-size", type=int, default=5)
+    ap.add_argument("--overflow", type=int, default=0)
+    ap.add_argument("--hold-ms", type=float, default=20)
+    args = ap.parse_args()
+    # the engine reads these at import
+    os.environ["DB_POOL_SIZE"] = str(args.pool_size)
+    os.environ["DB_MAX_OVERFLOW"] = str(args.overflow)
+    os.environ.setdefault("DB_POOL_TIMEOUT", "60")
+    return args
+
+
+async def main(args):
+    from sqlalchemy import text
+    from database.config import engine, read_session
+    from database.pool import pool_status
+
+    async def request():
+        t = time.perf_counter()
+        async with read_session() as db:
+            await db.execute(text("SELECT 1"))
+            await asyncio.sleep(args.hold_ms / 1000)   # a slow query holding the connection
+        return time.perf_counter() - t
+
+    peak = {"waiting": 0, "checked_out": 0}
+
+    async def sample():
+        while True:
+            st = pool_status(engine.pool)
+            for k in peak:
+                peak[k] = max(peak[k], st[k])
+            await asyncio.sleep(0.005)
+
+    sampler = asyncio.create_task(sample())
+    t = time.perf_counter()
+    lat = sorted(await asyncio.gather(*(request() for _ in range(args.requests))))
+    wall = time.perf_counter() - t
+    sampler.cancel()
+    st = pool_status(engine.pool)
+    print(f"{args.requests} requests, pool {args.pool_size}+{args.overflow}, hold {args.hold_ms} ms: {wall:.2f}s")
+    print(f"latency p50 {lat[len(lat) // 2] * 1000:.0f} ms  p99 {lat[int(len(lat) * 0.99)] * 1000:.0f} ms")
+    print(f"peak checked out {peak['checked_out']}  peak waiting {peak['waiting']}")
+    print(f"acquire wait avg {st['avg_wait_ms']} ms  max {st['max_wait_ms']} ms  "
+          f"slow {st['slow_acquires']}  timeouts {st['timeouts']}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
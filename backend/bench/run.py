@@ -0,0 +1,386 @@
+# bench/run.py
+# End-to-end benchmark of the API, in process and self-contained: SQLite
+# (aiosqlite), bench.fakes.MemoryRedis in place of Redis and the fake
+# scanner model. Seeds a synthetic catalog and meal history, then drives
+# each scenario with concurrent clients through the ASGI app (httpx for
+# HTTP, raw ASGI messages for the websocket). Reports req/s and
+# p50/p95/p99, writes the results as JSON and, given a baseline, exits 1
+# when a scenario got slower than --threshold allows.
+#
+#   python -m bench.run                                   # default scale, all scenarios
+#   python -m bench.run --foods 100000 --users 1000 --days 90 --out /tmp/bench.json
+#   python -m bench.run --save-baseline bench-baseline.json
+#   python -m bench.run --baseline bench-baseline.json --threshold 0.25
+#   python -m bench.run --only foods,analyze --concurrency 32
+#
+# Baselines are machine-specific: record and compare on the same host.
+import argparse
+import asyncio
+import datetime as dt
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:////tmp/bench_run.db")
+os.environ.setdefault("SCANNER_FAKE_MODEL", "1")
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+import backfill_daily_totals  # noqa: E402
+from bench.fakes import MemoryRedis  # noqa: E402
+from bench.search_bench import make_catalog, make_queries, percentiles  # noqa: E402
+from database.config import engine, Base, async_session  # noqa: E402
+from database.models import FoodItem, UserMeal  # noqa: E402
+from workers.analytics import refresh_weekly_analytics  # noqa: E402
+import main  # noqa: E402
+
+SEED_CHUNK = 5000
+WS_TIMEOUT = 5.0
+JOB_POLL_S = 0.005
+JOB_TIMEOUT = 60.0
+
+
+# ---------- DATA ----------
+
+async def seed(args, rng: random.Random) -> list[uuid.UUID]:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    catalog = make_catalog(args.foods, rng)
+    for i, food in enumerate(catalog):
+        food.update(protein=round(rng.uniform(0, 30), 1), carbs=round(rng.uniform(0, 70), 1),
+                    fats=round(rng.uniform(0, 30), 1), barcode=f"{i:013d}")
+        food["calories"] = round(4 * (food["protein"] + food["carbs"]) + 9 * food["fats"], 1)
+    food_ids = [f["id"] for f in catalog]
+
+    now = dt.datetime.utcnow()
+    meals = []
+    for u in range(args.users):
+        for day in range(args.days):
+            for m in range(args.meals_per_day):
+                food = catalog[rng.randrange(len(catalog))]
+                grams = rng.choice((50, 100, 150, 250))
+                meals.append({
+                    "id": uuid.uuid4(), "user_id": f"user-{u}", "food_id": food["id"],
+                    "weight_in_grams": grams, "time_of_meal": now - dt.timedelta(days=day, hours=4 * m),
+                    **{f"total_{k}": food[k] * grams / 100 for k in ("calories", "protein", "carbs", "fats")}})
+
+    async with async_session() as db:
+        for rows in (catalog, meals):
+            model = FoodItem if rows is catalog else UserMeal
+            for i in range(0, len(rows), SEED_CHUNK):
+                await db.execute(insert(model), rows[i:i + SEED_CHUNK])
+        await db.commit()
+    await backfill_daily_totals.go(None)
+    await refresh_weekly_analytics()
+    return food_ids
+
+
+def make_image(rng: random.Random, size=(640, 480)) -> bytes:
+    # a distinct photo-sized JPEG per request, so the image endpoints run
+    # decode and inference instead of answering from the result cache
+    h = np.random.default_rng(rng.randrange(2 ** 32))
+    base = h.integers(0, 256, 3, dtype=np.uint8)
+    pixels = np.clip(base + h.normal(0, 40, (size[1] // 8, size[0] // 8, 3)), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).resize(size).save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+# ---------- SCENARIOS ----------
+# each builds one request (method, url, httpx kwargs); payloads are built
+# before the clock starts
+
+class Context:
+    def __init__(self, args, rng: random.Random, food_ids: list):
+        self.rng = rng
+        self.food_ids = food_ids
+        self.users = [f"user-{u}" for u in range(args.users)]
+        self.queries = make_queries(1000, rng)
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def food(self):
+        return str(self.rng.choice(self.food_ids))
+
+    def upload(self):
+        return {"files": {"file": ("meal.jpg", make_image(self.rng), "image/jpeg")}}
+
+
+SCENARIOS = {
+    "foods": lambda c: ("GET", "/foods", {"params": {"query": c.rng.choice(c.queries)}}),
+    "log_meal": lambda c: ("POST", "/log-meal", {"json": {"user_id": c.user(), "food_id": c.food(),
+                                                          "weight": 150}}),
+    "meal_today": lambda c: ("GET", "/meal/today", {"params": {"user_id": c.user()}}),
+    "progress": lambda c: ("GET", "/progress", {"params": {"user_id": c.user(), "days": 30}}),
+    "weekly_analytics": lambda c: ("GET", "/weekly-analytics", {"params": {"user_id": c.user()}}),
+    "ai_suggest": lambda c: ("GET", "/ai/suggest", {"params": {"user_id": c.user()}}),
+    "analyze": lambda c: ("POST", "/analyze", c.upload()),
+    "analyze_full": lambda c: ("POST", "/analyze/full", c.upload()),
+    "predict_weight": lambda c: ("POST", "/predict-weight", c.upload()),
+    "classify_food": lambda c: ("POST", "/classify-food", c.upload()),
+}
+
+
+def summarize(latencies: list[float], wall: float, requests: int, errors: int) -> dict:
+    out = {"requests": requests, "errors": errors,
+           "req_s": round(len(latencies) / wall, 1) if wall else 0.0}
+    out.update(percentiles(latencies) if latencies else {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0})
+    return out
+
+
+async def drive(client: httpx.AsyncClient, requests: list, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    pending = iter(requests)
+
+    async def worker():
+        nonlocal errors
+        for method, url, kwargs in pending:
+            t = time.perf_counter()
+            r = await client.request(method, url, **kwargs)
+            if r.status_code < 400:
+                latencies.append(time.perf_counter() - t)
+            else:
+                errors += 1
+
+    t = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - t, len(requests), errors)
+
+
+class AsgiWebSocket:
+    # a websocket client speaking ASGI messages straight to the app
+    def __init__(self, app, path: str):
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        scope = {"type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws",
+                 "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+                 "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0),
+                 "server": ("bench", 80), "subprotocols": []}
+        self.task = asyncio.create_task(app(scope, self.inbox.get, self.outbox.put))
+
+    async def connect(self):
+        self.inbox.put_nowait({"type": "websocket.connect"})
+        msg = await asyncio.wait_for(self.outbox.get(), WS_TIMEOUT)
+        if msg["type"] != "websocket.accept":
+            raise RuntimeError(f"websocket refused: {msg}")
+
+    async def receive_text(self) -> str:
+        msg = await asyncio.wait_for(self.outbox.get(), WS_TIMEOUT)
+        return msg["text"]
+
+    async def close(self):
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self.task, WS_TIMEOUT)
+
+
+async def websocket_scenario(client, ctx: Context, requests: int, concurrency: int) -> dict:
+    # one socket per client; each request logs a meal and waits for the
+    # meal_update push on that user's socket (POST -> Redis -> socket)
+    sockets = []
+    t = time.perf_counter()
+    for k in range(concurrency):
+        ws = AsgiWebSocket(main.app, f"/ws/bench-ws-{k}")
+        await ws.connect()
+        sockets.append(ws)
+    connect_ms = round((time.perf_counter() - t) / concurrency * 1000, 3)
+    latencies, errors = [], 0
+
+    async def worker(k: int, n: int):
+        nonlocal errors
+        bodies = [{"user_id": f"bench-ws-{k}", "food_id": ctx.food(), "weight": 100} for _ in range(n)]
+        for body in bodies:
+            t = time.perf_counter()
+            try:
+                r = await client.post("/log-meal", json=body)
+                r.raise_for_status()
+                await sockets[k].receive_text()
+                latencies.append(time.perf_counter() - t)
+            except (httpx.HTTPError, asyncio.TimeoutError):
+                errors += 1
+
+    share = [requests // concurrency + (k < requests % concurrency) for k in range(concurrency)]
+    t = time.perf_counter()
+    await asyncio.gather(*(worker(k, n) for k, n in enumerate(share)))
+    out = summarize(latencies, time.perf_counter() - t, requests, errors)
+    for ws in sockets:
+        await ws.close()
+    out["connect_ms"] = connect_ms
+    return out
+
+
+async def job_scenario(client, ctx: Context, requests: int, concurrency: int) -> dict:
+    # POST /analyze?mode=async, then poll GET /jobs/{id} until the job
+    # settles; each client has one job in flight, so the local queue
+    # (JOB_MAX_QUEUE) never turns a submit away. Latency is submit to result.
+    latencies, submits, errors = [], [], 0
+
+    async def worker(n: int):
+        nonlocal errors
+        uploads = [ctx.upload() for _ in range(n)]
+        for upload in uploads:
+            t = time.perf_counter()
+            try:
+                r = await client.post("/analyze", params={"mode": "async"}, **upload)
+                r.raise_for_status()
+                submits.append(time.perf_counter() - t)
+                job_id = r.json()["data"]["id"]
+                while True:
+                    r = await client.get(f"/jobs/{job_id}")
+                    r.raise_for_status()
+                    status = r.json()["data"]["status"]
+                    if status in ("done", "failed"):
+                        break
+                    if time.perf_counter() - t > JOB_TIMEOUT:
+                        raise asyncio.TimeoutError
+                    await asyncio.sleep(JOB_POLL_S)
+                if status == "done":
+                    latencies.append(time.perf_counter() - t)
+                else:
+                    errors += 1
+            except (httpx.HTTPError, asyncio.TimeoutError):
+                errors += 1
+
+    share = [requests // concurrency + (k < requests % concurrency) for k in range(concurrency)]
+    t = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in share))
+    out = summarize(latencies, time.perf_counter() - t, requests, errors)
+    out["submit_p50_ms"] = percentiles(submits)["p50_ms"] if submits else 0.0
+    return out
+
+
+CUSTOM = {"analyze_async": job_scenario, "websocket": websocket_scenario}
+
+
+async def run_scenarios(args, ctx: Context) -> dict:
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        for name in args.only:
+            if name in CUSTOM:
+                await CUSTOM[name](client, ctx, args.warmup, args.concurrency)
+                res = await CUSTOM[name](client, ctx, args.requests, args.concurrency)
+            else:
+                build = SCENARIOS[name]
+                await drive(client, [build(ctx) for _ in range(args.warmup)], args.concurrency)
+                res = await drive(client, [build(ctx) for _ in range(args.requests)], args.concurrency)
+            results[name] = res
+            print(f"{name:<18} {res['req_s']:>9.1f} req/s  p50 {res['p50_ms']:>8.2f}  "
+                  f"p95 {res['p95_ms']:>8.2f}  p99 {res['p99_ms']:>8.2f} ms  errors {res['errors']}")
+    return results
+
+
+# ---------- REPORT ----------
+
+def git_rev() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def regressions(results: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list[str]:
+    # latency counts as regressed only past both the relative threshold and
+    # an absolute floor, so sub-millisecond endpoints don't fail on jitter
+    out = []
+    for name, r in results["scenarios"].items():
+        b = baseline["scenarios"].get(name)
+        if b is None:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if r[key] > b[key] * (1 + threshold) and r[key] - b[key] > min_delta_ms:
+                out.append(f"{name}: {key} {b[key]} -> {r[key]}")
+        if r["req_s"] < b["req_s"] * (1 - threshold):
+            out.append(f"{name}: req_s {b['req_s']} -> {r['req_s']}")
+        if r["errors"] > b["errors"]:
+            out.append(f"{name}: errors {b['errors']} -> {r['errors']}")
+    return out
+
+
+async def main_async(args) -> int:
+    rng = random.Random(args.seed)
+    redis = MemoryRedis()
+    main.manager.redis = main.catalog_cache.redis = main.result_cache.redis = redis
+    main.user_cache.redis = main.job_queue.store.redis = redis
+
+    t = time.perf_counter()
+    food_ids = await seed(args, rng)
+    print(f"seeded {args.foods} foods, {args.users * args.days * args.meals_per_day} meals "
+          f"in {time.perf_counter() - t:.1f}s")
+    await main.on_start()
+    try:
+        await main.app.state.warmup_task
+        scenarios = await run_scenarios(args, Context(args, rng, food_ids))
+    finally:
+        await main.on_stop()
+
+    results = {
+        "meta": {
+            "time": dt.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "git": git_rev(),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} cpus",
+            "database": engine.dialect.name,
+            "scale": {"foods": args.foods, "users": args.users, "days": args.days,
+                      "meals_per_day": args.meals_per_day},
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": scenarios,
+    }
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {path}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    for key in ("scale", "requests", "concurrency"):
+        if baseline["meta"].get(key) != results["meta"][key]:
+            print(f"warning: baseline {key} {baseline['meta'].get(key)} != {results['meta'][key]}")
+    failed = regressions(results, baseline, args.threshold, args.min_delta_ms)
+    for line in failed:
+        print(f"REGRESSION {line}")
+    print(f"{len(failed)} regression(s) against {args.baseline} (threshold {args.threshold:.0%})")
+    return 1 if failed else 0
+
+
+def main_cli() -> int:
+    names = [*SCENARIOS, *CUSTOM]
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--foods", type=int, default=20_000)
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--meals-per-day", type=int, default=3)
+    ap.add_argument("--requests", type=int, default=500, help="per scenario")
+    ap.add_argument("--warmup", type=int, default=20, help="unmeasured requests per scenario")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--only", type=lambda s: s.split(","), default=names,
+                    help=f"comma-separated subset of: {','.join(names)}")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--save-baseline", help="write results JSON here for later --baseline runs")
+    ap.add_argument("--baseline", help="compare with this results JSON, exit 1 on regression")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown")
+    ap.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore latency changes below this")
+    args = ap.parse_args()
+    unknown = set(args.only) - set(names)
+    if unknown:
+        ap.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    return asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
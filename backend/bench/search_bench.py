@@ -0,0 +1,108 @@
+# bench/search_bench.py
+# Compare the in-process FoodSearchIndex with the ILIKE '%q%' scan that
+# crud.get_foods_by_query issues. The scan runs on SQLite so the bench is
+# self-contained; on Postgres the seq-scan cost grows the same way.
+#
+#   python -m bench.search_bench --items 500000 --queries 2000
+import argparse
+import gc
+import random
+import sqlite3
+import string
+import time
+import uuid
+from database.search import FoodSearchIndex
+
+WORDS = """chicken beef pork rice brown white apple banana greek yogurt whole
+wheat bread cheddar cheese milk skim egg omelette salad caesar grilled fried
+baked roasted tomato potato sweet soup noodle pasta penne paneer tikka masala
+dal idli dosa spinach broccoli carrot orange juice almond peanut butter oat
+granola honey salmon tuna shrimp tofu lentil bean black kidney chickpea hummus
+burger pizza pepperoni sandwich turkey ham bacon sausage mushroom onion garlic
+ginger mango strawberry blueberry chocolate vanilla cream cookie cake muffin
+bagel croissant waffle pancake syrup coffee tea latte smoothie protein bar
+chips cracker popcorn pretzel""".split()
+
+
+def make_catalog(n: int, rng: random.Random) -> list[dict]:
+    brands = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 8)))
+              for _ in range(max(10, n // 150))]
+    return [{
+        "id": uuid.uuid4(),
+        "name": " ".join(rng.sample(WORDS, rng.randint(1, 3))) + " " + rng.choice(brands),
+        "calories": 100.0, "protein": 5.0, "carbs": 10.0, "fats": 2.0,
+        "barcode": None, "image_url": None,
+    } for _ in range(n)]
+
+
+def make_queries(n: int, rng: random.Random) -> list[str]:
+    out = []
+    for _ in range(n):
+        w = rng.choice(WORDS)
+        r = rng.random()
+        if r < 0.5:        # typeahead prefix
+            out.append(w[:rng.randint(1, len(w))])
+        elif r < 0.8:      # one dropped letter
+            i = rng.randrange(len(w))
+            out.append(w[:i] + w[i + 1:])
+        else:              # two words
+            out.append(f"{w} {rng.choice(WORDS)[:3]}")
+    return out
+
+
+def percentiles(samples: list[float]) -> dict:
+    s = sorted(samples)
+    pick = lambda p: round(s[min(len(s) - 1, int(len(s) * p))] * 1000, 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def bench_index(catalog, queries):
+    idx = FoodSearchIndex()
+    t = time.perf_counter()
+    for food in catalog:
+        idx._insert(food, keep_sorted=False)
+    idx._sort()
+    idx.loaded = True
+    build = time.perf_counter() - t
+    gc.collect()
+    gc.freeze()   # the API process does the same after loading
+    lat = []
+    for q in queries:
+        t = time.perf_counter()
+        idx.search(q)
+        lat.append(time.perf_counter() - t)
+    return {"build_s": round(build, 2), **percentiles(lat)}
+
+
+def bench_ilike(catalog, queries):
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE food_items (id TEXT PRIMARY KEY, name TEXT)")
+    db.execute("CREATE INDEX ix_food_items_name ON food_items (name)")
+    db.executemany("INSERT INTO food_items VALUES (?, ?)",
+                   ((str(f["id"]), f["name"]) for f in catalog))
+    # what SQLAlchemy renders for FoodItem.name.ilike(...) on this dialect
+    sql = "SELECT id, name FROM food_items WHERE lower(name) LIKE lower(?) LIMIT 10"
+    lat = []
+    for q in queries:
+        t = time.perf_counter()
+        db.execute(sql, (f"%{q}%",)).fetchall()
+        lat.append(time.perf_counter() - t)
+    return percentiles(lat)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=500_000)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+    catalog = make_catalog(args.items, rng)
+    queries = make_queries(args.queries, rng)
+    print(f"catalog={args.items} queries={args.queries}")
+    print("index ", bench_index(catalog, queries))
+    print("ilike ", bench_ilike(catalog, queries))
+
+
+if __name__ == "__main__":
+    main()
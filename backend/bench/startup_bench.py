@@ -0,0 +1,62 @@
+# bench/startup_bench.py
+# Cold-start cost of the API: import time of `main` and the time from
+# launching uvicorn until /foods first answers 200 (needs DATABASE_URL
+# to point at a reachable database).
+#
+#   python -m bench.startup_bench --runs 5
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def import_time() -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET],
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def first_200(port: int, timeout: float) -> float:
+    url = f"http://127.0.0.1:{port}/foods?query=a"
+    t = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - t < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as r:
+                    if r.status == 200:
+                        return time.perf_counter() - t
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.02)
+        raise TimeoutError(f"/foods did not answer within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--skip-server", action="store_true")
+    args = ap.parse_args()
+
+    imports = [import_time() for _ in range(args.runs)]
+    print(f"import main: median {statistics.median(imports) * 1000:.0f} ms "
+          f"(min {min(imports) * 1000:.0f} ms)")
+    if not args.skip_server:
+        firsts = [first_200(args.port, args.timeout) for _ in range(args.runs)]
+        print(f"first 200 on /foods: median {statistics.median(firsts) * 1000:.0f} ms "
+              f"(min {min(firsts) * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
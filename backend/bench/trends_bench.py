@@ -0,0 +1,108 @@
+# bench/trends_bench.py
+# Trend store at scale: writes a synthetic year of daily totals for
+# --users users straight into a throwaway store (no database), times an
+# incremental two-day refresh, then the per-user reads behind /trends,
+# /trends/weekly and /trends/streaks on random users.
+#
+#   python -m bench.trends_bench
+#   python -m bench.trends_bench --users 100000 --queries 5000 --dir /tmp/trends_bench
+import argparse
+import datetime as dt
+import os
+import random
+import resource
+import shutil
+import time
+import numpy as np
+from nutrition.trends import TrendStore, day_number, trend_report, weekly_report, streak_report
+
+DAYS = 365
+
+
+def percentiles(samples: list[float]) -> dict:
+    p50, p95, p99 = (round(float(v) * 1000, 3) for v in np.percentile(samples, (50, 95, 99)))
+    return {"p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+
+
+def synthetic(users: list[str], last_day: int, days: int, h: np.random.Generator):
+    # each user logs ~80% of days around a personal calorie level
+    n = len(users)
+    level = h.normal(2100, 350, n)
+    logged = h.random((n, days)) < 0.8
+    cal = np.clip(level[:, None] + h.normal(0, 300, (n, days)), 600, None)
+    split = h.dirichlet((3, 5, 2), n)   # protein/carbs/fats energy shares
+    values = np.stack([cal, cal * split[:, :1] / 4, cal * split[:, 1:2] / 4, cal * split[:, 2:] / 9,
+                       h.integers(1, 6, (n, days))], axis=-1)
+    user_idx, day_idx = np.nonzero(logged)
+    return (np.asarray(users)[user_idx], last_day - days + 1 + day_idx,
+            values[user_idx, day_idx].astype(np.float32))
+
+
+def build(path: str, users: int, batch: int, h) -> tuple[list[str], float]:
+    ids = [f"user{i:07d}" for i in range(users)]
+    today = dt.datetime.utcnow().date()
+    store = TrendStore(path)
+    store.open_writer(rebuild=True)
+    t = time.perf_counter()
+    store.advance(today)
+    rows = 0
+    for lo in range(0, users, batch):
+        u, d, v = synthetic(ids[lo:lo + batch], day_number(today), DAYS, h)
+        store.put(u, d, v)
+        rows += len(u)
+    store.commit()
+    elapsed = time.perf_counter() - t
+    print(f"build: {users} users, {rows} daily rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)")
+
+    # the periodic refresh: two days re-copied for everyone active
+    t = time.perf_counter()
+    u, d, v = synthetic(ids, day_number(today), 2, h)
+    store.replace(today - dt.timedelta(days=1), today, u, d, v)
+    store.commit()
+    print(f"refresh: 2 days, {len(u)} rows in {time.perf_counter() - t:.2f}s")
+    store.close()
+    return ids, elapsed
+
+
+def query(path: str, ids: list[str], queries: int, rng: random.Random):
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    store = TrendStore(path)
+    t = time.perf_counter()
+    store.open()
+    print(f"reader open: {(time.perf_counter() - t) * 1000:.0f} ms, "
+          f"+{(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024:.0f} MB max RSS, "
+          f"store {store.stats()['size_mb']} MB on disk")
+    last = dt.datetime.utcnow().date()
+    first = last - dt.timedelta(days=DAYS - 1)
+    timings = {"series (365 d)": [], "/trends": [], "/trends/weekly": [], "/trends/streaks": []}
+    for _ in range(queries):
+        user = rng.choice(ids)
+        t0 = time.perf_counter()
+        series = store.series(user, first, last)
+        t1 = time.perf_counter()
+        trend_report(series, first, "calories", [7, 30, 90], 7)
+        t2 = time.perf_counter()
+        weekly_report(series[-52 * 7:], last, 52)
+        t3 = time.perf_counter()
+        streak_report(series, 2000, 0.1)
+        t4 = time.perf_counter()
+        timings["series (365 d)"].append(t1 - t0)
+        timings["/trends"].append(t2 - t0)
+        timings["/trends/weekly"].append(t3 - t2 + t1 - t0)
+        timings["/trends/streaks"].append(t4 - t3 + t1 - t0)
+    for name, samples in timings.items():
+        print(f"{name:18} {percentiles(samples)}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--batch", type=int, default=2000, help="users per put()")
+    ap.add_argument("--dir", default="/tmp/trends_bench")
+    args = ap.parse_args()
+    shutil.rmtree(args.dir, ignore_errors=True)
+    ids, _ = build(args.dir, args.users, args.batch, np.random.default_rng(0))
+    query(args.dir, ids, args.queries, random.Random(0))
+    if not os.environ.get("TRENDS_BENCH_KEEP"):
+        shutil.rmtree(args.dir, ignore_errors=True)
@@ -0,0 +1,102 @@
+# bench/ws_load.py
+# Load test for database.websocket.ConnectionManager: N local sockets
+# (several per user) behind an in-process Redis pub/sub stand-in. Reports
+# connect cost, per-connection memory, fan-out throughput, end-to-end
+# delivery latency and slow-consumer evictions.
+#
+#   python -m bench.ws_load --connections 10000 --per-user 4 --messages 50
+import argparse
+import asyncio
+import time
+import tracemalloc
+from database.websocket import ConnectionManager
+from bench.fakes import MemoryRedis
+
+
+class FakeSocket:
+    def __init__(self, latencies: list, delay: float = 0.0):
+        self.latencies = latencies
+        self.delay = delay
+        self.received = 0
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.latencies.append(time.perf_counter() - float(message))
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+def pct(samples, p):
+    s = sorted(samples)
+    return round(s[min(len(s) - 1, int(len(s) * p))] * 1000, 2) if s else 0.0
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--connections", type=int, default=10_000)
+    ap.add_argument("--per-user", type=int, default=4)
+    ap.add_argument("--messages", type=int, default=50, help="messages per user")
+    ap.add_argument("--slow", type=float, default=0.01, help="fraction of slow sockets")
+    ap.add_argument("--slow-delay-ms", type=float, default=250)
+    ap.add_argument("--queue-size", type=int, default=16)
+    args = ap.parse_args()
+
+    manager = ConnectionManager(MemoryRedis(), queue_size=args.queue_size)
+    latencies: list[float] = []
+    users = [f"user{i}" for i in range(args.connections // args.per_user)]
+    slow_every = int(1 / args.slow) if args.slow else 0
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    t = time.perf_counter()
+    sockets, conns = [], []
+    for i in range(args.connections):
+        slow = slow_every and i % slow_every == 0
+        ws = FakeSocket(latencies, args.slow_delay_ms / 1000 if slow else 0.0)
+        sockets.append(ws)
+        conns.append(await manager.connect(ws, users[i % len(users)]))
+    connect_s = time.perf_counter() - t
+    per_conn = (tracemalloc.get_traced_memory()[0] - before) / args.connections
+    tracemalloc.stop()
+    print(f"connected {args.connections} sockets for {len(users)} users in {connect_s:.2f}s "
+          f"(~{per_conn / 1024:.1f} KiB/connection)")
+    await asyncio.sleep(0)   # let the listener subscribe
+
+    expected = args.messages * args.connections
+    t = time.perf_counter()
+    for _ in range(args.messages):
+        for user in users:
+            await manager.send_personal(str(time.perf_counter()), user)
+        await asyncio.sleep(0)
+    publish_s = time.perf_counter() - t
+    deadline = time.perf_counter() + 30
+    fast = [ws for ws in sockets if not ws.delay]
+    while sum(ws.received for ws in fast) < args.messages * len(fast) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    total_s = time.perf_counter() - t
+
+    delivered = sum(ws.received for ws in sockets)
+    print(f"published {args.messages * len(users)} messages in {publish_s:.2f}s; "
+          f"delivered {delivered}/{expected} in {total_s:.2f}s ({delivered / total_s:,.0f} msg/s)")
+    print(f"delivery latency p50={pct(latencies, 0.5)} ms p99={pct(latencies, 0.99)} ms")
+    print(f"slow consumers evicted: {manager.evicted} "
+          f"(closed with {sorted({ws.close_code for ws in sockets if ws.close_code})})")
+    print("manager:", manager.stats())
+
+    for conn in conns:
+        await manager.disconnect(conn)
+    leftover = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    await asyncio.sleep(0)
+    print(f"after disconnect: {manager.stats()}, listener running: {manager._listener is not None}, "
+          f"pending tasks: {len([t for t in leftover if not t.done()])}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,213 @@
+# database/catalog.py
+# Read-through cache of food_items rows for id and barcode lookups
+# (log_meal, /log-meals, /barcode). Bounded LRU with TTL; every committed
+# FoodItem write invalidates the row here and, over Redis pub/sub, in
+# every other API process, which also hands the ids to on_peer_change
+# (main.py re-reads them into its search index and catalog matrix).
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from uuid import UUID
+import redis.asyncio as redis
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from .config import REDIS_URL
+from .models import FoodItem
+from .search import food_to_dict
+
+CATALOG_TTL = int(os.getenv("CATALOG_CACHE_TTL", "600"))
+CATALOG_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "50000"))
+INVALIDATE_CHANNEL = "catalog:invalidate"
+log = logging.getLogger(__name__)
+ORIGIN = uuid.uuid4().hex   # tags this process's messages, so it skips its own
+
+
+class FoodCatalogCache:
+    def __init__(self, redis_client=None, ttl: int = CATALOG_TTL, max_entries: int = CATALOG_MAX_ENTRIES):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._by_id: OrderedDict[UUID, tuple[float, dict]] = OrderedDict()   # id -> (expires, food)
+        self._by_barcode: dict[str, UUID] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.on_peer_change = None   # async fn(food ids) for another process's writes
+        self._generation = 0         # bumped by every invalidation
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0, "lookup_ns": 0, "lookups": 0}
+
+    # ---------- LOCAL ----------
+
+    def get(self, food_id) -> dict | None:
+        t = time.perf_counter_ns()
+        entry = self._by_id.get(food_id)
+        food = None
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._by_id.move_to_end(food_id)
+                food = entry[1]
+            else:
+                self._evict(food_id)
+        self.counters["hits" if food else "misses"] += 1
+        self.counters["lookups"] += 1
+        self.counters["lookup_ns"] += time.perf_counter_ns() - t
+        return food
+
+    def get_barcode(self, code: str) -> dict | None:
+        food_id = self._by_barcode.get(code)
+        if food_id is None:
+            self.counters["misses"] += 1
+            return None
+        return self.get(food_id)
+
+    def put(self, food: dict, generation: int | None = None):
+        # generation: self._generation read before the row was SELECTed;
+        # skipped if an invalidation ran since, as the row may predate it
+        if generation is not None and generation != self._generation:
+            return
+        self._evict(food["id"])
+        self._by_id[food["id"]] = (time.monotonic() + self.ttl, food)
+        if food.get("barcode"):
+            self._by_barcode[food["barcode"]] = food["id"]
+        while len(self._by_id) > self.max_entries:
+            self._evict(next(iter(self._by_id)))
+
+    def invalidate(self, food_ids=None):
+        # None drops everything
+        if food_ids is None:
+            self._by_id.clear()
+            self._by_barcode.clear()
+        else:
+            for food_id in food_ids:
+                self._evict(food_id)
+        self._generation += 1
+        self.counters["invalidations"] += 1
+
+    def _evict(self, food_id):
+        entry = self._by_id.pop(food_id, None)
+        if entry is not None and entry[1].get("barcode"):
+            self._by_barcode.pop(entry[1]["barcode"], None)
+
+    def stats(self) -> dict:
+        c = self.counters
+        total = c["hits"] + c["misses"]
+        return {
+            "entries": len(self._by_id),
+            "hits": c["hits"],
+            "misses": c["misses"],
+            "invalidations": c["invalidations"],
+            "hit_ratio": round(c["hits"] / total, 4) if total else 0.0,
+            "avg_lookup_us": round(c["lookup_ns"] / c["lookups"] / 1000, 3) if c["lookups"] else 0.0,
+        }
+
+    # ---------- READ-THROUGH ----------
+
+    async def get_many(self, db: AsyncSession, food_ids) -> dict:
+        found, missing = {}, []
+        for food_id in set(food_ids):
+            food = self.get(food_id)
+            if food:
+                found[food_id] = food
+            else:
+                missing.append(food_id)
+        if missing:
+            generation = self._generation
+            res = await db.execute(select(FoodItem).where(FoodItem.id.in_(missing)))
+            for row in res.scalars():
+                food = food_to_dict(row)
+                self.put(food, generation)
+                found[food["id"]] = food
+        return found
+
+    async def get_by_id(self, db: AsyncSession, food_id) -> dict | None:
+        return (await self.get_many(db, [food_id])).get(food_id)
+
+    async def get_by_barcode(self, db: AsyncSession, code: str) -> dict | None:
+        food = self.get_barcode(code)
+        if food is None:
+            generation = self._generation
+            row = await db.scalar(select(FoodItem).where(FoodItem.barcode == code))
+            if row is not None:
+                food = food_to_dict(row)
+                self.put(food, generation)
+        return food
+
+    # ---------- CROSS-PROCESS ----------
+
+    async def publish(self, food_ids):
+        if self.redis is None:
+            return
+        payload = json.dumps({"origin": ORIGIN,
+                              "ids": None if food_ids is None else [str(i) for i in food_ids]})
+        try:
+            await self.redis.publish(INVALIDATE_CHANNEL, payload)
+        except (redis.RedisError, OSError):
+            pass   # peers fall back to the TTL
+
+    def schedule_publish(self, food_ids):
+        task = asyncio.get_running_loop().create_task(self.publish(food_ids))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def listen(self):
+        # run once per process (startup); applies peers' invalidations
+        if self.redis is None:
+            return
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                async for msg in pubsub.listen():
+                    if msg["type"] != "message":
+                        continue
+                    try:
+                        data = json.loads(msg["data"])
+                        if data["origin"] == ORIGIN:
+                            continue
+                        ids = None if data["ids"] is None else [UUID(i) for i in data["ids"]]
+                    except (ValueError, KeyError, TypeError):
+                        log.warning("catalog: ignoring malformed invalidation %r", msg["data"])
+                        continue
+                    self.invalidate(ids)
+                    if ids and self.on_peer_change is not None:
+                        try:
+                            await self.on_peer_change(ids)
+                        except Exception:
+                            log.exception("catalog: applying %d changed foods failed", len(ids))
+            except (redis.RedisError, OSError):
+                # lost Redis: we may have missed invalidations
+                self.invalidate()
+                await asyncio.sleep(1)
+
+
+catalog_cache = FoodCatalogCache(redis.from_url(REDIS_URL, decode_responses=True))
+
+
+# invalidate on commit (not on flush), so a concurrent reader cannot
+# re-cache the pre-commit row after we dropped it
+@event.listens_for(FoodItem, "after_insert")
+@event.listens_for(FoodItem, "after_update")
+@event.listens_for(FoodItem, "after_delete")
+def _food_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_foods", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_food_changes(session):
+    changed = session.info.pop("changed_foods", None)
+    if changed:
+        catalog_cache.invalidate(changed)
+        try:
+            catalog_cache.schedule_publish(changed)
+        except RuntimeError:   # no running loop (sync scripts)
+            pass
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_food_changes(session):
+    session.info.pop("changed_foods", None)
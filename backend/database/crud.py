@@ -1,24 +1,49 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
-from .models import FoodItem, UserMeal, SavedMeal, WeeklyAnalytics
-from .schemas import MealLogIn, SavedMealIn
+from sqlalchemy import select, insert, delete, func, and_, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from .models import FoodItem, UserMeal, SavedMeal, WeeklyAnalytics, DailyTotal
+from .schemas import MealLogIn, MealItemIn, SavedMealIn, SavedMealItem
+from .catalog import catalog_cache
+from utils import UTC, is_utc, local_today, local_date, day_range
+from metrics import db_timed
+import base64
 import datetime as dt
+import uuid
+from collections import defaultdict
 
+TOTAL_COLUMNS = ("total_calories", "total_protein", "total_carbs", "total_fats")
 
+
+def dialect_insert(db: AsyncSession, model):
+    # INSERT that supports .on_conflict_do_update() on the bound dialect
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+
+@db_timed
 async def get_foods_by_query(db: AsyncSession, q: str, limit: int = 10):
     stmt = select(FoodItem).where(FoodItem.name.ilike(f"%{q}%")).limit(limit)
     res = await db.execute(stmt)
     return res.scalars().all()
 
 
+@db_timed
 async def get_food_by_id(db: AsyncSession, food_id):
     return await db.get(FoodItem, food_id)
 
+
+@db_timed
+async def get_foods_by_ids(db: AsyncSession, food_ids):
+    res = await db.execute(select(FoodItem).where(FoodItem.id.in_(list(food_ids))))
+    return res.scalars().all()
+
 # AFTER (fixed)
 
 
+@db_timed
 async def log_meal(db: AsyncSession, payload: MealLogIn) -> UserMeal:
-    food = await get_food_by_id(db, payload.food_id)
+    food = await catalog_cache.get_by_id(db, payload.food_id)
     if not food:
         raise ValueError("Food not found")
     scale = payload.weight / 100
@@ -26,36 +51,185 @@ async def log_meal(db: AsyncSession, payload: MealLogIn) -> UserMeal:
         user_id=payload.user_id,
         food_id=payload.food_id,
         weight_in_grams=payload.weight,
-        total_calories=food.calories * scale,
-        total_protein=food.protein * scale,
-        total_carbs=food.carbs * scale,
-        total_fats=food.fats * scale
+        total_calories=food["calories"] * scale,
+        total_protein=food["protein"] * scale,
+        total_carbs=food["carbs"] * scale,
+        total_fats=food["fats"] * scale,
+        time_of_meal=dt.datetime.utcnow()
     )
     db.add(meal)
+    await bump_daily_totals(db, [_daily_delta(meal, +1)])
     await db.commit()
     await db.refresh(meal)
     return meal
 
 
-async def get_today_meals(db: AsyncSession, user_id: str):
-    today = dt.date.today()
-    stmt = select(UserMeal).where(
-        and_(UserMeal.user_id == user_id, func.date(
-            UserMeal.time_of_meal) == today)
-    ).order_by(UserMeal.time_of_meal.desc())
+@db_timed
+async def log_meals(db: AsyncSession, user_id: str, items: list[MealItemIn]) -> list[dict]:
+    # foods come from the catalog cache (one IN query for any misses),
+    # then one executemany insert and one commit
+    food_ids = {i.food_id for i in items}
+    foods = await catalog_cache.get_many(db, food_ids)
+    missing = food_ids - foods.keys()
+    if missing:
+        raise ValueError(f"Food not found: {', '.join(sorted(map(str, missing)))}")
+    now = dt.datetime.utcnow()
+    rows = []
+    for item in items:
+        food = foods[item.food_id]
+        scale = item.weight / 100
+        rows.append({
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "food_id": item.food_id,
+            "weight_in_grams": item.weight,
+            "total_calories": food["calories"] * scale,
+            "total_protein": food["protein"] * scale,
+            "total_carbs": food["carbs"] * scale,
+            "total_fats": food["fats"] * scale,
+            "time_of_meal": now,
+        })
+    await db.execute(insert(UserMeal), rows)
+    delta = {c: sum(r[c] for r in rows) for c in TOTAL_COLUMNS}
+    delta.update(user_id=user_id, date=now.date(), meal_count=len(rows))
+    await bump_daily_totals(db, [delta])
+    await db.commit()
+    return rows
+
+
+@db_timed
+async def expand_saved_meal(db: AsyncSession, saved_meal_id, user_id: str) -> list[MealItemIn] | None:
+    sm = await db.get(SavedMeal, saved_meal_id)
+    if not sm or sm.user_id != user_id:
+        return None
+    # older rows say "weight"; an entry without a usable one raises
+    # ValidationError (a ValueError)
+    entries = [SavedMealItem(food_id=f.get("food_id"), grams=f.get("grams", f.get("weight")))
+               for f in sm.list_of_food_ids]
+    return [MealItemIn(food_id=e.food_id, weight=e.grams) for e in entries]
+
+
+@db_timed
+async def delete_meal(db: AsyncSession, meal_id) -> UserMeal | None:
+    meal = await db.get(UserMeal, meal_id)
+    if not meal:
+        return None
+    await db.delete(meal)
+    await bump_daily_totals(db, [_daily_delta(meal, -1)])
+    await db.commit()
+    return meal
+
+
+def _daily_delta(meal: UserMeal, sign: int) -> dict:
+    row = {c: sign * (getattr(meal, c) or 0) for c in TOTAL_COLUMNS}
+    row.update(user_id=meal.user_id, date=meal.time_of_meal.date(), meal_count=sign)
+    return row
+
+
+@db_timed
+async def bump_daily_totals(db: AsyncSession, deltas: list[dict]):
+    # add deltas into daily_totals with one upsert; the caller commits
+    ins = dialect_insert(db, DailyTotal).values(deltas)
+    cols = TOTAL_COLUMNS + ("meal_count",)
+    await db.execute(ins.on_conflict_do_update(
+        index_elements=["user_id", "date"],
+        set_={c: getattr(DailyTotal, c) + getattr(ins.excluded, c) for c in cols}))
+    for d in deltas:
+        if d["meal_count"] < 0:   # drop days whose last meal was removed
+            await db.execute(delete(DailyTotal).where(
+                DailyTotal.user_id == d["user_id"], DailyTotal.date == d["date"],
+                DailyTotal.meal_count <= 0))
+
+
+@db_timed
+async def get_daily_totals(db: AsyncSession, user_id: str, start: dt.date, end: dt.date):
+    # rollup rows for start <= date < end, newest first
+    stmt = select(DailyTotal).where(
+        DailyTotal.user_id == user_id, DailyTotal.date >= start, DailyTotal.date < end
+    ).order_by(DailyTotal.date.desc())
     res = await db.execute(stmt)
     return res.scalars().all()
 
 
+# ---------- MEAL HISTORY ----------
+# Plain column rows with the food name joined in: no ORM objects and no
+# lazy `UserMeal.food` load per row (which AsyncSession cannot do anyway).
+
+def meal_rows(user_id: str):
+    return (select(UserMeal.id, UserMeal.time_of_meal, UserMeal.food_id,
+                   FoodItem.name.label("food_name"), UserMeal.weight_in_grams,
+                   *(getattr(UserMeal, c) for c in TOTAL_COLUMNS))
+            .outerjoin(FoodItem, FoodItem.id == UserMeal.food_id)
+            .where(UserMeal.user_id == user_id)
+            .order_by(UserMeal.time_of_meal.desc(), UserMeal.id.desc()))
+
+
+def encode_cursor(time_of_meal: dt.datetime, meal_id) -> str:
+    raw = f"{time_of_meal.isoformat()}|{meal_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[dt.datetime, uuid.UUID]:
+    # ValueError on anything we did not hand out
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        when, meal_id = raw.split("|")
+        return dt.datetime.fromisoformat(when), uuid.UUID(meal_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Bad cursor") from e
+
+
+@db_timed
+async def get_meals_page(db: AsyncSession, user_id: str, limit: int = 50, cursor: str | None = None):
+    # newest first; keyset on (time_of_meal, id) so deep pages cost the same
+    # as the first one. Returns (rows, next cursor or None).
+    stmt = meal_rows(user_id)
+    if cursor:
+        stmt = stmt.where(tuple_(UserMeal.time_of_meal, UserMeal.id) < decode_cursor(cursor))
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(last.time_of_meal, last.id)
+
+
+def _in_range(start: dt.datetime, stop: dt.datetime):
+    # half-open and on the bare column, so (user_id, time_of_meal) serves it
+    return and_(UserMeal.time_of_meal >= start, UserMeal.time_of_meal < stop)
+
+
+@db_timed
+async def get_today_meals(db: AsyncSession, user_id: str, tz: dt.tzinfo = UTC):
+    today = local_today(tz)
+    stmt = meal_rows(user_id).where(_in_range(*day_range(today, today + dt.timedelta(days=1), tz)))
+    return (await db.execute(stmt)).all()
+
+
+@db_timed
+async def get_today_totals(db: AsyncSession, user_id: str, tz: dt.tzinfo = UTC) -> dict:
+    # {total_calories, ...} eaten so far on the user's local day
+    today = local_today(tz)
+    if is_utc(tz):   # the rollup is keyed on UTC days
+        rows = await get_daily_totals(db, user_id, today, today + dt.timedelta(days=1))
+        return {c: getattr(rows[0], c) if rows else 0 for c in TOTAL_COLUMNS}
+    row = (await db.execute(
+        select(*(func.coalesce(func.sum(getattr(UserMeal, c)), 0) for c in TOTAL_COLUMNS))
+        .where(UserMeal.user_id == user_id,
+               _in_range(*day_range(today, today + dt.timedelta(days=1), tz))))).one()
+    return dict(zip(TOTAL_COLUMNS, row))
+
+
+@db_timed
 async def save_meal(db: AsyncSession, user_id: str, name: str, foods: list):
     sm = SavedMeal(user_id=user_id, meal_name=name,
-                   list_of_food_ids=[f.dict() for f in foods])
+                   list_of_food_ids=[{"food_id": str(f.food_id), "grams": f.weight} for f in foods])
     db.add(sm)
     await db.commit()
     await db.refresh(sm)
     return sm
 
 
+@db_timed
 async def get_saved_meals(db: AsyncSession, user_id: str):
     stmt = select(SavedMeal).where(SavedMeal.user_id ==
                                    user_id).order_by(SavedMeal.created_at.desc())
@@ -63,19 +237,39 @@ async def get_saved_meals(db: AsyncSession, user_id: str):
     return res.scalars().all()
 
 
-async def get_progress(db: AsyncSession, user_id: str, days: int = 30):
-    stmt = (
-        select(func.date(UserMeal.time_of_meal),
-               func.sum(UserMeal.total_calories))
-        .where(UserMeal.user_id == user_id)
-        .group_by(func.date(UserMeal.time_of_meal))
-        .order_by(func.date(UserMeal.time_of_meal).desc())
-        .limit(days)
-    )
-    res = await db.execute(stmt)
-    return [{"date": str(r[0]), "calories": r[1]} for r in res.all()]
+@db_timed
+async def get_favorite_food_ids(db: AsyncSession, user_id: str) -> set[uuid.UUID]:
+    # every food referenced by the user's saved meals; entries without a
+    # parseable food_id are skipped
+    res = await db.execute(select(SavedMeal.list_of_food_ids).where(SavedMeal.user_id == user_id))
+    ids = set()
+    for foods in res.scalars():
+        for f in foods or ():
+            try:
+                ids.add(uuid.UUID(f["food_id"]))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+    return ids
+
+
+@db_timed
+async def get_progress(db: AsyncSession, user_id: str, days: int = 30, tz: dt.tzinfo = UTC):
+    # calories per local day, newest first
+    today = local_today(tz)
+    first, end = today - dt.timedelta(days=days - 1), today + dt.timedelta(days=1)
+    if is_utc(tz):
+        rows = await get_daily_totals(db, user_id, first, end)
+        return [{"date": str(r.date), "calories": r.total_calories} for r in rows]
+    # other zones: bucket the range's meals by local day
+    res = await db.execute(select(UserMeal.time_of_meal, UserMeal.total_calories).where(
+        UserMeal.user_id == user_id, _in_range(*day_range(first, end, tz))))
+    per_day = defaultdict(float)
+    for when, calories in res:
+        per_day[local_date(when, tz)] += calories or 0
+    return [{"date": str(d), "calories": c} for d, c in sorted(per_day.items(), reverse=True)]
 
 
+@db_timed
 async def get_weekly_analytics(db: AsyncSession, user_id: str):
     stmt = select(WeeklyAnalytics).where(WeeklyAnalytics.user_id ==
                                          user_id).order_by(WeeklyAnalytics.date.desc()).limit(4)
@@ -0,0 +1,254 @@
+# database/ingest.py
+# Streaming import of food catalogs (USDA / OpenFoodFacts-style CSV, TSV
+# or NDJSON, optionally gzipped) into food_items, in constant memory.
+# Rows are validated with FoodIn and upserted in batches: on barcode when
+# the row has one, else on the lower-cased name among foods without a
+# barcode. Each batch commits on its own, so an interrupted import can
+# just be re-run. Bulk statements skip the FoodItem ORM hooks, so each
+# batch invalidates the catalog cache here and in the other API processes
+# (which re-read the foods into their search index and matrix); the
+# caller refreshes its own views through on_batch.
+#
+#   python -m database.ingest foods.csv.gz [--format csv|ndjson] [--batch 2000] [--rejects rejects.ndjson]
+import argparse
+import asyncio
+import contextlib
+import csv
+import datetime as dt
+import gzip
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from collections import Counter
+from sqlalchemy import select, update, func
+from executors import cpu_pool
+from .catalog import catalog_cache
+from .config import async_session, engine
+from .crud import dialect_insert
+from .models import FoodItem
+from .schemas import FoodIn
+
+INGEST_BATCH = int(os.getenv("INGEST_BATCH", "2000"))
+REJECT_SAMPLES = 20
+
+# column / key names accepted for each FoodIn field, matched case-insensitively
+FIELD_ALIASES = {
+    "name": ("name", "product_name", "description", "food_name"),
+    "calories": ("calories", "energy-kcal_100g", "energy_kcal", "kcal"),
+    "protein": ("protein", "proteins_100g"),
+    "carbs": ("carbs", "carbohydrates_100g", "carbohydrate"),
+    "fats": ("fats", "fat_100g", "fat"),
+    "barcode": ("barcode", "code", "gtin_upc", "ean"),
+    "image_url": ("image_url",),
+}
+
+log = logging.getLogger(__name__)
+csv.field_size_limit(2**31 - 1)   # OpenFoodFacts has very long ingredient fields
+
+
+# ---------- READING ----------
+
+def detect_format(filename: str) -> str:
+    base = filename.lower().removesuffix(".gz")
+    return "ndjson" if base.endswith((".ndjson", ".jsonl", ".json")) else "csv"
+
+
+def text_stream(binary, filename: str):
+    # decoded view of an uploaded or opened file, gunzipping *.gz
+    if filename.lower().endswith(".gz"):
+        binary = gzip.GzipFile(fileobj=binary, mode="rb")
+    return io.TextIOWrapper(binary, encoding="utf-8", errors="replace", newline="")
+
+
+def read_records(stream, fmt: str):
+    # (row number, {field: raw value}) per record
+    if fmt == "ndjson":
+        for row, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                obj = None
+            if not isinstance(obj, dict):
+                yield row, None
+                continue
+            keys = {k.lower(): v for k, v in obj.items()}
+            yield row, {f: next((keys[a] for a in aliases if keys.get(a) not in (None, "")), None)
+                        for f, aliases in FIELD_ALIASES.items()}
+        return
+    header = stream.readline()
+    tsv = header.count("\t") > header.count(",")
+    dialect = {"delimiter": "\t", "quoting": csv.QUOTE_NONE} if tsv else {}
+    names = [h.strip().lower() for h in next(csv.reader([header], **dialect), [])]
+    cols = {f: names.index(a) for f, aliases in FIELD_ALIASES.items()
+            for a in reversed(aliases) if a in names}   # reversed: the first alias wins
+    for row, values in enumerate(csv.reader(stream, **dialect), 2):
+        yield row, {f: values[i] if i < len(values) else None for f, i in cols.items()}
+
+
+def clean(raw: dict) -> dict:
+    # FoodIn fields of one record; raises ValueError (ValidationError is one)
+    record = {k: v.strip() if isinstance(v, str) else v for k, v in raw.items()}
+    record = {k: v for k, v in record.items() if v not in (None, "")}
+    if isinstance(record.get("name"), str):
+        record["name"] = " ".join(record["name"].split())
+    return FoodIn(**record).dict()
+
+
+def _reason(e: ValueError) -> str:
+    errors = getattr(e, "errors", None)
+    if callable(errors):
+        first = errors()[0]
+        return f"{'.'.join(map(str, first['loc']))}: {first['type']}"
+    return str(e)
+
+
+def _take(records, size: int, stats: dict) -> tuple[list[dict] | None, list[dict]]:
+    # the next `size` valid foods (None once the input is done) and the
+    # records rejected on the way; parsing and validation run on cpu_pool
+    foods, rejects = [], []
+    for row, raw in records:
+        stats["read"] += 1
+        try:
+            if raw is None:
+                raise ValueError("unparseable record")
+            foods.append(clean(raw))
+        except ValueError as e:
+            rejects.append({"row": row, "reason": _reason(e), "record": raw})
+        if len(foods) >= size:
+            break
+    return foods or None, rejects
+
+
+# ---------- WRITING ----------
+
+COLUMNS = ("name", "calories", "protein", "carbs", "fats", "barcode", "image_url")
+
+
+async def upsert_foods(db, foods: list[dict]) -> tuple[list[dict], set, int]:
+    # FoodIn dicts -> (the foods written, with ids; ids of those that
+    # already existed; rows left alone because nothing changed). Later rows
+    # with the same key win. The caller commits.
+    by_barcode = {f["barcode"]: f for f in foods if f["barcode"]}
+    by_name = {f["name"].lower(): f for f in foods if not f["barcode"]}
+    current = {}   # id -> stored column values
+    cols = [getattr(FoodItem, c) for c in COLUMNS]
+    if by_barcode:
+        res = await db.execute(select(FoodItem.id, *cols).where(FoodItem.barcode.in_(list(by_barcode))))
+        for food_id, *values in res:
+            by_barcode[values[5]]["id"] = food_id
+            current[food_id] = tuple(values)
+    if by_name:
+        res = await db.execute(select(FoodItem.id, func.lower(FoodItem.name), *cols)
+                               .where(FoodItem.barcode.is_(None),
+                                      func.lower(FoodItem.name).in_(list(by_name))))
+        for food_id, key, *values in res:
+            if key in by_name and "id" not in by_name[key]:   # first of any old duplicates
+                by_name[key]["id"] = food_id
+                current[food_id] = tuple(values)
+    foods = [*by_barcode.values(), *by_name.values()]
+    changed = [f for f in foods if "id" not in f or current[f["id"]] != tuple(f[c] for c in COLUMNS)]
+    updates = [f for f in changed if "id" in f]
+    if updates:
+        await db.execute(update(FoodItem), updates)   # by primary key
+    inserts = [f for f in changed if "id" not in f]
+    if inserts:
+        now = dt.datetime.utcnow()
+        for f in inserts:
+            f["id"] = uuid.uuid4()
+        ins = dialect_insert(db, FoodItem)
+        # a barcode that appeared since the lookup (another import) still
+        # updates, not fails; that row keeps its id, which RETURNING gives
+        res = await db.execute(ins.on_conflict_do_update(
+            index_elements=["barcode"],
+            set_={c: ins.excluded[c] for c in COLUMNS if c != "barcode"}
+        ).returning(FoodItem.id, FoodItem.barcode), [{**f, "created_at": now} for f in inserts])
+        stored = {code: food_id for food_id, code in res if code is not None}
+        for f in inserts:
+            if f["barcode"] and stored.get(f["barcode"], f["id"]) != f["id"]:
+                f["id"] = stored[f["barcode"]]
+                updates.append(f)
+    return changed, {f["id"] for f in updates}, len(foods) - len(changed)
+
+
+async def ingest(records, batch_size: int = INGEST_BATCH, on_batch=None, rejects_out=None) -> dict:
+    # records: (row, raw dict) pairs, e.g. read_records(); on_batch(foods,
+    # updated ids) runs after each commit; rejects_out gets every rejected
+    # record as NDJSON. Parsing of the next batch overlaps the upsert.
+    stats = {"read": 0, "rejected": 0, "duplicates": 0, "inserted": 0, "updated": 0,
+             "unchanged": 0, "batches": 0}
+    reasons, samples = Counter(), []
+    started = time.perf_counter()
+    records = iter(records)
+
+    def parse_next():
+        return asyncio.ensure_future(cpu_pool.run(_take, records, batch_size, stats, timeout=None))
+
+    pending = parse_next()
+    try:
+        while True:
+            foods, rejects = await pending
+            pending = parse_next() if foods is not None else None
+            for r in rejects:
+                reasons[r["reason"]] += 1
+                if len(samples) < REJECT_SAMPLES:
+                    samples.append(r)
+                if rejects_out is not None:
+                    rejects_out.write(json.dumps(r, default=str) + "\n")
+            stats["rejected"] += len(rejects)
+            if foods is None:
+                break
+
+            async with async_session() as db:
+                written, updated, unchanged = await upsert_foods(db, foods)
+                await db.commit()
+            if written:
+                ids = [f["id"] for f in written]
+                catalog_cache.invalidate(ids)
+                await catalog_cache.publish(ids)
+                if on_batch is not None:
+                    on_batch(written, updated)
+
+            stats["batches"] += 1
+            stats["duplicates"] += len(foods) - len(written) - unchanged
+            stats["unchanged"] += unchanged
+            stats["updated"] += len(updated)
+            stats["inserted"] += len(written) - len(updated)
+            elapsed = time.perf_counter() - started
+            log.info("ingest: batch %d, %d read, %d inserted, %d updated, %d unchanged, "
+                     "%d rejected, %.0f rows/s", stats["batches"], stats["read"], stats["inserted"],
+                     stats["updated"], stats["unchanged"], stats["rejected"], stats["read"] / elapsed)
+    finally:
+        if pending is not None:
+            pending.cancel()
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    stats["rows_per_s"] = round(stats["read"] / stats["seconds"]) if stats["seconds"] else 0
+    stats["reject_reasons"] = dict(reasons.most_common())
+    stats["reject_samples"] = samples
+    return stats
+
+
+async def _main(args) -> dict:
+    fmt = args.format or detect_format(args.path)
+    with open(args.path, "rb") as f, \
+            (open(args.rejects, "w") if args.rejects else contextlib.nullcontext()) as rejects:
+        stats = await ingest(read_records(text_stream(f, args.path), fmt), args.batch, rejects_out=rejects)
+    await engine.dispose()
+    return stats
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("path")
+    ap.add_argument("--format", choices=("csv", "ndjson"), help="default: from the file name")
+    ap.add_argument("--batch", type=int, default=INGEST_BATCH)
+    ap.add_argument("--rejects", help="write rejected records here as NDJSON")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    stats = asyncio.run(_main(args))
+    stats.pop("reject_samples")
+    print(json.dumps(stats, indent=1))
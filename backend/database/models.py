@@ -1,6 +1,6 @@
 import uuid
 import datetime as dt
-from sqlalchemy import Column, String, Float, DateTime, ForeignKey, JSON, Integer
+from sqlalchemy import Column, String, Float, Date, DateTime, ForeignKey, JSON, Integer, Index, func
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from .config import Base
@@ -17,10 +17,14 @@ class FoodItem(Base):
     barcode = Column(String, unique=True, nullable=True)
     image_url = Column(String, nullable=True)
     created_at = Column(DateTime, default=dt.datetime.utcnow)
+    # catalog imports match foods without a barcode on the lower-cased name
+    __table_args__ = (Index("ix_food_items_name_lower", func.lower(name)),)
 
 
 class UserMeal(Base):
     __tablename__ = "user_meals"
+    # every per-user read is a time range or newest-first page
+    __table_args__ = (Index("ix_user_meals_user_time", "user_id", "time_of_meal"),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     # use telegram-id / email
     user_id = Column(String, index=True)
@@ -36,6 +40,7 @@ class UserMeal(Base):
 
 class SavedMeal(Base):
     __tablename__ = "saved_meals"
+    __table_args__ = (Index("ix_saved_meals_user_created", "user_id", "created_at"),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(String, index=True)
     meal_name = Column(String)
@@ -46,6 +51,8 @@ class SavedMeal(Base):
 
 class WeeklyAnalytics(Base):
     __tablename__ = "weekly_analytics"
+    # one row per user per day; the nightly job upserts on this key
+    __table_args__ = (Index("uq_weekly_analytics_user_date", "user_id", "date", unique=True),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(String, index=True)
     date = Column(DateTime, index=True)   # midnight UTC
@@ -53,3 +60,18 @@ class WeeklyAnalytics(Base):
     total_protein = Column(Float)
     total_carbs = Column(Float)
     total_fats = Column(Float)
+
+
+class DailyTotal(Base):
+    # per-user, per-day rollup of user_meals, maintained by crud.log_meal /
+    # crud.delete_meal in the same transaction as the meal write
+    __tablename__ = "daily_totals"
+    user_id = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)   # UTC day of time_of_meal
+    total_calories = Column(Float, default=0)
+    total_protein = Column(Float, default=0)
+    total_carbs = Column(Float, default=0)
+    total_fats = Column(Float, default=0)
+    meal_count = Column(Integer, default=0)
+    # date-range scans of all users: the analytics jobs and the trend store refresh
+    __table_args__ = (Index("ix_daily_totals_date", "date"),)
@@ -0,0 +1,79 @@
+# database/pool.py
+# Queue pool that also records what the stock one doesn't show: how many
+# requests are waiting for a connection and how long they waited.
+# Checked-out / overflow / idle counts come from the pool itself.
+import logging
+import os
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+SLOW_ACQUIRE_MS = float(os.getenv("DB_SLOW_ACQUIRE_MS", "100"))
+
+log = logging.getLogger(__name__)
+
+
+class PoolStats:
+    # process-wide: Pool.recreate() builds a fresh pool object, the
+    # counters should survive that
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.slow = 0
+        self.wait_s = 0.0
+        self.max_wait_s = 0.0
+        self.last_warning = 0.0
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        s = pool_stats
+        with s.lock:
+            s.waiting += 1
+        t = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            with s.lock:
+                s.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - t
+            with s.lock:
+                s.waiting -= 1
+        slow = waited * 1000 >= SLOW_ACQUIRE_MS
+        with s.lock:
+            s.acquired += 1
+            s.wait_s += waited
+            s.max_wait_s = max(s.max_wait_s, waited)
+            s.slow += slow
+            # at most one warning a second; a spike would flood the log
+            warn = slow and t - s.last_warning >= 1
+            if warn:
+                s.last_warning = t
+        if warn:
+            log.warning("db pool: waited %.0f ms for a connection (%d checked out, %d waiting, %d slow so far)",
+                        waited * 1000, self.checkedout(), s.waiting, s.slow)
+        return conn
+
+
+def pool_status(pool) -> dict:
+    s = pool_stats
+    out = {
+        "waiting": s.waiting,
+        "acquired": s.acquired,
+        "timeouts": s.timeouts,
+        "slow_acquires": s.slow,
+        "avg_wait_ms": round(s.wait_s / s.acquired * 1000, 3) if s.acquired else 0.0,
+        "max_wait_ms": round(s.max_wait_s * 1000, 3),
+    }
+    if isinstance(pool, QueuePool):
+        out.update(size=pool.size(), checked_out=pool.checkedout(),
+                   overflow=max(pool.overflow(), 0), idle=pool.checkedin())
+    return out
@@ -4,6 +4,26 @@ from typing import List, Optional
 from uuid import UUID
 
 
+class UserProfile(BaseModel):
+    age: int
+    height: float
+    weight: float
+    gender: str
+    activity: str
+    goal: str
+
+
+class FoodIn(BaseModel):
+    # one catalog row to import; energy and macros per 100 g
+    name: str = Field(min_length=1, max_length=255)
+    calories: float = Field(ge=0, le=900)
+    protein: float = Field(ge=0, le=100)
+    carbs: float = Field(ge=0, le=100)
+    fats: float = Field(ge=0, le=100)
+    barcode: Optional[str] = Field(None, max_length=64)
+    image_url: Optional[str] = None
+
+
 class FoodOut(BaseModel):
     id: UUID
     name: str
@@ -30,6 +50,33 @@ class MealLogOut(BaseModel):
     total_fats: float
 
 
+class MealItemIn(BaseModel):
+    food_id: UUID
+    weight: float = Field(gt=0)
+
+
+class MealBatchIn(BaseModel):
+    user_id: str
+    items: List[MealItemIn] = []
+    # log every food of a saved meal (in addition to `items`)
+    saved_meal_id: Optional[UUID] = None
+
+
+class MealBatchOut(BaseModel):
+    success: bool
+    meal_ids: List[UUID]
+    total_calories: float
+    total_protein: float
+    total_carbs: float
+    total_fats: float
+
+
+class SavedMealItem(BaseModel):
+    # one entry of SavedMeal.list_of_food_ids
+    food_id: UUID
+    grams: float = Field(gt=0)
+
+
 class SavedMealIn(BaseModel):
     user_id: str
     meal_name: str
@@ -42,6 +89,21 @@ class SavedMealOut(BaseModel):
     foods: List[FoodOut]
 
 
+class MealPlanIn(BaseModel):
+    # targets come from `profile` (as /nutrition) unless given explicitly
+    profile: Optional[UserProfile] = None
+    calories: Optional[float] = Field(None, gt=0)
+    protein: Optional[float] = Field(None, ge=0)
+    carbs: Optional[float] = Field(None, ge=0)
+    fats: Optional[float] = Field(None, ge=0)
+    exclude_ids: List[UUID] = []
+    # drop foods whose name contains any of these, e.g. "pork", "peanut"
+    exclude_terms: List[str] = []
+    # prefer foods from this user's saved meals
+    user_id: Optional[str] = None
+    items: int = Field(5, ge=1, le=12)
+
+
 class ProgressPoint(BaseModel):
     date: str
     calories: float
@@ -0,0 +1,346 @@
+# database/search.py
+# In-process food search for /foods: a sorted word-prefix index over
+# food_items.name plus a trigram index over the name vocabulary for typos.
+# Loaded once at startup, kept fresh by committed FoodItem writes
+# (on_food_commit below).
+import bisect
+from collections import Counter
+from uuid import UUID
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from .models import FoodItem
+
+MAX_CORRECTIONS = 3     # spelling alternatives tried per query word
+MIN_SIMILARITY = 0.35   # trigram jaccard needed to accept a correction
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def trigrams(word: str, partial: bool = False) -> set[str]:
+    # a partially typed word has no end-of-word padding
+    padded = f"  {word}" if partial else f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def food_to_dict(food: FoodItem) -> dict:
+    return {
+        "id": food.id,
+        "name": food.name,
+        "calories": food.calories,
+        "protein": food.protein,
+        "carbs": food.carbs,
+        "fats": food.fats,
+        "barcode": food.barcode,
+        "image_url": food.image_url,
+    }
+
+
+class FoodSearchIndex:
+    def __init__(self):
+        self.loaded = False
+        self._docs: list[dict | None] = []        # doc id -> food dict
+        self._names: list[str] = []               # doc id -> normalized name
+        self._by_food: dict[UUID, int] = {}       # food id -> doc id
+        self._starts: dict[int, list[tuple[str, int]]] = {}  # name length -> (name, doc id), sorted
+        self._prefix: list[tuple[str, int, int]] = []  # (later-word suffix, word pos, doc id), sorted
+        self._vocab: Counter = Counter()          # word -> live doc count
+        self._grams: dict[str, set[str]] = {}     # trigram -> vocab words
+        self._dead = 0
+        self._pending: list | None = None          # writes seen during load()
+
+    def __len__(self):
+        return len(self._by_food)
+
+    def foods(self):
+        # every live food dict, e.g. to build other in-memory views
+        return (d for d in self._docs if d is not None)
+
+    # ---------- BUILD ----------
+
+    async def load(self, db: AsyncSession):
+        self.clear()
+        self._pending = []
+        res = await db.stream(select(FoodItem).execution_options(yield_per=5000))
+        async for food in res.scalars():
+            self._insert(food_to_dict(food), keep_sorted=False)
+        self._sort()
+        self.loaded = True
+        # writes that raced the snapshot: replay them in order
+        pending, self._pending = self._pending, None
+        for food, food_id in pending:
+            if food is not None:
+                self.add(food)
+            else:
+                self.remove(food_id)
+
+    def on_write(self, food: dict | None, food_id=None):
+        # committed ORM write: food dict for an insert/update, None + id
+        # for a delete
+        if self.loaded:
+            if food is not None:
+                self.add(food)
+            else:
+                self.remove(food_id)
+        elif self._pending is not None:
+            self._pending.append((food, food_id))
+
+    def on_write_many(self, foods: list[dict]):
+        # inserted/updated foods from a bulk write, which skips the ORM hooks
+        if self.loaded:
+            self.add_many(foods)
+        elif self._pending is not None:
+            self._pending.extend((food, None) for food in foods)
+
+    def clear(self):
+        self.__init__()
+
+    def add(self, food: dict):
+        if food["id"] in self._by_food:
+            self.remove(food["id"])
+        self._insert(food, keep_sorted=True)
+
+    def add_many(self, foods: list[dict]):
+        # one sort for the batch instead of an insort per food; removals
+        # go first, they bisect the still-sorted lists
+        for food in foods:
+            self.remove(food["id"])
+        for food in foods:
+            self._insert(food, keep_sorted=False)
+        self._sort()
+
+    def remove(self, food_id):
+        doc = self._by_food.pop(food_id, None)
+        if doc is None:
+            return
+        self._docs[doc] = None
+        name = self._names[doc]
+        bucket = self._starts[len(name)]
+        i = bisect.bisect_left(bucket, (name, doc))
+        if i < len(bucket) and bucket[i][1] == doc:
+            del bucket[i]
+        for pos, suffix in enumerate(self._suffixes(name), start=1):
+            i = bisect.bisect_left(self._prefix, (suffix, pos, doc))
+            if i < len(self._prefix) and self._prefix[i][2] == doc:
+                del self._prefix[i]
+        for word in set(name.split(" ")):
+            self._vocab[word] -= 1
+            if self._vocab[word] <= 0:
+                del self._vocab[word]   # gram sets are cleaned lazily
+        self._dead += 1
+        if self._dead > 1000 and self._dead > len(self._docs) // 4:
+            self._compact()
+
+    def _insert(self, food: dict, keep_sorted: bool):
+        name = normalize(food["name"] or "")
+        doc = len(self._docs)
+        self._docs.append(food)
+        self._names.append(name)
+        self._by_food[food["id"]] = doc
+        bucket = self._starts.setdefault(len(name), [])
+        if keep_sorted:
+            bisect.insort(bucket, (name, doc))
+        else:
+            bucket.append((name, doc))
+        for pos, suffix in enumerate(self._suffixes(name), start=1):
+            if keep_sorted:
+                bisect.insort(self._prefix, (suffix, pos, doc))
+            else:
+                self._prefix.append((suffix, pos, doc))
+        for word in set(name.split(" ")):
+            if word not in self._vocab:
+                for g in trigrams(word):
+                    self._grams.setdefault(g, set()).add(word)
+            self._vocab[word] += 1
+
+    def _sort(self):
+        # after _insert(keep_sorted=False)
+        for bucket in self._starts.values():
+            bucket.sort()
+        self._prefix.sort()
+
+    @staticmethod
+    def _suffixes(name: str):
+        # the suffix at each later word start, so "breast" matches
+        # "chicken breast"; the whole name is in _starts
+        start = 0
+        for part in name.split(" ")[:-1]:
+            start += len(part) + 1
+            yield name[start:]
+
+    def _compact(self):
+        live = [d for d in self._docs if d is not None]
+        self.clear()
+        for food in live:
+            self._insert(food, keep_sorted=False)
+        self._sort()
+        self.loaded = True
+
+    # ---------- QUERY ----------
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        q = normalize(query)
+        if not q:
+            return []
+        hits: dict[int, tuple] = {}
+        self._scan_prefix(q, 0, limit, hits)
+        if len(hits) < limit:
+            # typo tolerance: retry with spelling-corrected queries
+            for rank, (sim, fixed) in enumerate(self._corrections(q), start=1):
+                self._scan_prefix(fixed, rank, limit, hits, sim)
+                if len(hits) >= limit:
+                    break
+        ranked = sorted(hits.values())[:limit]
+        return [self._docs[doc] for *_, doc in ranked]
+
+    def best_match(self, name: str) -> dict | None:
+        # the food a free-text label (e.g. a detector class) most likely
+        # means: that exact name, else the shortest one starting with it,
+        # else the same after a spelling fix
+        hits = self.search(name, 1)
+        return hits[0] if hits else None
+
+    def _scan_prefix(self, q: str, rank: int, limit: int, hits: dict, sim: float = 1.0):
+        # tier 0: the name starts with q, ranked exactly, shortest first:
+        # the per-length lists are walked from len(q) up until `limit`
+        # matches are found. tier 1: a later word starts with q, only if
+        # tier 0 leaves room, from the first limit * 4 matches. Corrected
+        # queries (rank > 0) always sort after exact ones.
+        rank = min(rank, 1)
+        found = 0
+        for n in sorted(self._starts):
+            if n < len(q):
+                continue
+            bucket = self._starts[n]
+            i = bisect.bisect_left(bucket, (q,))
+            while i < len(bucket) and found < limit and bucket[i][0].startswith(q):
+                self._hit(hits, (rank, -sim, 0, n, bucket[i][0], bucket[i][1]))
+                found += 1
+                i += 1
+            if found >= limit:
+                return
+        i = bisect.bisect_left(self._prefix, (q,))
+        seen = 0
+        while i < len(self._prefix) and seen < limit * 4:
+            suffix, pos, doc = self._prefix[i]
+            if not suffix.startswith(q):
+                break
+            name = self._names[doc]
+            self._hit(hits, (rank, -sim, 1, len(name), name, doc))
+            seen += 1
+            i += 1
+
+    @staticmethod
+    def _hit(hits: dict, key: tuple):
+        doc = key[-1]
+        if doc not in hits or key < hits[doc]:
+            hits[doc] = key
+
+    def _corrections(self, q: str) -> list[tuple[float, str]]:
+        words = q.split(" ")
+        last = len(words) - 1
+        options = []
+        for n, word in enumerate(words):
+            similar = self._similar_words(word, partial=(n == last))
+            if word in self._vocab or (n == last and not similar):
+                similar.insert(0, (1.0, word))
+            if not similar:
+                return []
+            options.append(similar)
+        # vary the worst-matching word, keep the best choice for the rest
+        best = [opts[0] for opts in options]
+        weakest = min(range(len(options)), key=lambda n: best[n][0])
+        floor = min((s for n, (s, _) in enumerate(best) if n != weakest), default=1.0)
+        out = []
+        for sim, word in options[weakest][:MAX_CORRECTIONS]:
+            fixed = [w for _, w in best]
+            fixed[weakest] = word
+            candidate = " ".join(fixed)
+            if candidate != q:
+                out.append((min(sim, floor), candidate))
+        return out
+
+    def _similar_words(self, word: str, partial: bool) -> list[tuple[float, str]]:
+        if len(word) < 3:
+            return []
+        qgrams = trigrams(word, partial)
+        counts = Counter()
+        for g in qgrams:
+            counts.update(self._grams.get(g, ()))
+        scored = []
+        for cand, shared in counts.items():
+            if cand not in self._vocab:
+                continue
+            if partial:
+                # compare against the candidate's leading part only
+                cgrams = trigrams(cand[:len(word) + 1], partial=True)
+                shared = len(qgrams & cgrams)
+            else:
+                cgrams = trigrams(cand)
+            sim = shared / len(qgrams | cgrams)
+            if sim >= MIN_SIMILARITY and cand != word:
+                scored.append((sim, cand))
+        scored.sort(key=lambda x: (-x[0], -self._vocab[x[1]]))
+        return scored[:MAX_CORRECTIONS]
+
+
+food_index = FoodSearchIndex()
+
+
+# ---------- COMMITTED WRITES ----------
+# In-memory views of food_items (this index, nutrition/matrix.py,
+# nutrition/neighbors.py) take a write only once it is committed: mapper
+# events note each written food on its session at flush (the row as
+# flushed, None for a delete), after_commit hands the last state of each
+# to the registered listeners, and a rollback drops them.
+_commit_listeners = []
+
+
+def on_food_commit(fn):
+    # decorator; fn(food_id, food dict or None if deleted, inserted)
+    _commit_listeners.append(fn)
+    return fn
+
+
+def _note(target, food: dict | None, inserted: bool = False):
+    session = Session.object_session(target)
+    if session is None:
+        return
+    writes = session.info.setdefault("food_writes", {})
+    earlier = writes.get(target.id)
+    writes[target.id] = (food, inserted or (earlier is not None and earlier[1]))
+
+
+@event.listens_for(FoodItem, "after_insert")
+def _food_inserted(mapper, connection, target):
+    _note(target, food_to_dict(target), inserted=True)
+
+
+@event.listens_for(FoodItem, "after_update")
+def _food_updated(mapper, connection, target):
+    _note(target, food_to_dict(target))
+
+
+@event.listens_for(FoodItem, "after_delete")
+def _food_deleted(mapper, connection, target):
+    _note(target, None)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_food_writes(session):
+    writes = session.info.pop("food_writes", None)
+    for food_id, (food, inserted) in (writes or {}).items():
+        for fn in _commit_listeners:
+            fn(food_id, food, inserted)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_food_writes(session):
+    session.info.pop("food_writes", None)
+
+
+@on_food_commit
+def _index_food(food_id, food, inserted):
+    food_index.on_write(food, food_id)
@@ -0,0 +1,181 @@
+# database/user_cache.py
+# Per-user response cache for the polled dashboard reads (/meal/today,
+# /progress, /weekly-analytics, /saved-meals). Each user has a version
+# counter in Redis, bumped after every committed write of their meals or
+# saved meals; a global epoch is bumped by the weekly analytics job. A
+# poll reads both with one MGET and, when this process already holds the
+# response for that version, serves it from memory. The cached part is
+# the serialized `data` of std_resp(), so only server_time is rebuilt.
+# The ETag is a hash of that data, so clients get 304 whenever it is unchanged.
+import datetime as dt
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+import redis.asyncio as redis
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from .config import REDIS_URL
+
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "600"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "20000"))
+VERSION_TTL = 30 * 24 * 3600   # longer than any cached body lives
+CACHE_CONTROL = "private, no-cache"   # browsers keep it but revalidate every poll
+
+log = logging.getLogger(__name__)
+
+
+def serialize(data) -> str:
+    # as JSONResponse renders it
+    return json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":"))
+
+
+def etag_of(data_json: str) -> str:
+    # weak: the body around the data differs in server_time
+    return 'W/"' + hashlib.blake2b(data_json.encode(), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in (t.removeprefix("W/") for t in tags)
+
+
+class UserResponseCache:
+    def __init__(self, redis_client=None, ttl: int = USER_CACHE_TTL,
+                 max_entries: int = USER_CACHE_MAX_ENTRIES, prefix: str = "ucache"):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = prefix
+        # (user, key) -> (expires, version, etag, data json)
+        self._local: OrderedDict[tuple, tuple[float, str, str, str]] = OrderedDict()
+        self._versions: dict[str, int] = {}   # only used without Redis
+        self._epoch = 0
+        self._last_warning = 0.0
+        self.counters = {"local_hits": 0, "redis_hits": 0, "misses": 0, "not_modified": 0,
+                         "bumps": 0, "bypassed": 0, "redis_errors": 0}
+
+    def _version_key(self, user_id: str) -> str:
+        return f"{self.prefix}:v:{user_id}"
+
+    # ---------- VERSIONS ----------
+
+    async def version(self, user_id: str) -> str | None:
+        # "epoch.user"; None when Redis is unreachable (don't cache then)
+        if self.redis is None:
+            return f"{self._epoch}.{self._versions.get(user_id, 0)}"
+        try:
+            user, epoch = await self.redis.mget(self._version_key(user_id), f"{self.prefix}:epoch")
+        except (redis.RedisError, OSError):
+            self._lost_redis()
+            return None
+        return f"{epoch or 0}.{user or 0}"
+
+    async def bump(self, *user_ids: str):
+        # call after the write has committed
+        self.counters["bumps"] += len(user_ids)
+        if self.redis is None:
+            for user_id in user_ids:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.incr(self._version_key(user_id))
+                    pipe.expire(self._version_key(user_id), VERSION_TTL)
+                await pipe.execute()
+        except (redis.RedisError, OSError):
+            self._lost_redis()
+
+    async def bump_all(self):
+        # every user's cached responses, e.g. after the analytics job
+        if self.redis is None:
+            self._epoch += 1
+            return
+        try:
+            await self.redis.incr(f"{self.prefix}:epoch")
+        except (redis.RedisError, OSError):
+            self._lost_redis()
+
+    def _lost_redis(self):
+        # a bump may have been missed: nothing held locally can be trusted
+        self.counters["redis_errors"] += 1
+        self._local.clear()
+        now = time.monotonic()
+        if now - self._last_warning >= 60:
+            self._last_warning = now
+            log.warning("user cache: Redis unavailable, serving uncached (%d errors so far)",
+                        self.counters["redis_errors"])
+
+    # ---------- RESPONSES ----------
+
+    async def respond(self, request: Request, user_id: str, key: str, compute) -> Response:
+        # key: endpoint + every parameter that changes the data (including
+        # the user's current date where "today" matters); compute: zero-arg
+        # coroutine function returning the std_resp() data
+        version = await self.version(user_id)
+        if version is None:
+            self.counters["bypassed"] += 1
+            return self._response(serialize(await compute()), None)
+
+        entry = self._local.get((user_id, key))
+        if entry is not None and entry[0] > time.monotonic() and entry[1] == version:
+            self._local.move_to_end((user_id, key))
+            self.counters["local_hits"] += 1
+            etag, data_json = entry[2], entry[3]
+        else:
+            etag, data_json = await self._load(user_id, key, version, compute)
+            self._local[(user_id, key)] = (time.monotonic() + self.ttl, version, etag, data_json)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.counters["not_modified"] += 1
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+        return self._response(data_json, etag)
+
+    async def _load(self, user_id: str, key: str, version: str, compute) -> tuple[str, str]:
+        redis_key = f"{self.prefix}:r:{user_id}:{key}:{version}"
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(redis_key)
+            except (redis.RedisError, OSError):
+                self._lost_redis()
+                raw = None
+            if raw is not None:
+                self.counters["redis_hits"] += 1
+                etag, data_json = raw.split("\n", 1)
+                return etag, data_json
+        self.counters["misses"] += 1
+        data_json = serialize(await compute())
+        etag = etag_of(data_json)
+        if self.redis is not None:
+            try:
+                await self.redis.set(redis_key, f"{etag}\n{data_json}", ex=self.ttl)
+            except (redis.RedisError, OSError):
+                self._lost_redis()
+        return etag, data_json
+
+    @staticmethod
+    def _response(data_json: str, etag: str | None) -> Response:
+        # std_resp() around already-serialized data
+        body = '{"status":"success","data":%s,"server_time":"%s"}' % (
+            data_json, dt.datetime.utcnow().isoformat())
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL} if etag else None
+        return Response(body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        hits = self.counters["local_hits"] + self.counters["redis_hits"]
+        total = hits + self.counters["misses"]
+        return {**self.counters, "hit_ratio": round(hits / total, 4) if total else 0.0,
+                "entries": len(self._local)}
+
+    def clear(self):
+        self._local.clear()
+
+
+user_cache = UserResponseCache(redis.from_url(REDIS_URL, decode_responses=True))
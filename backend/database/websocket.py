@@ -1,44 +1,128 @@
-import json
 import asyncio
+import os
 import redis.asyncio as redis
-from fastapi import WebSocket, WebSocketDisconnect
+from fastapi import WebSocket
 from .config import REDIS_URL
+from metrics import REDIS_PUBLISH_SECONDS
+
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+SLOW_CONSUMER_CLOSE_CODE = 1013   # "try again later"
+
+
+class Connection:
+    # one socket; messages go through a bounded queue drained by its own
+    # sender task, so one slow client never blocks delivery to others
+    def __init__(self, websocket: WebSocket, user_id: str, queue_size: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self.sender: asyncio.Task | None = None
+        self.closed = False
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active: dict[str, WebSocket] = {}
-        self.redis = redis.from_url(REDIS_URL, decode_responses=True)
+    # Every worker process holds ONE Redis pattern subscription (user:*)
+    # and fans each message out to its local sockets for that user.
+    # send_personal only publishes, so each socket gets a message exactly
+    # once no matter which worker produced it.
+    def __init__(self, redis_client=None, queue_size: int = SEND_QUEUE_SIZE):
+        self.active: dict[str, set[Connection]] = {}
+        self.redis = redis_client
+        self.queue_size = queue_size
+        self.evicted = 0
+        self._listener: asyncio.Task | None = None
+        self._closing: set[asyncio.Task] = set()
 
-    async def connect(self, websocket: WebSocket, user_id: str):
+    async def connect(self, websocket: WebSocket, user_id: str) -> Connection:
         await websocket.accept()
-        self.active[user_id] = websocket
-        # subscribe to Redis channel
-        pubsub = self.redis.pubsub()
-        await pubsub.subscribe(f"user:{user_id}")
-        self.redis_loop = asyncio.create_task(
-            self._redis_listener(pubsub, websocket))
-
-    async def disconnect(self, user_id: str):
-        ws = self.active.pop(user_id, None)
-        if ws:
-            try:
-                await ws.close()
-            except:
-                pass
-        if hasattr(self, 'redis_loop'):
-            self.redis_loop.cancel()
+        conn = Connection(websocket, user_id, self.queue_size)
+        conn.sender = asyncio.create_task(self._sender(conn))
+        self.active.setdefault(user_id, set()).add(conn)
+        if self.redis is not None and (self._listener is None or self._listener.done()):
+            self._listener = asyncio.create_task(self._redis_listener())
+        return conn
+
+    async def disconnect(self, conn: Connection, code: int = 1000):
+        if self._detach(conn):
+            await self._close(conn, code)
+
+    @staticmethod
+    async def _close(conn: Connection, code: int):
+        try:
+            await conn.websocket.close(code=code)
+        except Exception:
+            pass   # already gone
 
-    async def _redis_listener(self, pubsub, websocket: WebSocket):
-        async for msg in pubsub.listen():
-            if msg["type"] == "message":
-                await websocket.send_text(msg["data"])
+    def _detach(self, conn: Connection) -> bool:
+        # synchronous bookkeeping half of disconnect(); False if done before
+        if conn.closed:
+            return False
+        conn.closed = True
+        conns = self.active.get(conn.user_id)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns:
+                del self.active[conn.user_id]
+        if conn.sender is not None and conn.sender is not asyncio.current_task():
+            conn.sender.cancel()
+        if not self.active and self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        return True
 
     async def send_personal(self, message: str, user_id: str):
-        if user_id in self.active:
-            await self.active[user_id].send_text(message)
-        # also publish to Redis so any worker can push
-        await self.redis.publish(f"user:{user_id}", message)
+        if self.redis is None:
+            self.deliver_local(message, user_id)
+            return
+        try:
+            with REDIS_PUBLISH_SECONDS.time("user"):
+                await self.redis.publish(f"user:{user_id}", message)
+        except (redis.RedisError, OSError):
+            # Redis down: at least reach this worker's sockets
+            self.deliver_local(message, user_id)
+
+    def deliver_local(self, message: str, user_id: str):
+        for conn in list(self.active.get(user_id, ())):
+            try:
+                conn.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # slow consumer: drop the socket, the client reconnects
+                if self._detach(conn):
+                    self.evicted += 1
+                    task = asyncio.create_task(self._close(conn, SLOW_CONSUMER_CLOSE_CODE))
+                    self._closing.add(task)
+                    task.add_done_callback(self._closing.discard)
+
+    def stats(self) -> dict:
+        conns = [c for cs in self.active.values() for c in cs]
+        return {
+            "users": len(self.active),
+            "connections": len(conns),
+            "queued": sum(c.queue.qsize() for c in conns),
+            "evicted": self.evicted,
+        }
+
+    async def _sender(self, conn: Connection):
+        try:
+            while True:
+                await conn.websocket.send_text(await conn.queue.get())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self.disconnect(conn)
+
+    async def _redis_listener(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.psubscribe("user:*")
+                async for msg in pubsub.listen():
+                    if msg["type"] == "pmessage":
+                        self.deliver_local(msg["data"], msg["channel"][len("user:"):])
+            except (redis.RedisError, OSError):
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.reset()
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(redis.from_url(REDIS_URL, decode_responses=True))
@@ -0,0 +1,123 @@
+# executors.py
+# Named, bounded thread pools for CPU-bound work, so handlers only await:
+#   decode - upload hashing and image decoding (hashlib and PIL drop the GIL)
+#   cpu    - model helpers, meal planning, nutrition batches, index builds
+# The scanner has its own micro-batching process pool (ml/inference.py).
+# Each pool caps queued + running jobs (ExecutorBusy -> 503) and gives up
+# waiting after a timeout (ExecutorTimeout -> 504). A job whose caller gave
+# up (timeout, client gone) is dropped if it is still queued; one already
+# running finishes and its result is discarded.
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CPUS = os.cpu_count() or 1
+
+
+class ExecutorBusy(Exception):
+    """Raised when a pool already has max_pending jobs."""
+
+
+class ExecutorTimeout(Exception):
+    """Raised when a job did not finish within the pool's timeout."""
+
+
+class ClientDisconnected(Exception):
+    """Raised by cancel_on_disconnect() when the client went away first."""
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, workers: int, max_pending: int, timeout: float | None):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pool: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()   # job callbacks run on the pool's threads
+        self.pending = 0
+        self.counters = {"completed": 0, "rejected": 0, "timeouts": 0, "cancelled": 0}
+
+    async def run(self, fn, *args, timeout: float | None = ...):
+        # timeout: seconds, None for no limit; defaults to the pool's
+        timeout = self.timeout if timeout is ... else timeout
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.counters["rejected"] += 1
+                raise ExecutorBusy(f"{self.name} pool full ({self.max_pending} jobs)")
+            self.pending += 1
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+        try:
+            job = self._pool.submit(fn, *args)
+        except BaseException:
+            with self._lock:
+                self.pending -= 1
+            raise
+        job.add_done_callback(self._finished)
+        try:
+            # cancelling the wrapper cancels the job if it hasn't started
+            return await asyncio.wait_for(asyncio.wrap_future(job), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.counters["timeouts"] += 1
+            raise ExecutorTimeout(f"{self.name}: no result within {timeout}s") from None
+
+    def _finished(self, job):
+        with self._lock:
+            self.pending -= 1
+            self.counters["cancelled" if job.cancelled() else "completed"] += 1
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "pending": self.pending,
+                "max_pending": self.max_pending, "timeout_s": self.timeout, **self.counters}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def _timeout(name: str, default: str) -> float | None:
+    value = float(os.getenv(name, default))
+    return value or None   # 0 = no limit
+
+
+decode_pool = BoundedExecutor(
+    "decode",
+    workers=int(os.getenv("DECODE_THREADS", str(min(4, CPUS)))),
+    max_pending=int(os.getenv("DECODE_MAX_PENDING", "64")),
+    timeout=_timeout("DECODE_TIMEOUT_S", "10"),
+)
+cpu_pool = BoundedExecutor(
+    "cpu",
+    workers=int(os.getenv("CPU_THREADS", str(CPUS))),
+    max_pending=int(os.getenv("CPU_MAX_PENDING", "128")),
+    timeout=_timeout("CPU_TIMEOUT_S", "10"),
+)
+pools = {p.name: p for p in (decode_pool, cpu_pool)}
+
+
+# ---------- CLIENT DISCONNECT ----------
+
+async def until_disconnected(request):
+    # once the body has been read, the next ASGI message for an HTTP
+    # request is http.disconnect, sent when the client goes away
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def cancel_on_disconnect(request, awaitable):
+    # await `awaitable`, cancelling it (and the pool jobs it queued) if the
+    # client disconnects first
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(until_disconnected(request))
+    try:
+        done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+    if task not in done:
+        raise ClientDisconnected()
+    return task.result()
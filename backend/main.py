@@ -1,25 +1,46 @@
-from fastapi import WebSocket
-from fastapi import FastAPI, UploadFile, File, Form, Query, HTTPException, Depends
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, Form, Query, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from fastapi.responses import JSONResponse
-import random
-from typing import List
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import text
+from typing import List, Literal
 from uuid import UUID
 import datetime as dt
 from sqlalchemy.ext.asyncio import AsyncSession
-from database.config import async_session, Base, engine
+from database.config import async_session, read_session, Base, engine
+from database.pool import pool_status
 from database.models import FoodItem, UserMeal, SavedMeal, WeeklyAnalytics
 from database.schemas import *
 from database.crud import *
 from database.websocket import manager
-from ml.weight import predict_weight
+from database.search import food_index, food_to_dict
+from database.catalog import catalog_cache
+from database.ingest import ingest, read_records, text_stream, detect_format
+from database.user_cache import user_cache
 from ml.classify import classify_food
-from workers.analytics import build_weekly_analytics
-from PIL import Image
+from ml.inference import scan_pool, InferenceBusy
+from ml.preprocess import ImageUpload, UploadLimit, UploadTooLarge
+from ml.scanner import SIGNATURE as SCAN_SIGNATURE
+from ml.cache import result_cache
+from ml.jobs import job_queue, DEFAULT_PRIORITY
+from nutrition.engine import nutrition_targets
+from nutrition.matrix import catalog_matrix
+from nutrition.planner import plan_meals
+from nutrition.neighbors import food_recommender, REFERENCE_DAY
+from nutrition.portions import scan_nutrition, scan_weight
+from nutrition.trends import trend_store, trend_report, weekly_report, streak_report, TRENDS_DAYS
+from utils import std_resp, get_zone, local_today
+import metrics
+from executors import (pools, cpu_pool, cancel_on_disconnect, ExecutorBusy,
+                       ExecutorTimeout, ClientDisconnected)
+from metrics import Gauge, ML_STAGE_SECONDS
+import csv
+import gc
 import io
-import redis
 import json
+import re
+import asyncio
+from urllib.parse import quote
 
 app = FastAPI()
 
@@ -31,139 +52,361 @@ app.add_middleware(
     allow_headers=["*"],
     allow_methods=["*"]
 )
+# image uploads over MAX_UPLOAD_MB get a 413 before they are spooled
+app.add_middleware(UploadLimit, paths=("/analyze", "/analyze/full", "/predict-weight", "/classify-food"))
+metrics.install(app, engine)
+
+
+@app.exception_handler(ExecutorBusy)
+async def executor_busy(request: Request, exc: ExecutorBusy):
+    return JSONResponse({"detail": f"Busy, retry shortly ({exc})"}, status_code=503,
+                        headers={"Retry-After": "1"})
 
-# -------------------------
-# USER MODEL
-# -------------------------
 
+@app.exception_handler(ExecutorTimeout)
+async def executor_timeout(request: Request, exc: ExecutorTimeout):
+    return JSONResponse({"detail": str(exc)}, status_code=504)
 
-class UserProfile(BaseModel):
-    age: int
-    height: float
-    weight: float
-    gender: str
-    activity: str
-    goal: str
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected(request: Request, exc: ClientDisconnected):
+    # nobody reads this; 499 (nginx's "client closed request") shows in metrics
+    return Response(status_code=499)
 
 
 # -------------------------
 # NUTRITION API
 # -------------------------
 @app.post("/nutrition")
-def nutrition(user: UserProfile):
+async def nutrition(user: UserProfile):
+    return (await cpu_pool.run(nutrition_targets, [user]))[0]
 
-    h = user.height / 100
-    bmi = round(user.weight / (h**2), 2)
 
-    if user.gender == "male":
-        bmr = 10*user.weight + 6.25*user.height - 5*user.age + 5
-    else:
-        bmr = 10*user.weight + 6.25*user.height - 5*user.age - 161
+@app.post("/nutrition/batch", response_model=dict)
+async def nutrition_batch(users: List[UserProfile]):
+    return std_resp(await cpu_pool.run(nutrition_targets, users))
 
-    multiplier = {"low": 1.2, "medium": 1.55, "high": 1.9}
-    calories = round(bmr * multiplier.get(user.activity, 1.2))
 
-    if user.goal == "weight_loss":
-        calories -= 400
-    elif user.goal == "muscle_gain":
-        calories += 400
+# -------------------------
+# FOOD SCANNER
+# -------------------------
+async def read_image(file: UploadFile) -> ImageUpload:
+    try:
+        return await ImageUpload.read(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
-    if user.goal == "weight_loss":
-        diet = "High protein, salads, fruits, avoid sugar & fried foods."
-    elif user.goal == "muscle_gain":
-        diet = "Protein heavy: Eggs, chicken, paneer, rice, nuts."
-    else:
-        diet = "Balanced diet with vegetables, carbs and protein."
 
-    return {
-        "bmi": bmi,
-        "bmr": round(bmr),
-        "daily_calories": calories,
-        "diet_plan": diet
-    }
+async def decoded(upload: ImageUpload):
+    try:
+        return await upload.image()
+    except OSError:   # PIL.UnidentifiedImageError and truncated files
+        raise HTTPException(status_code=400, detail="Unreadable image")
 
 
-# -------------------------
-# FOOD SCANNER FAKE AI
-# -------------------------
-foods = [
-    ("Idli", 280, "Good carbs, low fat."),
-    ("Dosa", 350, "Moderate calories, avoid excess chutney."),
-    ("Rice & Dal", 420, "Good protein but control rice."),
-    ("Chapati + Sabzi", 360, "Balanced meal."),
-    ("Fried Snack", 500, "Reduce junk food intake."),
-    ("Chicken Curry", 480, "High protein, good for muscle gain."),
-    ("Paneer Dish", 450, "Vegetarian protein source."),
-]
+# each ML step is cached by upload content, so repeats skip inference
+async def scan_upload(upload: ImageUpload) -> dict:
+    # the detections only: nutrition is looked up per request, so catalog
+    # edits show up without invalidating cached scans
+    async def run():
+        try:
+            return await scan_pool.submit(await decoded(upload))
+        except InferenceBusy:
+            raise HTTPException(status_code=503, detail="Scanner busy, retry shortly",
+                                headers={"Retry-After": "1"})
+    return await result_cache.get_or_compute(f"detect:{SCAN_SIGNATURE}", upload.digest, run)
+
+
+def with_nutrition(scan: dict) -> dict:
+    return scan_nutrition(scan, food_index.best_match)
+
+
+async def classify_upload(upload: ImageUpload) -> dict:
+    async def run():
+        image = await decoded(upload)
+        with ML_STAGE_SECONDS.time("classify", "infer"):
+            name, conf = await cpu_pool.run(classify_food, image)
+        return {"food_name": name, "confidence": conf}
+    return await result_cache.get_or_compute("classify", upload.digest, run)
+
+
+async def weigh_upload(upload: ImageUpload) -> dict:
+    return scan_weight(await scan_upload(upload))
+
+
+# ?mode=async: a job record comes back at once (202) and the result
+# follows at GET /jobs/{id} and as a "job_update" push (ml/jobs.py)
+async def run_job(kind: str, upload: ImageUpload) -> dict:
+    if kind == "scan":
+        return with_nutrition(await scan_upload(upload))
+    if kind == "classify":
+        return await classify_upload(upload)
+    return await weigh_upload(upload)
+
+
+job_queue.runner = run_job
+job_queue.notify = manager.send_personal
+
 
+def job_options(mode: Literal["sync", "async"] = Query("sync"),
+                user_id: str | None = Query(None, description="async: push the result to this user"),
+                priority: int = Query(DEFAULT_PRIORITY, ge=0, le=9, description="async: 0 runs first")):
+    return {"user_id": user_id, "priority": priority} if mode == "async" else None
 
+
+async def submit_job(kind: str, upload: ImageUpload, options: dict):
+    record = await job_queue.submit(kind, upload, **options)
+    return JSONResponse(std_resp(record), status_code=202)
+
+
+# image endpoints give up (and drop their queued jobs) when the client
+# disconnects
 @app.post("/analyze")
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(request: Request, file: UploadFile = File(...), job: dict | None = Depends(job_options)):
+    upload = await read_image(file)
+    if job is not None:
+        return await submit_job("scan", upload, job)
+    return with_nutrition(await cancel_on_disconnect(request, scan_upload(upload)))
 
-    food = random.choice(foods)
 
-    return {
-        "food": food[0],
-        "calories": food[1],
-        "tips": food[2]
-    }
+@app.post("/analyze/full", response_model=dict)
+async def analyze_full(request: Request, file: UploadFile = File(...)):
+    # scan + classify + weight off one decoded image
+    upload = await read_image(file)
 
+    async def run():
+        scan = with_nutrition(await scan_upload(upload))
+        return std_resp({
+            "scan": scan,
+            "classification": await classify_upload(upload),
+            "weight": scan["totals"]["grams"],
+        })
+    return await cancel_on_disconnect(request, run())
 
-@app.get("/foods")
-def foods(query: str = Query(...)):
-    # dummy list
-    return [{"name": q, "calories": 120, "protein": 10, "carbs": 15, "fats": 4} for q in [query, query+" 2"]]
 
+@app.get("/catalog/cache-stats", response_model=dict)
+async def catalog_cache_stats():
+    return std_resp(catalog_cache.stats())
 
-@app.post("/meal/log")
-def meal_log(data: dict):
-    # store in DB here
-    return {"ok": True}
+
+@app.get("/db/pool-stats", response_model=dict)
+async def db_pool_stats():
+    return std_resp(pool_status(engine.pool))
+
+
+@app.get("/executors/stats", response_model=dict)
+async def executor_stats():
+    return std_resp({**{name: p.stats() for name, p in pools.items()}, "scanner": scan_pool.stats()})
+
+
+@app.get("/jobs/stats", response_model=dict)
+async def job_stats():
+    return std_resp(job_queue.stats())
+
+
+@app.get("/jobs/{job_id}", response_model=dict)
+async def job_status(job_id: str):
+    record = await job_queue.get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return std_resp(record)
+
+
+@app.get("/user-cache/stats", response_model=dict)
+async def user_cache_stats():
+    return std_resp(user_cache.stats())
+
+
+@app.get("/trends/stats", response_model=dict)
+async def trends_stats():
+    return std_resp(trend_store.stats())
+
+
+@app.get("/ml/cache-stats", response_model=dict)
+async def ml_cache_stats():
+    return std_resp(result_cache.stats())
+
+
+# ---------- METRICS ----------
+# gauges are read from the components' own stats at scrape time
+
+Gauge("ws_connections", "Open websocket connections on this worker", lambda: manager.stats()["connections"])
+Gauge("ws_users", "Users with a websocket on this worker", lambda: manager.stats()["users"])
+Gauge("ws_queued_messages", "Messages waiting in websocket send queues", lambda: manager.stats()["queued"])
+Gauge("ws_evicted_total", "Slow websocket consumers dropped", lambda: manager.stats()["evicted"], kind="counter")
+Gauge("db_pool_connections", "DB pool connections by state",
+      lambda: {(k,): v for k, v in pool_status(engine.pool).items() if k in ("checked_out", "idle", "overflow")},
+      ("state",))
+Gauge("db_pool_waiting", "Requests waiting for a DB connection", lambda: pool_status(engine.pool)["waiting"])
+Gauge("db_pool_timeouts_total", "DB connection acquire timeouts",
+      lambda: pool_status(engine.pool)["timeouts"], kind="counter")
+Gauge("scanner_queued", "Scan requests waiting for a batch", lambda: scan_pool.stats()["queued"])
+Gauge("jobs_queued", "Async image jobs waiting in this process", lambda: job_queue.stats()["queued"])
+Gauge("scanner_batches_in_flight", "Scan batches running in workers",
+      lambda: scan_pool.stats()["batches_in_flight"])
+Gauge("executor_pending_jobs", "Queued + running jobs per executor pool",
+      lambda: {(name,): p.pending for name, p in pools.items()}, ("pool",))
+Gauge("executor_jobs_total", "Executor jobs by pool and outcome",
+      lambda: {(name, k): v for name, p in pools.items() for k, v in p.counters.items()},
+      ("pool", "outcome"), kind="counter")
+Gauge("ml_cache_events_total", "ML result cache lookups by outcome",
+      lambda: {(k,): v for k, v in result_cache.counters.items()}, ("outcome",), kind="counter")
+Gauge("user_cache_events_total", "Per-user response cache events by outcome",
+      lambda: {(k,): v for k, v in user_cache.counters.items()}, ("outcome",), kind="counter")
+Gauge("trend_store_users", "Users in the mapped trend store",
+      lambda: sum(trend_store.meta["users"]) if trend_store.ready else 0)
+Gauge("catalog_cache_events_total", "Catalog cache lookups by outcome",
+      lambda: {(k,): catalog_cache.counters[k] for k in ("hits", "misses", "invalidations")},
+      ("outcome",), kind="counter")
 
 
-@app.get("/meal/today")
-def meal_today():
-    # return logged meals
-    return {"meals": []}
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
-@app.get("/ai/suggest")
-def ai_suggest():
-    return {"suggestion": "Add a protein source to hit your goal!"}
+@app.post("/meal/log")
+def meal_log(data: dict):
+    # store in DB here
+    return {"ok": True}
 
 
 async def get_db():
     async with async_session() as session:
         yield session
 
-# ---------- UTIL ----------
+
+async def get_read_db():
+    # GET endpoints: never flushed or committed
+    async with read_session() as session:
+        yield session
 
 
-def std_resp(data, status: str = "success"):
-    return {"status": status, "data": data, "server_time": dt.datetime.utcnow().isoformat()}
+def user_tz(tz: str = Query("UTC", description="IANA zone the user's days are counted in")) -> dt.tzinfo:
+    try:
+        return get_zone(tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # ---------- LIFECYCLE ----------
 
 
+# startup only creates tables; the search index, the catalog matrix and
+# the scanner workers warm up in the background so the pod serves /health
+# immediately
+warmup = {"search_index": False, "scanner": False}
+
+
+async def _warm_up():
+    trend_store.open()   # maps what the trends job last wrote, if anything
+    async with async_session() as db:
+        await food_index.load(db)
+        catalog_matrix.load(food_index.foods())   # no await in between: no write slips past both
+    await cpu_pool.run(food_recommender.build, timeout=None)
+    gc.collect()
+    gc.freeze()   # keep the long-lived index out of gc scans
+    warmup["search_index"] = True
+    await scan_pool.warm_up()
+    warmup["scanner"] = True
+
+
+def _apply_food_changes(foods: list[dict], updated=()):
+    # bulk imports and other processes' writes skip the FoodItem ORM
+    # hooks that keep the search index, matrix and recommender in step
+    food_index.on_write_many(foods)
+    if catalog_matrix.loaded:
+        for food in foods:
+            catalog_matrix.add(food)
+    for food_id in updated:
+        food_recommender.on_update(food_id)
+
+
+async def _reload_foods(food_ids):
+    # foods another process wrote (catalog_cache.on_peer_change)
+    async with read_session() as db:
+        foods = [food_to_dict(f) for f in await get_foods_by_ids(db, food_ids)]
+    found = {f["id"] for f in foods}
+    _apply_food_changes(foods, [f["id"] for f in foods if catalog_matrix.row_of(f["id"]) is not None])
+    for food_id in food_ids:
+        if food_id not in found:   # deleted
+            food_index.on_write(None, food_id)
+            if catalog_matrix.loaded:
+                catalog_matrix.remove(food_id)
+
+
+catalog_cache.on_peer_change = _reload_foods
+
+
 @app.on_event("startup")
 async def on_start():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    app.state.warmup_task = asyncio.create_task(_warm_up())
+    app.state.catalog_listener = asyncio.create_task(catalog_cache.listen())
+
+
+@app.on_event("shutdown")
+async def on_stop():
+    app.state.warmup_task.cancel()
+    app.state.catalog_listener.cancel()
+    await scan_pool.close()
+    await job_queue.close()
+    for pool in pools.values():
+        pool.shutdown()
+    await engine.dispose()
+
+
+@app.get("/health")
+async def health():
+    # liveness: the process is up and the event loop answers
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready(db: AsyncSession = Depends(get_read_db)):
+    # readiness: DB reachable and search index loaded; the scanner is
+    # reported but /analyze queues requests until its workers are up
+    try:
+        await db.execute(text("SELECT 1"))
+        db_ok = True
+    except Exception:
+        db_ok = False
+    ok = db_ok and warmup["search_index"]
+    body = {"ready": ok, "database": db_ok, **warmup}
+    return JSONResponse(body, status_code=200 if ok else 503)
 
 # ---------- 1. FOOD SEARCH ----------
 
 
 @app.get("/foods", response_model=dict)
-async def foods(query: str = Query(..., min_length=1), db: AsyncSession = Depends(get_db)):
-    items = await get_foods_by_query(db, query)
+async def search_foods(query: str = Query(..., min_length=1)):
+    if food_index.loaded:
+        return std_resp([FoodOut(**f).dict() for f in food_index.search(query)])
+    async with read_session() as db:   # only until the index is loaded
+        items = await get_foods_by_query(db, query)
     return std_resp([FoodOut.from_orm(i).dict() for i in items])
 
+
+@app.get("/foods/{food_id}/similar", response_model=dict)
+async def similar_foods(food_id: UUID, k: int = Query(10, ge=1, le=50), db: AsyncSession = Depends(get_read_db)):
+    # nearest per-100g macro profiles (nutrition/neighbors.py)
+    if not food_recommender.ready:
+        raise HTTPException(status_code=503, detail="Catalog still loading, retry shortly",
+                            headers={"Retry-After": "1"})
+    hits = food_recommender.similar(food_id, k)
+    if hits is None:
+        raise HTTPException(status_code=404, detail="Food not found")
+    foods = await catalog_cache.get_many(db, [i for i, _ in hits])
+    return std_resp([{**FoodOut(**foods[i]).dict(), "distance": d} for i, d in hits if i in foods])
+
 # ---------- 2. LOG MEAL ----------
 
 
 @app.post("/log-meal", response_model=dict)
 async def log_meal_endpoint(payload: MealLogIn, db: AsyncSession = Depends(get_db)):
     meal = await log_meal(db, payload)   # CRUD function
+    # bump before the push: clients refetch as soon as the event arrives
+    await user_cache.bump(payload.user_id)
     await manager.send_personal(
         json.dumps({"event": "meal_update", "payload": {
                    "meal_id": str(meal.id), "calories": meal.total_calories}}),
@@ -177,20 +420,117 @@ async def log_meal_endpoint(payload: MealLogIn, db: AsyncSession = Depends(get_d
         total_carbs=meal.total_carbs,
         total_fats=meal.total_fats
     ).dict())
+
+
+@app.post("/log-meals", response_model=dict)
+async def log_meals_endpoint(payload: MealBatchIn, db: AsyncSession = Depends(get_db)):
+    items = list(payload.items)
+    if payload.saved_meal_id:
+        try:
+            saved = await expand_saved_meal(db, payload.saved_meal_id, payload.user_id)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Saved meal has a food without a valid weight")
+        if saved is None:
+            raise HTTPException(status_code=404, detail="Saved meal not found")
+        items += saved
+    if not items:
+        raise HTTPException(status_code=422, detail="Nothing to log")
+    try:
+        rows = await log_meals(db, payload.user_id, items)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    totals = {c: sum(r[c] for r in rows) for c in TOTAL_COLUMNS}
+    await user_cache.bump(payload.user_id)
+    # one aggregated event for the whole batch
+    await manager.send_personal(
+        json.dumps({"event": "meal_update", "payload": {
+                   "meal_ids": [str(r["id"]) for r in rows], "calories": totals["total_calories"]}}),
+        payload.user_id
+    )
+    return std_resp(MealBatchOut(
+        success=True, meal_ids=[r["id"] for r in rows], **totals).dict())
+
 # ---------- 3. TODAY MEALS ----------
 
 
-@app.get("/meal/today", response_model=dict)
-async def meal_today(user_id: str = Query(...), db: AsyncSession = Depends(get_db)):
-    meals = await get_today_meals(db, user_id)
-    return std_resp([{
+def meal_out(m) -> dict:
+    # a meal_rows() row as the API returns it
+    return {
         "id": str(m.id),
-        "food": m.food.name,
+        "food_id": str(m.food_id),
+        "food": m.food_name,
         "grams": m.weight_in_grams,
         "calories": m.total_calories,
         "macros": {"protein": m.total_protein, "carbs": m.total_carbs, "fats": m.total_fats},
         "time": m.time_of_meal.isoformat()
-    } for m in meals])
+    }
+
+
+# the dashboard reads below answer from user_cache until the user writes;
+# the session only takes a connection on a cache miss
+@app.get("/meal/today", response_model=dict)
+async def meal_today(request: Request, user_id: str = Query(...), tz: dt.tzinfo = Depends(user_tz),
+                     db: AsyncSession = Depends(get_read_db)):
+    async def compute():
+        return [meal_out(m) for m in await get_today_meals(db, user_id, tz)]
+    return await user_cache.respond(request, user_id, f"today:{tz}:{local_today(tz)}", compute)
+
+
+@app.get("/meals", response_model=dict)
+async def meal_history(user_id: str = Query(...), limit: int = Query(50, ge=1, le=500),
+                       cursor: str | None = Query(None), db: AsyncSession = Depends(get_read_db)):
+    # pass `next_cursor` back as `cursor` for the next (older) page
+    try:
+        rows, next_cursor = await get_meals_page(db, user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return std_resp({"items": [meal_out(m) for m in rows], "next_cursor": next_cursor})
+
+
+EXPORT_BATCH = 1000   # rows per fetch / per streamed chunk
+EXPORT_COLUMNS = ("id", "time_of_meal", "food_id", "food_name", "weight_in_grams", *TOTAL_COLUMNS)
+
+
+async def _export_chunks(user_id: str, fmt: str):
+    # own session: the request's one is closed before the body is streamed.
+    # db.stream() is a server-side cursor; one chunk per fetched partition.
+    async with read_session() as db:
+        res = await db.stream(meal_rows(user_id).execution_options(yield_per=EXPORT_BATCH))
+        if fmt == "csv":
+            yield ",".join(EXPORT_COLUMNS) + "\n"
+        async for part in res.partitions():
+            buf = io.StringIO()
+            if fmt == "csv":
+                csv.writer(buf, lineterminator="\n").writerows(part)
+            else:
+                for row in part:
+                    buf.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str) + "\n")
+            yield buf.getvalue()
+
+
+@app.get("/meals/export")
+async def meal_export(user_id: str = Query(...), format: Literal["csv", "ndjson"] = Query("csv")):
+    media = "text/csv" if format == "csv" else "application/x-ndjson"
+    # user_id is client text: a plain-ASCII filename for old clients, the
+    # exact one percent-encoded (RFC 6266) for the rest
+    name = f"meals-{user_id}.{format}"
+    plain = re.sub(r"[^A-Za-z0-9._-]", "_", name)
+    return StreamingResponse(_export_chunks(user_id, format), media_type=media, headers={
+        "Content-Disposition": f"attachment; filename=\"{plain}\"; filename*=UTF-8''{quote(name, safe='')}"})
+
+
+@app.delete("/meals/{meal_id}", response_model=dict)
+async def delete_meal_endpoint(meal_id: UUID, db: AsyncSession = Depends(get_db)):
+    meal = await delete_meal(db, meal_id)
+    if not meal:
+        raise HTTPException(status_code=404, detail="Not found")
+    await user_cache.bump(meal.user_id)
+    await manager.send_personal(
+        json.dumps({"event": "meal_update", "payload": {
+                   "meal_id": str(meal.id), "deleted": True}}),
+        meal.user_id
+    )
+    return std_resp({"deleted": str(meal_id)})
 
 # ---------- 4. SAVED MEALS ----------
 
@@ -198,13 +538,16 @@ async def meal_today(user_id: str = Query(...), db: AsyncSession = Depends(get_d
 @app.post("/saved-meals", response_model=dict)
 async def create_saved(data: SavedMealIn, db: AsyncSession = Depends(get_db)):
     sm = await save_meal(db, data.user_id, data.meal_name, data.foods)
+    await user_cache.bump(data.user_id)
     return std_resp({"id": str(sm.id), "meal_name": sm.meal_name})
 
 
 @app.get("/saved-meals", response_model=dict)
-async def list_saved(user_id: str = Query(...), db: AsyncSession = Depends(get_db)):
-    meals = await get_saved_meals(db, user_id)
-    return std_resp([{"id": str(m.id), "meal_name": m.meal_name, "foods": m.list_of_food_ids} for m in meals])
+async def list_saved(request: Request, user_id: str = Query(...), db: AsyncSession = Depends(get_read_db)):
+    async def compute():
+        meals = await get_saved_meals(db, user_id)
+        return [{"id": str(m.id), "meal_name": m.meal_name, "foods": m.list_of_food_ids} for m in meals]
+    return await user_cache.respond(request, user_id, "saved", compute)
 
 
 @app.delete("/saved-meals/{meal_id}", response_model=dict)
@@ -214,69 +557,91 @@ async def delete_saved(meal_id: UUID, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Not found")
     await db.delete(stmt)
     await db.commit()
+    await user_cache.bump(stmt.user_id)
     return std_resp({"deleted": str(meal_id)})
 
 # ---------- 5. PROGRESS GRAPH ----------
 
 
 @app.get("/progress", response_model=dict)
-async def progress(user_id: str = Query(...), days: int = Query(30, ge=1), db: AsyncSession = Depends(get_db)):
-    data = await get_progress(db, user_id, days)
-    return std_resp(data)
+async def progress(request: Request, user_id: str = Query(...), days: int = Query(30, ge=1),
+                   tz: dt.tzinfo = Depends(user_tz), db: AsyncSession = Depends(get_read_db)):
+    return await user_cache.respond(request, user_id, f"progress:{days}:{tz}:{local_today(tz)}",
+                                    lambda: get_progress(db, user_id, days, tz))
 
 # ---------- 6. WEEKLY ANALYTICS ----------
 
 
 @app.get("/weekly-analytics", response_model=dict)
-async def weekly(user_id: str = Query(...), db: AsyncSession = Depends(get_db)):
-    rows = await get_weekly_analytics(db, user_id)
-    return std_resp([{
-        "date": r.date.strftime("%Y-%m-%d"),
-        "total_calories": r.total_calories,
-        "total_protein": r.total_protein,
-        "total_carbs": r.total_carbs,
-        "total_fats": r.total_fats
-    } for r in rows])
+async def weekly(request: Request, user_id: str = Query(...), db: AsyncSession = Depends(get_read_db)):
+    async def compute():
+        rows = await get_weekly_analytics(db, user_id)
+        return [{
+            "date": r.date.strftime("%Y-%m-%d"),
+            "total_calories": r.total_calories,
+            "total_protein": r.total_protein,
+            "total_carbs": r.total_carbs,
+            "total_fats": r.total_fats
+        } for r in rows]
+    return await user_cache.respond(request, user_id, "weekly", compute)
 
 # ---------- 7. AI SUGGEST ----------
 
 
 @app.get("/ai/suggest", response_model=dict)
-async def suggest(user_id: str = Query(...), db: AsyncSession = Depends(get_db)):
-    # dummy logic
-    meals = await get_today_meals(db, user_id)
-    total_p = sum(m.total_protein for m in meals)
-    if total_p < 50:
-        return std_resp({"suggestion": "Add a protein source (eggs, peanut-butter) to hit your goal!"})
-    return std_resp({"suggestion": "Great macro balance today!"})
+async def suggest(user_id: str = Query(...),
+                  calories: float = Query(float(REFERENCE_DAY[0]), gt=0),
+                  protein: float = Query(float(REFERENCE_DAY[1]), ge=0),
+                  carbs: float = Query(float(REFERENCE_DAY[2]), ge=0),
+                  fats: float = Query(float(REFERENCE_DAY[3]), ge=0),
+                  k: int = Query(5, ge=1, le=20), tz: dt.tzinfo = Depends(user_tz),
+                  db: AsyncSession = Depends(get_read_db)):
+    # today's remaining macros against the targets, and the foods/portions
+    # that close most of that gap
+    eaten = (await get_today_totals(db, user_id, tz)).values()
+    targets = {"calories": calories, "protein": protein, "carbs": carbs, "fats": fats}
+    gap = {m: round(t - e, 1) for (m, t), e in zip(targets.items(), eaten)}
+    foods = food_recommender.fill_gap(list(gap.values()), k) if food_recommender.ready else []
+    # the macro furthest behind, relative to its target
+    short = max(("protein", "carbs", "fats"), key=lambda m: gap[m] / max(targets[m], 1))
+    if gap[short] <= 0.1 * targets[short] or not foods:
+        message = "Great macro balance today!"
+    else:
+        top = foods[0]
+        message = f"You're {gap[short]:.0f} g short on {short}: try {top['grams']:.0f} g of {top['name']}."
+    return std_resp({"suggestion": message, "gap": gap, "foods": foods})
 
 # ---------- 8. ML WEIGHT ----------
 
 
 @app.post("/predict-weight", response_model=dict)
-async def predict_weight(file: UploadFile = File(...)):
-    image = Image.open(io.BytesIO(await file.read()))
-    weight = predict_weight(image)
-    return std_resp({"weight": weight})
+async def predict_weight_endpoint(request: Request, file: UploadFile = File(...),
+                                  job: dict | None = Depends(job_options)):
+    upload = await read_image(file)
+    if job is not None:
+        return await submit_job("weight", upload, job)
+    return std_resp(await cancel_on_disconnect(request, weigh_upload(upload)))
 
 # ---------- 9. ML CLASSIFY ----------
 
 
 @app.post("/classify-food", response_model=dict)
-async def classify_food(file: UploadFile = File(...)):
-    image = Image.open(io.BytesIO(await file.read()))
-    name, conf = classify_food(image)
-    return std_resp({"food_name": name, "confidence": conf})
+async def classify_food_endpoint(request: Request, file: UploadFile = File(...),
+                                 job: dict | None = Depends(job_options)):
+    upload = await read_image(file)
+    if job is not None:
+        return await submit_job("classify", upload, job)
+    return std_resp(await cancel_on_disconnect(request, classify_upload(upload)))
 
 # ---------- 10. BARCODE ----------
 
 
 @app.get("/barcode/{code}", response_model=dict)
-async def barcode(code: str, db: AsyncSession = Depends(get_db)):
-    food = await db.scalar(select(FoodItem).where(FoodItem.barcode == code))
+async def barcode(code: str, db: AsyncSession = Depends(get_read_db)):
+    food = await catalog_cache.get_by_barcode(db, code)
     if food:
-        return std_resp({"food_name": food.name, "calories": food.calories,
-                         "macros": {"protein": food.protein, "carbs": food.carbs, "fats": food.fats}})
+        return std_resp({"food_name": food["name"], "calories": food["calories"],
+                         "macros": {"protein": food["protein"], "carbs": food["carbs"], "fats": food["fats"]}})
     # fallback Nutritionix (needs API key) – dummy here
     return std_resp({"food_name": "Unknown", "calories": 0, "macros": {"protein": 0, "carbs": 0, "fats": 0}})
 
@@ -285,16 +650,100 @@ async def barcode(code: str, db: AsyncSession = Depends(get_db)):
 
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
+    conn = await manager.connect(websocket, user_id)
     try:
         while True:
             await websocket.receive_text()  # keep alive
     except WebSocketDisconnect:
-        await manager.disconnect(user_id)
+        pass
+    finally:
+        await manager.disconnect(conn)
+
+
+# ---------- 12. MEAL PLAN ----------
+
+
+@app.post("/meal-plan", response_model=dict)
+async def meal_plan(req: MealPlanIn, request: Request, db: AsyncSession = Depends(get_read_db)):
+    targets = {}
+    if req.profile is not None:
+        t = nutrition_targets([req.profile])[0]
+        targets = {"calories": t["daily_calories"], **t["macros"]}
+    for m in ("calories", "protein", "carbs", "fats"):
+        if getattr(req, m) is not None:
+            targets[m] = getattr(req, m)
+    if len(targets) < 4:
+        raise HTTPException(status_code=422, detail="Give a profile or all of calories/protein/carbs/fats")
+    if not catalog_matrix.loaded:
+        raise HTTPException(status_code=503, detail="Catalog still loading, retry shortly",
+                            headers={"Retry-After": "1"})
+    favorites = await get_favorite_food_ids(db, req.user_id) if req.user_id else ()
+    plan = cpu_pool.run(plan_meals, catalog_matrix, targets, req.exclude_ids,
+                        req.exclude_terms, favorites, req.items)
+    return std_resp(await cancel_on_disconnect(request, plan))
+
+# ---------- 13. TRENDS ----------
+# long-range series from the columnar trend store (nutrition/trends.py),
+# refreshed from daily_totals every TRENDS_REFRESH_S; days are UTC days
+
+
+def _trend_series(user_id: str, days: int):
+    trend_store.maybe_reload()
+    if not trend_store.ready:
+        raise HTTPException(status_code=503, detail="Trend store not built yet",
+                            headers={"Retry-After": "60"})
+    last = dt.datetime.utcnow().date()
+    first = last - dt.timedelta(days=days - 1)
+    return first, last, trend_store.series(user_id, first, last)
+
+
+@app.get("/trends", response_model=dict)
+async def trends(user_id: str = Query(...), days: int = Query(90, ge=1, le=TRENDS_DAYS),
+                 metric: Literal["calories", "protein", "carbs", "fats"] = "calories",
+                 windows: str = Query("7,30", description="moving-average windows in days"),
+                 span: int = Query(7, ge=1, le=TRENDS_DAYS)):
+    try:
+        sizes = sorted({int(w) for w in windows.split(",") if w.strip()})
+    except ValueError:
+        raise HTTPException(status_code=422, detail="windows must be comma-separated day counts")
+    if not sizes or sizes[0] < 1 or sizes[-1] > TRENDS_DAYS:
+        raise HTTPException(status_code=422, detail=f"windows must be between 1 and {TRENDS_DAYS} days")
+    first, last, series = _trend_series(user_id, days)
+    return std_resp({"user_id": user_id, "from": first.isoformat(), "to": last.isoformat(),
+                     "as_of": trend_store.meta["refreshed_at"],
+                     **trend_report(series, first, metric, sizes, span)})
+
+
+@app.get("/trends/weekly", response_model=dict)
+async def trends_weekly(user_id: str = Query(...), weeks: int = Query(12, ge=1, le=TRENDS_DAYS // 7)):
+    first, last, series = _trend_series(user_id, weeks * 7)
+    return std_resp({"user_id": user_id, "as_of": trend_store.meta["refreshed_at"],
+                     "weeks": weekly_report(series, last, weeks)})
+
+
+@app.get("/trends/streaks", response_model=dict)
+async def trends_streaks(user_id: str = Query(...), days: int = Query(365, ge=1, le=TRENDS_DAYS),
+                         calories: float = Query(float(REFERENCE_DAY[0]), gt=0),
+                         tolerance: float = Query(0.1, gt=0, le=1)):
+    first, last, series = _trend_series(user_id, days)
+    return std_resp({"user_id": user_id, "from": first.isoformat(), "to": last.isoformat(),
+                     "as_of": trend_store.meta["refreshed_at"],
+                     **streak_report(series, calories, tolerance)})
+
+
+@app.post("/catalog/import", response_model=dict)
+async def catalog_import(file: UploadFile = File(...),
+                         format: Literal["csv", "ndjson"] | None = Query(None, description="default: from the file name")):
+    # streams the upload (CSV/TSV or NDJSON, optionally .gz) into
+    # food_items; see database/ingest.py
+    name = file.filename or ""
+    records = read_records(text_stream(file.file, name), format or detect_format(name))
+    return std_resp(await ingest(records, on_batch=_apply_food_changes))
 
 
 @app.post("/seed", response_model=dict)
-async def seed(db: AsyncSession = Depends(get_db)):
+async def seed():
+    # upserts on name, so seeding again changes nothing
     samples = [
         {"name": "rice", "calories": 130, "protein": 2.7, "carbs": 28, "fats": 0.3},
         {"name": "chicken breast", "calories": 165,
@@ -302,7 +751,5 @@ async def seed(db: AsyncSession = Depends(get_db)):
         {"name": "apple", "calories": 52, "protein": 0.3, "carbs": 14, "fats": 0.2},
         {"name": "egg", "calories": 155, "protein": 13, "carbs": 1.1, "fats": 11},
     ]
-    for s in samples:
-        db.add(FoodItem(**s))
-    await db.commit()
+    await ingest(enumerate(samples, 1), on_batch=_apply_food_changes)
     return {"status": "success", "data": "seeded"}
@@ -0,0 +1,327 @@
+# metrics.py
+# In-process metrics in the Prometheus text exposition format, served on
+# /metrics. Histograms and counters are updated from the event loop
+# thread; gauges are callbacks read at scrape time, so they cost nothing
+# between scrapes. With METRICS_ENABLED=0 the decorators hand back the
+# undecorated function, timers are a shared no-op and nothing is
+# installed on the app or the engine.
+# Each process keeps its own registry: scrape every API worker, and the
+# Celery worker on CELERY_METRICS_PORT.
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import random
+import time
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))   # 0 = profiler off
+PROFILE_SAMPLE = float(os.getenv("PROFILE_SAMPLE", "0.05"))  # share of requests profiled
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")                   # else profiles go to the log
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+log = logging.getLogger(__name__)
+_registry: list = []
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for n, v in zip(names, values):
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{n}="{v}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    # fn() -> number, or {label values tuple: number}
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labels=(), kind: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind   # "counter" for monotonic totals read from elsewhere
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []   # the source is not up yet
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_labels(self.labelnames, k)} {float(v)}" for k, v in value.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}   # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, *labels):
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect.bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels) if ENABLED else _NOOP
+
+    def samples(self):
+        out = []
+        for labels, s in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), s[:-1]):
+                cumulative += n
+                out.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (bound,))} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {s[-1]}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return out
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NOOP = _NoopTimer()
+
+
+def render() -> str:
+    if not ENABLED:
+        return "# metrics disabled (METRICS_ENABLED=0)\n"
+    return "\n".join(line for m in _registry for line in m.render()) + "\n"
+
+
+# ---------- METRICS ----------
+
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route template",
+                         ("method", "route"))
+HTTP_REQUESTS = Counter("http_requests_total", "Requests by route template and status",
+                        ("method", "route", "status"))
+DB_CALL_SECONDS = Histogram("db_call_duration_seconds", "Time in each CRUD function", ("function",))
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Per-statement time, by calling CRUD function",
+                             ("function",))
+ML_STAGE_SECONDS = Histogram("ml_stage_duration_seconds", "ML pipeline stages (per batch where batched)",
+                             ("model", "stage"))
+ML_BATCH_SIZE = Histogram("ml_batch_size", "Images per inference batch", ("model",),
+                          buckets=(1, 2, 4, 8, 16, 32))
+REDIS_PUBLISH_SECONDS = Histogram("redis_publish_duration_seconds", "Redis PUBLISH latency", ("channel",))
+TASK_SECONDS = Histogram("celery_task_duration_seconds", "Celery task run time", ("task", "state"),
+                         buckets=(.1, .5, 1, 5, 15, 60, 300, 900, 3600))
+
+
+# ---------- DB ----------
+
+_db_function = contextvars.ContextVar("db_function", default="other")
+
+
+def db_timed(fn):
+    # CRUD functions: time the call and tag the statements it runs
+    if not ENABLED:
+        return fn
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        token = _db_function.set(name)
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            DB_CALL_SECONDS.observe(time.perf_counter() - start, name)
+            _db_function.reset(token)
+    return wrapper
+
+
+def instrument_engine(engine):
+    if not ENABLED:
+        return
+    from sqlalchemy import event
+
+    # (execution context, start) per statement running on the connection
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append((context, time.perf_counter()))
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERY_SECONDS.observe(time.perf_counter() - conn.info["query_start"].pop()[1], _db_function.get())
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def _failed(ctx):
+        # a statement that raised never reaches after_cursor_execute: drop
+        # its entry so later timings on this connection stay its own
+        starts = ctx.connection.info.get("query_start") if ctx.connection is not None else None
+        if starts and starts[-1][0] is ctx.execution_context:
+            starts.pop()
+
+
+# ---------- HTTP ----------
+
+class MetricsMiddleware:
+    # plain ASGI (no BaseHTTPMiddleware): times until the last body chunk,
+    # so streamed responses are measured whole
+    def __init__(self, app):
+        self.app = app
+        self._profiling = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        profiler = self._maybe_profile()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.observe(elapsed, scope["method"], route)
+            HTTP_REQUESTS.inc(scope["method"], route, status[0])
+            if profiler is not None:
+                self._finish_profile(profiler, elapsed, scope["method"], route)
+
+    # ---------- SLOW-REQUEST PROFILER ----------
+    # pyinstrument (optional) samples PROFILE_SAMPLE of requests, one at a
+    # time; the profile is kept only when the request was slow
+
+    def _maybe_profile(self):
+        if not PROFILE_SLOW_MS or self._profiling or random.random() >= PROFILE_SAMPLE:
+            return None
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            return None
+        self._profiling = True
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        return profiler
+
+    def _finish_profile(self, profiler, elapsed: float, method: str, route: str):
+        try:
+            profiler.stop()
+            if elapsed * 1000 < PROFILE_SLOW_MS:
+                return
+            text = profiler.output_text(unicode=False, color=False)
+            if PROFILE_DIR:
+                name = f"{int(time.time() * 1000)}-{method}-{route.strip('/').replace('/', '_') or 'root'}.txt"
+                with open(os.path.join(PROFILE_DIR, name), "w") as f:
+                    f.write(text)
+            else:
+                log.warning("slow request %s %s (%.0f ms)\n%s", method, route, elapsed * 1000, text)
+        finally:
+            self._profiling = False
+
+
+def install(app, engine):
+    if not ENABLED:
+        return
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(engine)
+
+
+# ---------- CELERY ----------
+
+def instrument_celery():
+    # task durations, plus /metrics on CELERY_METRICS_PORT in the worker
+    if not ENABLED:
+        return
+    from celery.signals import task_prerun, task_postrun, worker_ready
+    started: dict[str, float] = {}
+
+    @task_prerun.connect(weak=False)
+    def _start(task_id=None, **kw):
+        started[task_id] = time.perf_counter()
+
+    @task_postrun.connect(weak=False)
+    def _stop(task_id=None, task=None, state=None, **kw):
+        start = started.pop(task_id, None)
+        if start is not None:
+            TASK_SECONDS.observe(time.perf_counter() - start, task.name, state or "UNKNOWN")
+
+    @worker_ready.connect(weak=False)
+    def _serve(**kw):
+        port = int(os.getenv("CELERY_METRICS_PORT", "0"))
+        if port:
+            serve(port)
+
+
+def serve(port: int):
+    # /metrics over a bare HTTP server thread, for processes without an API
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
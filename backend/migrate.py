@@ -0,0 +1,43 @@
+# Bring an existing database up to the current models. create_all() only
+# creates missing tables; this also creates indexes declared on the models
+# that an older database lacks. Safe to re-run.
+#   python migrate.py
+import asyncio
+from sqlalchemy import inspect, text
+from database.config import engine, Base
+import database.models  # noqa: F401  (registers the tables on Base)
+
+
+def _index_names(conn, insp, table: str) -> set:
+    if conn.dialect.name == "sqlite":   # its reflection leaves out expression indexes
+        return set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                     "AND tbl_name = :t"), {"t": table}).scalars())
+    return {ix["name"] for ix in insp.get_indexes(table)}
+
+
+def _create_missing_indexes(conn):
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = _index_names(conn, insp, table.name)
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+                print(f"created index {index.name}")
+
+
+async def go():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # keep one row (the lowest id) per duplicated (user, day) so the
+        # unique index can be built; the analytics job only rebuilds the
+        # trailing window, so older days have to survive
+        await conn.execute(text(
+            "DELETE FROM weekly_analytics WHERE EXISTS ("
+            " SELECT 1 FROM weekly_analytics AS o"
+            " WHERE o.user_id = weekly_analytics.user_id AND o.date = weekly_analytics.date"
+            " AND o.id < weekly_analytics.id)"))
+        await conn.run_sync(_create_missing_indexes)
+    print("migrations ok")
+
+if __name__ == "__main__":
+    asyncio.run(go())
@@ -1,10 +1,15 @@
 # ml/analyze.py
 from fastapi import UploadFile, File
-from ml.scanner import scan_food
-from main import std_resp   # or wherever you placed std_resp
+from ml.inference import scan_pool
+from ml.preprocess import read_upload, ImageUpload
+from ml.cache import result_cache
+from utils import std_resp
 
 
 async def analyze(file: UploadFile = File(...)):
-    contents = await file.read()
-    result = scan_food(contents)
+    upload = ImageUpload(await read_upload(file))
+
+    async def run():
+        return await scan_pool.submit(await upload.image())
+    result = await result_cache.get_or_compute("scan", upload.digest, run)
     return std_resp(result)
@@ -0,0 +1,98 @@
+# ml/cache.py
+# Content-addressed cache for image-analysis results. Keys are a hash of
+# the raw upload bytes (ImageUpload.digest), so a retried or re-sent photo skips decode and
+# inference. Two tiers: a per-process LRU with TTL, then Redis (shared by
+# all API workers). Redis errors degrade to a miss, never to a 500.
+import json
+import os
+import time
+from collections import OrderedDict
+import redis.asyncio as redis
+from database.config import REDIS_URL
+
+CACHE_TTL = int(os.getenv("ML_CACHE_TTL", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("ML_CACHE_MAX_ENTRIES", "4096"))
+CACHE_MAX_BYTES = int(float(os.getenv("ML_CACHE_MAX_MB", "32")) * 1024 * 1024)
+
+
+class ResultCache:
+    def __init__(self, redis_client=None, ttl: int = CACHE_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 prefix: str = "mlcache"):
+        self.redis = redis_client    # any redis.asyncio-compatible client (or fakeredis)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self._local: OrderedDict[str, tuple[float, str]] = OrderedDict()  # key -> (expires, json)
+        self._bytes = 0
+        self.counters = {"local_hits": 0, "redis_hits": 0, "misses": 0, "redis_errors": 0}
+
+    def _key(self, kind: str, digest: str) -> str:
+        return f"{self.prefix}:{kind}:{digest}"
+
+    async def get(self, kind: str, digest: str):
+        key = self._key(kind, digest)
+        entry = self._local.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._local.move_to_end(key)
+                self.counters["local_hits"] += 1
+                return json.loads(entry[1])
+            self._drop(key)
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(key)
+            except (redis.RedisError, OSError):
+                self.counters["redis_errors"] += 1
+                raw = None
+            if raw is not None:
+                self.counters["redis_hits"] += 1
+                self._store(key, raw)
+                return json.loads(raw)
+        self.counters["misses"] += 1
+        return None
+
+    async def set(self, kind: str, digest: str, value):
+        key = self._key(kind, digest)
+        raw = json.dumps(value)
+        self._store(key, raw)
+        if self.redis is not None:
+            try:
+                await self.redis.set(key, raw, ex=self.ttl)
+            except (redis.RedisError, OSError):
+                self.counters["redis_errors"] += 1
+
+    async def get_or_compute(self, kind: str, digest: str, compute):
+        # compute: zero-arg coroutine function, only awaited on a miss
+        value = await self.get(kind, digest)
+        if value is None:
+            value = await compute()
+            await self.set(kind, digest, value)
+        return value
+
+    def stats(self) -> dict:
+        hits = self.counters["local_hits"] + self.counters["redis_hits"]
+        total = hits + self.counters["misses"]
+        return {**self.counters, "hit_ratio": round(hits / total, 4) if total else 0.0,
+                "entries": len(self._local), "bytes": self._bytes}
+
+    def clear(self):
+        self._local.clear()
+        self._bytes = 0
+
+    def _store(self, key: str, raw: str):
+        self._drop(key)
+        self._local[key] = (time.monotonic() + self.ttl, raw)
+        self._bytes += len(raw)
+        while self._local and (len(self._local) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, old_raw) = self._local.popitem(last=False)
+            self._bytes -= len(old_raw)
+
+    def _drop(self, key: str):
+        entry = self._local.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+
+result_cache = ResultCache(redis.from_url(REDIS_URL, decode_responses=True))
@@ -1,8 +1,8 @@
 import random
-from PIL import Image
+import numpy as np
 
 
-def classify_food(image: Image.Image) -> tuple[str, float]:
+def classify_food(image: np.ndarray) -> tuple[str, float]:
     # dummy
     foods = ["pizza", "salad", "rice", "apple", "steak"]
     food = random.choice(foods)
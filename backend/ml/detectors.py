@@ -0,0 +1,313 @@
+# ml/detectors.py
+# Detector backends behind the food scanner. Each one takes a batch of
+# uint8 RGB images in three steps (prepare -> infer -> decode, timed
+# separately by the scanner) and returns one Detections per image:
+#   torch  ultralytics YOLO on PyTorch
+#   onnx   the same weights exported once to ONNX and INT8-quantized,
+#          run by ONNX Runtime on CPU (onnxruntime; export needs
+#          ultralytics + onnx). The file is cached in SCANNER_ONNX_DIR.
+#   fake   deterministic stand-in for tests and benches
+# SCANNER_BACKEND picks one, SCANNER_MODEL the YOLO variant (yolov8n/s/m/
+# l/x.pt) and the scanner's SCANNER_THREADS the intra-op threads.
+#
+#   python -m ml.detectors export --model yolov8s.pt --calibration ../frontendfinal/src
+import argparse
+import ast
+import contextlib
+import fcntl
+import logging
+import os
+import time
+import zlib
+from pathlib import Path
+import numpy as np
+from ml.preprocess import MODEL_INPUT_SIZE, decode_image
+
+FAKE_MODEL = os.getenv("SCANNER_FAKE_MODEL", "0") == "1"   # same as SCANNER_BACKEND=fake
+BACKEND = os.getenv("SCANNER_BACKEND", "fake" if FAKE_MODEL else "torch")
+MODEL_NAME = os.getenv("SCANNER_MODEL", "yolov8x.pt")
+IOU_THRESHOLD = float(os.getenv("SCANNER_IOU", "0.7"))   # NMS, as in ultralytics
+MAX_DETECTIONS = 300
+FAKE_LATENCY_MS = float(os.getenv("SCANNER_FAKE_LATENCY_MS", "0"))
+
+ONNX_DIR = os.getenv("SCANNER_ONNX_DIR", "./data/models")
+# static: INT8 weights and activations, calibrated on SCANNER_CALIBRATION_DIR
+# (falls back to dynamic without images); dynamic: INT8 weights only; none: FP32
+QUANTIZE = os.getenv("SCANNER_QUANTIZE", "static")
+CALIBRATION_DIR = os.getenv("SCANNER_CALIBRATION_DIR", "")
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".jfif", ".png", ".webp", ".bmp")
+
+log = logging.getLogger(__name__)
+
+
+class Detections:
+    # one image's boxes: cls (n,) int, conf (n,) float, xyxyn (n, 4)
+    # corners as fractions of the image; names maps class id -> label
+    __slots__ = ("cls", "conf", "xyxyn", "names")
+
+    def __init__(self, cls, conf, xyxyn, names: dict):
+        self.cls = np.asarray(cls, dtype=np.int64)
+        self.conf = np.asarray(conf, dtype=np.float64)
+        self.xyxyn = np.asarray(xyxyn, dtype=np.float64).reshape(-1, 4)
+        self.names = names
+
+
+def load_detector(backend: str = BACKEND, model: str = MODEL_NAME, threads: int = 1,
+                  conf: float = 0.25, imgsz: int = MODEL_INPUT_SIZE, quantize: str = QUANTIZE,
+                  calibration: str = CALIBRATION_DIR):
+    if backend == "torch":
+        return TorchDetector(model, threads, conf, imgsz)
+    if backend == "onnx":
+        return OnnxDetector(onnx_weights(model, imgsz, quantize, calibration), threads, conf)
+    if backend == "fake":
+        return FakeDetector()
+    raise ValueError(f"unknown SCANNER_BACKEND {backend!r} (torch, onnx or fake)")
+
+
+# ---------- TORCH ----------
+
+class TorchDetector:
+    name = "torch"
+
+    def __init__(self, model: str, threads: int, conf: float, imgsz: int):
+        import torch
+        from ultralytics import YOLO
+        torch.set_num_threads(threads)
+        self.model = YOLO(model)
+        self.conf = conf
+        self.imgsz = imgsz
+
+    def prepare(self, images: list):
+        # ultralytics reads raw arrays as BGR (OpenCV order)
+        return [np.ascontiguousarray(img[..., ::-1]) for img in images]
+
+    def infer(self, batch):
+        return self.model(batch, conf=self.conf, iou=IOU_THRESHOLD, imgsz=self.imgsz, verbose=False)
+
+    def decode(self, results, batch) -> list[Detections]:
+        out = []
+        for r in results:
+            boxes = r.boxes.cpu().numpy()
+            out.append(Detections(boxes.cls, boxes.conf, boxes.xyxyn, r.names))
+        return out
+
+
+# ---------- ONNX ----------
+
+def letterbox(images: list, size: int) -> tuple[np.ndarray, np.ndarray]:
+    # images -> (N, 3, size, size) float32 in [0, 1], each resized to fit
+    # and centred on grey like ultralytics' LetterBox, plus per image
+    # (scale, pad x, pad y, width, height) to map boxes back
+    from PIL import Image
+    canvas = np.full((len(images), size, size, 3), 114, dtype=np.uint8)
+    geometry = np.empty((len(images), 5), dtype=np.float32)
+    for i, img in enumerate(images):
+        h, w = img.shape[:2]
+        r = min(size / h, size / w)
+        nw, nh = round(w * r), round(h * r)
+        if (nw, nh) != (w, h):
+            img = np.asarray(Image.fromarray(img).resize((nw, nh), Image.BILINEAR))
+        left, top = (size - nw) // 2, (size - nh) // 2
+        canvas[i, top:top + nh, left:left + nw] = img
+        geometry[i] = (r, left, top, w, h)
+    x = np.empty((len(images), 3, size, size), dtype=np.float32)
+    np.multiply(canvas.transpose(0, 3, 1, 2), np.float32(1 / 255), out=x)
+    return x, geometry
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    # one xyxy box against (n, 4)
+    lt = np.maximum(box[:2], boxes[:, :2])
+    rb = np.minimum(box[2:], boxes[:, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=1)
+    area = lambda b: (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / (area(box) + area(boxes) - inter + 1e-9)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, cls: np.ndarray, iou: float,
+        max_det: int = MAX_DETECTIONS) -> np.ndarray:
+    # class-aware greedy NMS (each class's boxes shifted to their own
+    # region, as torchvision's batched_nms); indices, best first
+    shifted = boxes + (cls * 4096.0)[:, None]
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size and len(keep) < max_det:
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        order = rest[box_iou(shifted[i], shifted[rest]) <= iou]
+    return np.asarray(keep, dtype=np.int64)
+
+
+class OnnxDetector:
+    name = "onnx"
+
+    def __init__(self, path: str, threads: int, conf: float):
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.input = self.session.get_inputs()[0].name
+        meta = self.session.get_modelmeta().custom_metadata_map   # written by the export
+        self.names = {int(k): v for k, v in ast.literal_eval(meta["names"]).items()}
+        imgsz = ast.literal_eval(meta.get("imgsz", str(MODEL_INPUT_SIZE)))   # e.g. "[640, 640]"
+        self.imgsz = int(imgsz[0] if isinstance(imgsz, (list, tuple)) else imgsz)
+        self.conf = conf
+
+    def prepare(self, images: list):
+        return letterbox(images, self.imgsz)
+
+    def infer(self, batch):
+        return self.session.run(None, {self.input: batch[0]})[0]
+
+    def decode(self, raw: np.ndarray, batch) -> list[Detections]:
+        # raw: (N, 4 + classes, anchors), boxes as centre x/y, width, height
+        # in letterboxed pixels
+        out = []
+        for pred, (r, left, top, w, h) in zip(raw, batch[1]):
+            scores = pred[4:]
+            cls = scores.argmax(axis=0)
+            conf = np.take_along_axis(scores, cls[None], axis=0)[0]
+            cand = np.flatnonzero(conf >= self.conf)
+            cx, cy, bw, bh = pred[:4, cand]
+            boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+            keep = nms(boxes, conf[cand], cls[cand], IOU_THRESHOLD)
+            xyxy = (boxes[keep] - (left, top, left, top)) / r
+            xyxyn = np.clip(xyxy / (w, h, w, h), 0, 1)
+            out.append(Detections(cls[cand][keep], conf[cand][keep], xyxyn, self.names))
+        return out
+
+
+@contextlib.contextmanager
+def _exclusive(path: str):
+    # workers start together: the first one exports, the rest wait for it
+    with open(path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def onnx_weights(model: str = MODEL_NAME, imgsz: int = MODEL_INPUT_SIZE, quantize: str = QUANTIZE,
+                 calibration: str = CALIBRATION_DIR) -> str:
+    # path of the exported (and quantized) model, creating it on first use
+    stem = Path(model).stem
+    fp32 = os.path.join(ONNX_DIR, f"{stem}-{imgsz}.onnx")
+    path = fp32 if quantize == "none" else os.path.join(ONNX_DIR, f"{stem}-{imgsz}-{quantize}.onnx")
+    if os.path.exists(path):
+        return path
+    os.makedirs(ONNX_DIR, exist_ok=True)
+    with _exclusive(os.path.join(ONNX_DIR, ".export.lock")):
+        if os.path.exists(path):
+            return path
+        if not os.path.exists(fp32):
+            from ultralytics import YOLO
+            t = time.perf_counter()
+            exported = YOLO(model).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+            os.replace(exported, fp32)   # written next to the .pt
+            log.info("scanner: exported %s to %s in %.0fs", model, fp32, time.perf_counter() - t)
+        if quantize != "none":
+            t = time.perf_counter()
+            _quantize(fp32, path, quantize, calibration, imgsz)
+            log.info("scanner: %s INT8 model %s in %.0fs", quantize, path, time.perf_counter() - t)
+    return path
+
+
+def _calibration_images(directory: str) -> list[Path]:
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(p for p in Path(directory).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def _quantize(src: str, dst: str, mode: str, calibration: str, imgsz: int):
+    import onnx
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_dynamic, quantize_static)
+    images = _calibration_images(calibration)
+    if mode == "static" and not images:
+        log.warning("scanner: no calibration images in %r, quantizing weights only", calibration)
+        mode = "dynamic"
+    tmp = dst + ".tmp"
+    if mode == "dynamic":
+        quantize_dynamic(src, tmp, weight_type=QuantType.QUInt8)
+    elif mode == "static":
+        graph = onnx.load(src).graph
+        name = graph.input[0].name
+
+        class Reader(CalibrationDataReader):
+            def __init__(self):
+                self.files = iter(images)
+
+            def get_next(self):
+                path = next(self.files, None)
+                if path is None:
+                    return None
+                return {name: letterbox([decode_image(path.read_bytes(), imgsz)], imgsz)[0]}
+
+        # the detect head (the module of the last node, /model.22/ on v8)
+        # concatenates box coordinates (0..640) with class scores (0..1):
+        # one INT8 scale cannot hold both, so all but its convs stay float
+        prefix = "/".join(graph.node[-1].name.split("/")[:2]) + "/"
+        head = [n.name for n in graph.node if n.name.startswith(prefix) and n.op_type != "Conv"]
+        quantize_static(src, tmp, Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        nodes_to_exclude=head)
+    else:
+        raise ValueError(f"unknown SCANNER_QUANTIZE {mode!r} (static, dynamic or none)")
+    # keep the class names and input size the export stored
+    quantized, exported = onnx.load(tmp), onnx.load(src)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(exported.metadata_props)
+    onnx.save(quantized, tmp)
+    os.replace(tmp, dst)
+
+
+# ---------- FAKE ----------
+
+class FakeDetector:
+    # one "forward pass" per call, costing a fixed overhead plus a per-image
+    # share, so batching behaves like the real thing in benchmarks. Each
+    # image gets 1-3 foods (and sometimes a table, which is filtered out)
+    # derived from its bytes
+    name = "fake"
+    names = {46: "banana", 47: "apple", 48: "sandwich", 49: "orange",
+             50: "broccoli", 51: "carrot", 52: "hot dog", 53: "pizza",
+             54: "donut", 55: "cake", 60: "dining table"}
+
+    def prepare(self, images: list):
+        return images
+
+    def infer(self, batch):
+        if FAKE_LATENCY_MS:
+            time.sleep(FAKE_LATENCY_MS * (1 + 0.25 * len(batch)) / 1000)
+        return [zlib.crc32(img if isinstance(img, bytes) else img.tobytes()) for img in batch]
+
+    def decode(self, seeds, batch) -> list[Detections]:
+        out = []
+        for seed in seeds:
+            rng = np.random.default_rng(seed)
+            n = 1 + seed % 3
+            cls = 46 + rng.permutation(10)[:n]
+            conf = rng.uniform(0.5, 0.99, n)
+            xy = rng.uniform(0, 0.5, (n, 2))
+            xyxyn = np.hstack([xy, xy + rng.uniform(0.2, 0.5, (n, 2))])
+            if seed % 4 == 0:
+                cls, conf = np.append(cls, 60), np.append(conf, 0.9)
+                xyxyn = np.vstack([xyxyn, [0, 0.3, 1, 1]])
+            out.append(Detections(cls, conf, xyxyn, self.names))
+        return out
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=("export",))
+    ap.add_argument("--model", default=MODEL_NAME)
+    ap.add_argument("--imgsz", type=int, default=MODEL_INPUT_SIZE)
+    ap.add_argument("--quantize", choices=("static", "dynamic", "none"), default=QUANTIZE)
+    ap.add_argument("--calibration", default=CALIBRATION_DIR, help="directory of sample images")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    print(onnx_weights(args.model, args.imgsz, args.quantize, args.calibration))
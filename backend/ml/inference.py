@@ -0,0 +1,197 @@
+# ml/inference.py
+# Micro-batching front end for a process pool of model workers.
+# Concurrent submit() calls are queued, grouped into batches of up to
+# max_batch (waiting at most max_wait_ms for stragglers) and each batch is
+# one call of `batch_fn` in a worker process, i.e. one forward pass.
+# With `name` set, batch_fn returns (results, {stage: seconds}) and the
+# pool records those stages plus queue wait and batch size under it.
+# A worker that dies (OOM kill, segfault) breaks the whole executor; the
+# pool is then rebuilt and the batch retried once.
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from ml import scanner
+from executors import ExecutorBusy, ExecutorTimeout
+from metrics import ENABLED as METRICS_ENABLED, ML_STAGE_SECONDS, ML_BATCH_SIZE
+
+log = logging.getLogger(__name__)
+
+
+def _ping():
+    return os.getpid()
+
+
+class InferenceBusy(ExecutorBusy):
+    """Raised by submit() when the request queue is full."""
+
+
+class InferencePool:
+    def __init__(self, batch_fn, initializer=None, initargs=(), workers: int = 1,
+                 max_batch: int = 8, max_wait_ms: float = 10, max_queue: int = 64,
+                 name: str | None = None, timeout: float | None = None):
+        self.batch_fn = batch_fn
+        self.timeout = timeout   # seconds a caller waits, queue included
+        self.name = name
+        self.initializer = initializer
+        self.initargs = initargs
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self._executor: ProcessPoolExecutor | None = None
+        self._queue: asyncio.Queue | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._batcher: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
+        self._rebuild_lock: asyncio.Lock | None = None
+        self.rebuilds = 0
+
+    @property
+    def started(self) -> bool:
+        return self._batcher is not None
+
+    async def start(self):
+        if self.started:
+            return
+        self._executor = self._new_executor()
+        self._rebuild_lock = asyncio.Lock()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._batcher = asyncio.create_task(self._run())
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn, not fork: the API process has an event loop and threads
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=mp.get_context("spawn"),
+            initializer=self.initializer, initargs=self.initargs)
+
+    async def _rebuild(self, broken: ProcessPoolExecutor):
+        # batches that failed on the same broken executor replace it once
+        async with self._rebuild_lock:
+            if self._executor is broken:
+                log.warning("%s: worker process died, restarting the pool", self.name or "inference")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+                self.rebuilds += 1
+
+    async def _call(self, items: list):
+        # batch_fn in a worker; on a broken pool, once more on a new one
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, self.batch_fn, items)
+        except BrokenProcessPool:
+            await self._rebuild(executor)
+            return await loop.run_in_executor(self._executor, self.batch_fn, items)
+
+    async def warm_up(self):
+        # spawn every worker (running the initializer, i.e. loading weights)
+        # before the first real request has to wait for it
+        await self.start()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _ping)
+                               for _ in range(self.workers)))
+
+    async def close(self):
+        if not self.started:
+            return
+        self._batcher.cancel()
+        for task in list(self._inflight):
+            task.cancel()
+        while not self._queue.empty():
+            _, fut, _ = self._queue.get_nowait()
+            if not fut.done():
+                fut.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._batcher = None
+
+    async def submit(self, item):
+        if not self.started:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        try:
+            self._queue.put_nowait((item, fut, loop.time()))
+        except asyncio.QueueFull:
+            raise InferenceBusy(f"inference queue full ({self.max_queue})")
+        try:
+            # a caller that gives up cancels fut, and _dispatch skips it
+            return await asyncio.wait_for(fut, self.timeout)
+        except asyncio.TimeoutError:
+            raise ExecutorTimeout(f"inference: no result within {self.timeout}s") from None
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "batches_in_flight": len(self._inflight),
+            "workers": self.workers,
+            "rebuilds": self.rebuilds,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # wait for a free worker first, so the queue keeps filling
+            # (and the next batch gets bigger) while all workers are busy
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch):
+        loop = asyncio.get_running_loop()
+        # drop requests whose callers already went away
+        batch = [(item, fut, queued) for item, fut, queued in batch if not fut.done()]
+        try:
+            if batch:
+                started = loop.time()
+                results = await self._call([item for item, _, _ in batch])
+                if self.name is not None:
+                    results, stages = results
+                    if METRICS_ENABLED:
+                        self._record(batch, started, loop.time(), stages)
+                for (_, fut, _), res in zip(batch, results):
+                    if not fut.done():
+                        fut.set_result(res)
+        except Exception as exc:
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(exc)
+        finally:
+            self._slots.release()
+
+    def _record(self, batch, started: float, finished: float, stages: dict):
+        for _, _, queued in batch:
+            ML_STAGE_SECONDS.observe(started - queued, self.name, "queue")
+        ML_BATCH_SIZE.observe(len(batch), self.name)
+        for stage, seconds in stages.items():
+            ML_STAGE_SECONDS.observe(seconds, self.name, stage)
+        # pickling the batch to the worker and the results back
+        ML_STAGE_SECONDS.observe(finished - started - sum(stages.values()), self.name, "transfer")
+
+
+scan_pool = InferencePool(
+    scanner.scan_batch_timed,
+    initializer=scanner.init_worker,
+    initargs=(int(os.getenv("SCANNER_THREADS", "1")),),
+    workers=int(os.getenv("SCANNER_WORKERS", "1")),
+    max_batch=int(os.getenv("SCANNER_MAX_BATCH", "8")),
+    max_wait_ms=float(os.getenv("SCANNER_MAX_WAIT_MS", "10")),
+    max_queue=int(os.getenv("SCANNER_MAX_QUEUE", "64")),
+    name="scanner",
+    timeout=float(os.getenv("SCANNER_TIMEOUT_S", "30")) or None,
+)
@@ -0,0 +1,322 @@
+# ml/jobs.py
+# Async mode of the image endpoints (?mode=async). The endpoint answers
+# 202 with a job record right away; the result is kept in Redis for
+# JOB_TTL seconds, read through GET /jobs/{id} and pushed to the user's
+# websockets as a "job_update" event. With CELERY_BROKER_URL set, jobs run
+# on the Celery app (workers/jobs.py, which gets the upload through Redis);
+# otherwise they run on a priority queue in this process, through the
+# app's own scan/classify paths (`runner`).
+# Priorities run from 0 (first) to 9. An image already queued or running
+# for the same kind joins that job instead of starting another. Errors of
+# 500 and up are retried with exponential backoff, up to JOB_MAX_ATTEMPTS
+# runs; anything below 500 (an unreadable image) fails at once.
+import asyncio
+import datetime as dt
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+import redis.asyncio as redis
+from database.config import REDIS_URL
+from executors import ExecutorBusy
+
+JOBS_MODE = os.getenv("JOBS_MODE", "celery" if os.getenv("CELERY_BROKER_URL") else "local")
+JOB_TTL = int(os.getenv("JOB_TTL", "3600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF_S = float(os.getenv("JOB_RETRY_BACKOFF_S", "1"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))        # local mode: jobs running at once
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "256"))  # local mode
+DEFAULT_PRIORITY = 5
+KINDS = ("scan", "classify", "weight")
+CELERY_TASK = "workers.jobs.run_image_job"
+
+log = logging.getLogger(__name__)
+
+
+class JobQueueFull(ExecutorBusy):
+    """Raised by submit() when the local job queue is full."""
+
+
+class JobStoreUnavailable(ExecutorBusy):
+    """Raised when a celery-mode job cannot be written to Redis."""
+
+
+class JobFailed(Exception):
+    """A job error that retrying will not fix."""
+
+
+def retryable(exc: Exception) -> bool:
+    return not isinstance(exc, JobFailed) and getattr(exc, "status_code", 500) >= 500
+
+
+def _now() -> str:
+    return dt.datetime.utcnow().isoformat()
+
+
+class JobStore:
+    # Redis keys with a TTL. With local=True (the in-process queue, whose
+    # records only this process writes) every value is also kept in a dict,
+    # which serves reads first and covers a Redis outage; without it a
+    # failed read or write raises JobStoreUnavailable rather than passing
+    # for a missing or stored job.
+    def __init__(self, redis_client=None, ttl: int = JOB_TTL, local: bool = True, prefix: str = "job"):
+        self.redis = redis_client    # bytes in and out (no decode_responses)
+        self.ttl = ttl
+        self.local = local
+        self.prefix = prefix
+        self._mem: dict[str, tuple[float, bytes | set]] = {}   # key -> (expires, value or members)
+        self._writes = 0
+        self.counters = {"redis_errors": 0}
+
+    async def get(self, key: str, fresh: bool = False) -> bytes | None:
+        # fresh: Redis first, for keys other processes write too
+        if not fresh:
+            value = self._get_local(key)
+            if value is not None:
+                return value
+        if self.redis is not None:
+            try:
+                value = await self.redis.get(f"{self.prefix}:{key}")
+                if value is not None:
+                    return value
+            except (redis.RedisError, OSError) as e:
+                self._redis_failed(e)
+        return self._get_local(key) if fresh else None
+
+    def _get_local(self, key: str):
+        entry = self._mem.get(key)
+        return entry[1] if entry is not None and entry[0] > time.monotonic() else None
+
+    async def set(self, key: str, value: bytes, nx: bool = False) -> bool:
+        # False when nx is set and the key exists
+        if nx and self.local and await self.get(key, fresh=True) is not None:
+            return False
+        if self.redis is not None:
+            try:
+                if not await self.redis.set(f"{self.prefix}:{key}", value, ex=self.ttl, nx=nx):
+                    return False
+            except (redis.RedisError, OSError) as e:
+                self._redis_failed(e)
+        if self.local:
+            self._mem[key] = (time.monotonic() + self.ttl, value)
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._prune()
+        return True
+
+    async def add(self, key: str, member: str):
+        # a set member (SADD), so concurrent adds from several processes
+        # all land; the set expires with the job
+        if self.redis is not None:
+            name = f"{self.prefix}:{key}"
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.sadd(name, member)
+                    pipe.expire(name, self.ttl)
+                    await pipe.execute()
+            except (redis.RedisError, OSError) as e:
+                self._redis_failed(e)
+        if self.local:
+            self._mem[key] = (time.monotonic() + self.ttl, (self._get_local(key) or set()) | {member})
+
+    async def members(self, key: str) -> list[str]:
+        found = set(self._get_local(key) or ())
+        if self.redis is not None:
+            try:
+                found.update(m.decode() for m in await self.redis.smembers(f"{self.prefix}:{key}"))
+            except (redis.RedisError, OSError):
+                self.counters["redis_errors"] += 1
+        return sorted(found)
+
+    def _redis_failed(self, exc: Exception):
+        self.counters["redis_errors"] += 1
+        if not self.local:
+            raise JobStoreUnavailable("job store unavailable") from exc
+
+    async def delete(self, key: str):
+        self._mem.pop(key, None)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(f"{self.prefix}:{key}")
+            except (redis.RedisError, OSError):
+                self.counters["redis_errors"] += 1
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._mem.items() if expires <= now]:
+            del self._mem[key]
+
+
+class JobQueue:
+    def __init__(self, store: JobStore, mode: str = JOBS_MODE, workers: int = JOB_WORKERS,
+                 max_queue: int = JOB_MAX_QUEUE, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 backoff: float = JOB_RETRY_BACKOFF_S):
+        self.store = store
+        self.mode = mode
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.runner = None   # local mode: async (kind, upload) -> result, set by the app
+        self.notify = None   # async (message, user_id), e.g. ConnectionManager.send_personal
+        self.counters = {"submitted": 0, "deduplicated": 0, "retried": 0, "done": 0, "failed": 0}
+        self._seq = itertools.count()
+        self._queue: asyncio.PriorityQueue | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._uploads: dict[str, object] = {}   # local mode: job id -> ImageUpload
+        self._running = 0
+
+    # ---------- RECORDS ----------
+
+    async def get(self, job_id: str) -> dict | None:
+        raw = await self.store.get(job_id)
+        return json.loads(raw) if raw is not None else None
+
+    async def _save(self, record: dict):
+        await self.store.set(record["id"], json.dumps(record).encode())
+
+    async def _watchers(self, job_id: str) -> list[str]:
+        return await self.store.members(f"users:{job_id}")
+
+    async def _watch(self, job_id: str, user_id: str | None):
+        if user_id is not None:
+            await self.store.add(f"users:{job_id}", user_id)
+
+    # ---------- SUBMIT ----------
+
+    async def submit(self, kind: str, upload, user_id: str | None = None,
+                     priority: int = DEFAULT_PRIORITY) -> dict:
+        # upload: ml.preprocess.ImageUpload; returns the job record
+        if self.mode == "local":
+            await self.start()
+            if self._queue.qsize() >= self.max_queue:
+                raise JobQueueFull(f"job queue full ({self.max_queue})")
+        job_id = uuid.uuid4().hex
+        dedup = f"key:{kind}:{upload.digest}"
+        if not await self.store.set(dedup, job_id.encode(), nx=True):
+            other = await self.store.get(dedup, fresh=True)
+            record = await self.get(other.decode()) if other is not None else None
+            if record is not None and record["status"] in ("queued", "running"):
+                self.counters["deduplicated"] += 1
+                await self._watch(record["id"], user_id)
+                return record
+            await self.store.set(dedup, job_id.encode())   # left over from a job that is gone
+        record = {"id": job_id, "kind": kind, "status": "queued", "priority": priority,
+                  "attempts": 0, "digest": upload.digest, "created_at": _now(),
+                  "started_at": None, "finished_at": None, "result": None, "error": None}
+        await self._save(record)
+        await self._watch(job_id, user_id)
+        self.counters["submitted"] += 1
+        if self.mode == "local":
+            self._uploads[job_id] = upload
+            self._queue.put_nowait((priority, next(self._seq), job_id))
+        else:
+            await self.store.set(f"data:{job_id}", upload.data)
+            from workers.analytics import celery
+            # a blocking broker round trip: off the event loop
+            await asyncio.to_thread(celery.send_task, CELERY_TASK, args=[job_id], priority=priority)
+        return record
+
+    # ---------- RUN ----------
+
+    async def run(self, job_id: str, compute) -> bool:
+        # one attempt of compute() -> result. True once the job is settled
+        # (done, failed for good or expired), False to run it again later
+        record = await self.get(job_id)
+        if record is None:
+            return True
+        record.update(status="running", attempts=record["attempts"] + 1, started_at=_now())
+        await self._save(record)
+        try:
+            result = await compute()
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            if retryable(e) and record["attempts"] < self.max_attempts:
+                log.warning("job %s attempt %d failed, retrying: %s", job_id, record["attempts"], error)
+                record.update(status="queued", error=error)
+                await self._save(record)
+                self.counters["retried"] += 1
+                return False
+            if retryable(e):
+                log.exception("job %s failed after %d attempts", job_id, record["attempts"])
+            record.update(status="failed", error=error)
+        else:
+            record.update(status="done", result=result, error=None)
+        record["finished_at"] = _now()
+        await self._finish(record)
+        return True
+
+    def retry_delay(self, attempts: int) -> float:
+        return self.backoff * 2 ** (attempts - 1)
+
+    async def _finish(self, record: dict):
+        job_id = record["id"]
+        await self._save(record)
+        self.counters["done" if record["status"] == "done" else "failed"] += 1
+        dedup = f"key:{record['kind']}:{record['digest']}"
+        if await self.store.get(dedup, fresh=True) == job_id.encode():   # identical images start fresh now
+            await self.store.delete(dedup)
+        await self.store.delete(f"data:{job_id}")
+        self._uploads.pop(job_id, None)
+        if self.notify is not None:
+            message = json.dumps({"event": "job_update", "payload": record})
+            for user_id in await self._watchers(job_id):
+                await self.notify(message, user_id)
+
+    # ---------- LOCAL WORKERS ----------
+
+    async def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.PriorityQueue()
+        for _ in range(self.workers):
+            self._spawn(self._work())
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._queue = None
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _work(self):
+        while True:
+            priority, _, job_id = await self._queue.get()
+            upload = self._uploads.get(job_id)
+            if upload is None:
+                continue
+            self._running += 1
+            try:
+                record = await self.get(job_id)
+                kind = record["kind"] if record else None
+                settled = await self.run(job_id, lambda: self.runner(kind, upload))
+            except Exception:   # the store itself; keep the worker alive
+                log.exception("job %s: run failed", job_id)
+                settled = True
+            finally:
+                self._running -= 1
+            if not settled:
+                self._spawn(self._requeue(priority, job_id, self.retry_delay(record["attempts"] + 1)))
+
+    async def _requeue(self, priority: int, job_id: str, delay: float):
+        await asyncio.sleep(delay)
+        if self._queue is not None:
+            self._queue.put_nowait((priority, next(self._seq), job_id))
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self._running,
+            "workers": self.workers if self.mode == "local" else None,
+            **self.counters,
+            **self.store.counters,
+        }
+
+
+job_queue = JobQueue(JobStore(redis.from_url(REDIS_URL), local=JOBS_MODE == "local"))
@@ -0,0 +1,117 @@
+# ml/preprocess.py
+# Shared image intake for the ML endpoints: read the upload once with a
+# size cap, decode straight to model resolution and hand out one uint8
+# RGB array (H, W, 3) that scan/classify/weight all consume.
+import hashlib
+import io
+import json
+import os
+import numpy as np
+from executors import decode_pool
+from metrics import ML_STAGE_SECONDS
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "12")) * 1024 * 1024)
+MODEL_INPUT_SIZE = int(os.getenv("MODEL_INPUT_SIZE", "640"))   # YOLO imgsz
+CHUNK_SIZE = 256 * 1024
+FORM_OVERHEAD = 64 * 1024   # multipart boundaries, headers and small fields
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadLimit:
+    # plain ASGI: 413 for request bodies past max_bytes on `paths`, before
+    # Starlette parses the form and spools the file (memory, then a temp
+    # file) for UploadFile. By Content-Length when the client sends one,
+    # else by counting the body as it arrives; the app then sees a
+    # disconnect and whatever it answers is dropped.
+    def __init__(self, app, paths, max_bytes: int = MAX_UPLOAD_BYTES + FORM_OVERHEAD):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(send)
+        seen, rejected = 0, False
+
+        async def limited_receive():
+            nonlocal seen, rejected
+            message = await receive()
+            if message["type"] == "http.request" and not rejected:
+                seen += len(message.get("body", b""))
+                if seen > self.max_bytes:
+                    rejected = True
+                    await self._reject(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": f"upload exceeds {self.max_bytes - FORM_OVERHEAD} bytes"}).encode()
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()), (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+async def read_upload(file, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    # the exact cap on the file itself; UploadLimit has already kept the
+    # request body near it, so this copies at most ~max_bytes
+    buf = bytearray()
+    while chunk := await file.read(CHUNK_SIZE):
+        buf += chunk
+        if len(buf) > max_bytes:
+            raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+    return bytes(buf)
+
+
+def decode_image(data: bytes, size: int = MODEL_INPUT_SIZE) -> np.ndarray:
+    from PIL import Image, ImageOps
+    img = Image.open(io.BytesIO(data))
+    # JPEG only: let libjpeg scale by 1/2..1/8 during decode, so a 12 MP
+    # photo is never materialized at full resolution
+    img.draft("RGB", (size, size))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((size, size), Image.BILINEAR)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+class ImageUpload:
+    # raw bytes + content hash; decoded at most once, on first use, so a
+    # cache hit never pays for the decode
+    def __init__(self, data: bytes, digest: str | None = None):
+        self.data = data
+        self.digest = digest or content_digest(data)
+        self._image = None
+
+    @classmethod
+    async def read(cls, file, max_bytes: int = MAX_UPLOAD_BYTES) -> "ImageUpload":
+        # hashing a 12 MB photo takes ~20 ms: off the event loop too
+        data = await read_upload(file, max_bytes)
+        return cls(data, await decode_pool.run(content_digest, data))
+
+    async def image(self) -> np.ndarray:
+        if self._image is None:
+            with ML_STAGE_SECONDS.time("upload", "decode"):
+                self._image = await decode_pool.run(decode_image, self.data)
+        return self._image
@@ -1,43 +1,79 @@
 # ml/scanner.py
-from ultralytics import YOLO
-from PIL import Image
-import io
-
-model = YOLO("yolov8x.pt")          # or yolov8n.pt for speed
-FOOD_CLASS_IDS = [46, 47, 48, 49, 50, 51, 52, 53,
-                  54, 55, 56, 57, 58, 59, 60]  # COCO food classes
-
-MACRO_MAP = {
-    "apple":     {"protein": 0.3, "carbs": 14, "fats": 0.2},
-    "banana":    {"protein": 1.1, "carbs": 23, "fats": 0.3},
-    "pizza":     {"protein": 12,  "carbs": 34, "fats": 10},
-    "sandwich":  {"protein": 15,  "carbs": 30, "fats": 8},
-    "carrot":    {"protein": 0.9, "carbs": 10, "fats": 0.2},
-    # default fallback
-    "default":   {"protein": 5,   "carbs": 20, "fats": 5}
-}
-
-
-def scan_food(image_bytes: bytes) -> dict:
-    img = Image.open(io.BytesIO(image_bytes))
-    results = model(img, verbose=False)
-    boxes = results[0].boxes
-    food_boxes = [b for b in boxes if int(b.cls) in FOOD_CLASS_IDS]
-
-    if not food_boxes:
-        return {"food": "unknown", "calories": 0, "macros": MACRO_MAP["default"], "tips": "No food detected – try another angle."}
-
-    largest = max(food_boxes, key=lambda b: b.conf)
-    label = results[0].names[int(largest.cls)]
-    conf = float(largest.conf)
-    calories = {"apple": 52, "banana": 89, "pizza": 285,
-                "sandwich": 250, "carrot": 41}.get(label, 120)
-    macros = MACRO_MAP.get(label, MACRO_MAP["default"])
-
-    return {
-        "food": label,
-        "calories": calories,
-        "macros": macros,
-        "confidence": round(conf, 2),
-        "tips": f"Detected {label} – log it!"
-    }
+# Food scan of a batch of decoded images: one pass of the configured
+# detector backend (ml/detectors.py), then the food boxes of each image
+# with portion estimates.
+import os
+import time
+import numpy as np
+from ml.detectors import BACKEND, IOU_THRESHOLD, MODEL_NAME, QUANTIZE, Detections, load_detector
+from ml.weight import REFERENCE_AREA, portion_grams
+
+MIN_CONFIDENCE = float(os.getenv("SCANNER_MIN_CONF", "0.25"))
+
+# COCO food classes, banana..cake (56-60 are furniture: chair..dining table)
+FOOD_CLASS_IDS = [46, 47, 48, 49, 50, 51, 52, 53, 54, 55]
+
+# the settings scan results depend on, for cache keys: switching backend,
+# model or quantization must not serve the previous detector's boxes
+SIGNATURE = ":".join(map(str, (BACKEND, MODEL_NAME, QUANTIZE if BACKEND == "onnx" else "-",
+                               IOU_THRESHOLD, MIN_CONFIDENCE, REFERENCE_AREA)))
+
+_detector = None
+_threads = 1
+
+
+# ---------- MODEL ----------
+
+def get_detector():
+    global _detector
+    if _detector is None:
+        _detector = load_detector(BACKEND, MODEL_NAME, _threads, MIN_CONFIDENCE)
+    return _detector
+
+
+def init_worker(threads: int = 1):
+    # process-pool initializer: set the backend's threads and load weights once
+    global _threads
+    _threads = threads
+    get_detector()
+
+
+# ---------- SCAN ----------
+
+def _postprocess(det: Detections) -> dict:
+    # every food box above MIN_CONFIDENCE, most confident first, with its
+    # portion estimate; array ops over the whole box set, one dict per kept box
+    cls, conf, xyxyn = det.cls, det.conf, det.xyxyn
+    keep = np.isin(cls, FOOD_CLASS_IDS) & (conf >= MIN_CONFIDENCE)
+    order = np.flatnonzero(keep)[np.argsort(-conf[keep], kind="stable")]
+    cls, conf, xyxyn = cls[order], conf[order], np.clip(xyxyn[order], 0, 1)
+    area = (xyxyn[:, 2] - xyxyn[:, 0]) * (xyxyn[:, 3] - xyxyn[:, 1])
+    grams = portion_grams(cls, area)
+    names = det.names
+    return {"items": [
+        {"label": names[c], "confidence": cf, "bbox": box, "area": a, "grams": g}
+        for c, cf, box, a, g in zip(cls.tolist(), np.round(conf, 2).tolist(),
+                                    np.round(xyxyn, 4).tolist(), np.round(area, 4).tolist(),
+                                    grams.tolist())]}
+
+
+def scan_batch_timed(images: list) -> tuple[list[dict], dict]:
+    # images: uint8 RGB arrays from ml.preprocess.decode_image;
+    # one forward pass for the whole batch. Also returns seconds per
+    # stage: this runs in a worker process, the caller records them
+    detector = get_detector()
+    t0 = time.perf_counter()
+    batch = detector.prepare(images)
+    t1 = time.perf_counter()
+    raw = detector.infer(batch)
+    t2 = time.perf_counter()
+    out = [_postprocess(d) for d in detector.decode(raw, batch)]
+    return out, {"preprocess": t1 - t0, "infer": t2 - t1, "postprocess": time.perf_counter() - t2}
+
+
+def scan_batch(images: list) -> list[dict]:
+    return scan_batch_timed(images)[0]
+
+
+def scan_food(image) -> dict:
+    return scan_batch([image])[0]
@@ -1,7 +1,36 @@
-import random
-from PIL import Image
+# ml/weight.py
+# Portion estimate from a detection box. Each COCO food class has a
+# typical portion weight for an item whose box covers REFERENCE_AREA of
+# the frame; other box sizes scale it by (area ratio) ** 1.5, i.e. the
+# box is read as the projection of a solid. No depth or plate reference,
+# so this is a first guess for the user to correct, not a measurement.
+import os
+import numpy as np
 
+REFERENCE_AREA = float(os.getenv("SCAN_REFERENCE_AREA", "0.15"))   # fraction of the frame
+DEFAULT_PORTION_G = 100.0
+MIN_SCALE, MAX_SCALE = 0.2, 3.0   # clamp, relative to the typical portion
 
-def predict_weight(image: Image.Image) -> float:
-    # dummy: random 50-500 g
-    return round(random.uniform(50, 500), 1)
+PORTION_GRAMS = {   # COCO class id -> grams of a typical portion
+    46: 120,   # banana
+    47: 180,   # apple
+    48: 200,   # sandwich
+    49: 150,   # orange
+    50: 90,    # broccoli
+    51: 60,    # carrot
+    52: 100,   # hot dog
+    53: 110,   # pizza (a slice)
+    54: 60,    # donut
+    55: 100,   # cake
+}
+
+_portions = np.full(max(PORTION_GRAMS) + 1, DEFAULT_PORTION_G)
+_portions[list(PORTION_GRAMS)] = list(PORTION_GRAMS.values())
+
+
+def portion_grams(cls: np.ndarray, area: np.ndarray) -> np.ndarray:
+    # cls: int class ids, area: box area as a fraction of the image, same shape
+    typical = np.where(cls < len(_portions), _portions[np.minimum(cls, len(_portions) - 1)],
+                       DEFAULT_PORTION_G)
+    scale = np.clip((area / REFERENCE_AREA) ** 1.5, MIN_SCALE, MAX_SCALE)
+    return np.round(typical * scale, 1)
@@ -0,0 +1,74 @@
+# nutrition/engine.py
+# Vectorized BMI / Mifflin-St Jeor BMR / calorie and macro targets.
+# Everything works on NumPy columns, so one call handles one profile or
+# a nightly batch of millions; /nutrition and /nutrition/batch wrap it.
+import numpy as np
+
+ACTIVITY_MULTIPLIER = {"low": 1.2, "medium": 1.55, "high": 1.9}
+DEFAULT_MULTIPLIER = 1.2
+GOAL_CALORIE_DELTA = {"weight_loss": -400, "muscle_gain": 400}
+# (protein g per kg body weight, share of calories from fat)
+MACRO_SPLIT = {"weight_loss": (2.0, 0.25), "muscle_gain": (2.2, 0.25)}
+DEFAULT_SPLIT = (1.6, 0.30)
+DIET_PLANS = {
+    "weight_loss": "High protein, salads, fruits, avoid sugar & fried foods.",
+    "muscle_gain": "Protein heavy: Eggs, chicken, paneer, rice, nuts.",
+}
+DEFAULT_DIET = "Balanced diet with vegetables, carbs and protein."
+
+
+def _lookup(values, table: dict, default) -> np.ndarray:
+    # map a string column through `table` with one dict lookup per
+    # distinct value instead of one per row
+    values = np.asarray(values)
+    keys, inverse = np.unique(values, return_inverse=True)
+    mapped = np.array([table.get(k, default) for k in keys.tolist()])
+    return mapped[inverse]
+
+
+def compute_targets(age, height, weight, gender, activity, goal) -> dict[str, np.ndarray]:
+    # columns: age (years), height (cm), weight (kg), gender/activity/goal strings
+    age = np.asarray(age, dtype=np.float64)
+    height = np.asarray(height, dtype=np.float64)
+    weight = np.asarray(weight, dtype=np.float64)
+    male = np.asarray(gender) == "male"
+
+    h = height / 100
+    bmi = np.round(weight / (h * h), 2)
+    bmr = 10 * weight + 6.25 * height - 5 * age + np.where(male, 5, -161)
+    calories = np.round(bmr * _lookup(activity, ACTIVITY_MULTIPLIER, DEFAULT_MULTIPLIER))
+    calories += _lookup(goal, GOAL_CALORIE_DELTA, 0)
+
+    split = _lookup(goal, MACRO_SPLIT, DEFAULT_SPLIT)
+    protein = split[:, 0] * weight
+    fats = calories * split[:, 1] / 9
+    carbs = np.maximum(calories - protein * 4 - fats * 9, 0) / 4
+    return {
+        "bmi": bmi,
+        "bmr": np.round(bmr),
+        "daily_calories": calories,
+        "protein_g": np.round(protein),
+        "carbs_g": np.round(carbs),
+        "fats_g": np.round(fats),
+    }
+
+
+def nutrition_targets(profiles) -> list[dict]:
+    # profiles: UserProfile-like objects (age/height/weight/gender/activity/goal)
+    if not profiles:
+        return []
+    cols = {f: [getattr(p, f) for p in profiles]
+            for f in ("age", "height", "weight", "gender", "activity", "goal")}
+    t = compute_targets(**cols)
+    out = []
+    for i, goal in enumerate(cols["goal"]):
+        out.append({
+            "bmi": float(t["bmi"][i]),
+            "bmr": int(t["bmr"][i]),
+            "daily_calories": int(t["daily_calories"][i]),
+            "macros": {"protein": int(t["protein_g"][i]),
+                       "carbs": int(t["carbs_g"][i]),
+                       "fats": int(t["fats_g"][i])},
+            "diet_plan": DIET_PLANS.get(goal, DEFAULT_DIET),
+        })
+    return out
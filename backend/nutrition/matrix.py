@@ -0,0 +1,103 @@
+# nutrition/matrix.py
+# The food catalog as a dense float32 matrix of per-100g
+# (calories, protein, carbs, fats), row-aligned with ids and names, for
+# vectorized planning and recommendations. Built from the search index
+# at warm-up and kept in sync with committed FoodItem writes.
+import numpy as np
+from database.search import on_food_commit
+
+MACROS = ("calories", "protein", "carbs", "fats")
+
+
+class CatalogMatrix:
+    def __init__(self):
+        self.loaded = False
+        self.version = 0          # bumped on every change; part of cache keys
+        self.epoch = 0            # bumped on every full load
+        self.ids: list = []
+        self._names: list[str] = []
+        self._data = np.zeros((0, 4), dtype=np.float32)
+        self._live = np.zeros(0, dtype=bool)
+        self._rows: dict = {}     # food id -> row
+        self._names_arr = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def values(self) -> np.ndarray:
+        # (rows, 4) per-100g macros; dead rows are zero, check `live`
+        return self._data[:len(self.ids)]
+
+    @property
+    def live(self) -> np.ndarray:
+        return self._live[:len(self.ids)]
+
+    @property
+    def names(self) -> np.ndarray:
+        # lower-cased names as a NumPy string array, for vectorized matching
+        if self._names_arr is None:
+            self._names_arr = np.array(self._names, dtype=str)
+        return self._names_arr
+
+    def view(self) -> tuple:
+        # (ids, names, values, live) with the same rows, for readers on other
+        # threads: add() only appends or regrows, load() swaps in new objects
+        ids, names = self.ids, self._names
+        n = len(ids)
+        return ids, names, self._data[:n], self._live[:n]
+
+    def load(self, foods):
+        foods = list(foods)
+        version, epoch = self.version, self.epoch
+        self.__init__()
+        self.version, self.epoch = version + 1, epoch + 1
+        self.ids = [f["id"] for f in foods]
+        self._names = [(f["name"] or "").lower() for f in foods]
+        self._rows = {food_id: i for i, food_id in enumerate(self.ids)}
+        self._data = np.array([[f[m] or 0 for m in MACROS] for f in foods],
+                              dtype=np.float32).reshape(-1, 4)
+        self._live = np.ones(len(foods), dtype=bool)
+        self.loaded = True
+
+    def add(self, food: dict):
+        row = self._rows.get(food["id"])
+        if row is None:
+            row = len(self.ids)
+            if row == len(self._data):   # grow by doubling
+                cap = max(16, 2 * row)
+                self._data = np.resize(self._data, (cap, 4))
+                self._live = np.resize(self._live, cap)
+            self.ids.append(food["id"])
+            self._names.append("")
+            self._rows[food["id"]] = row
+        self._data[row] = [food[m] or 0 for m in MACROS]
+        self._names[row] = (food["name"] or "").lower()
+        self._live[row] = True
+        self._names_arr = None
+        self.version += 1
+
+    def remove(self, food_id):
+        row = self._rows.pop(food_id, None)
+        if row is not None:
+            self._live[row] = False
+            self._data[row] = 0
+            self.version += 1
+
+    def row_of(self, food_id) -> int | None:
+        return self._rows.get(food_id)
+
+    def name_of(self, row: int) -> str:
+        return self._names[row]
+
+
+catalog_matrix = CatalogMatrix()
+
+
+@on_food_commit
+def _matrix_write(food_id, food, inserted):
+    if catalog_matrix.loaded:
+        if food is not None:
+            catalog_matrix.add(food)
+        else:
+            catalog_matrix.remove(food_id)
@@ -0,0 +1,213 @@
+# nutrition/neighbors.py
+# KD-tree recommendations over the catalog matrix:
+#   similar()  - foods with the nearest per-100g macro profile
+#   fill_gap() - foods (and portions) that best close a day's macro gap
+# The trees cover a snapshot of the matrix. Foods added or edited after
+# it are brute-forced from a small delta and the trees are rebuilt in a
+# background thread once the delta grows past RECOMMEND_REBUILD_AFTER.
+import os
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+from database.search import on_food_commit
+from .matrix import CatalogMatrix, catalog_matrix, MACROS
+from .planner import MIN_GRAMS, MAX_GRAMS, GRAM_STEP
+
+REBUILD_AFTER = int(os.getenv("RECOMMEND_REBUILD_AFTER", "4096"))
+# one day's worth of each macro; gaps are compared in fractions of these
+REFERENCE_DAY = np.array([2000.0, 150.0, 225.0, 65.0])
+
+
+def _directions(values: np.ndarray) -> np.ndarray:
+    # unit (protein, carbs, fats) vectors in REFERENCE_DAY units: the nearest
+    # direction is the food whose best portion leaves the smallest residual
+    # gap. Calories are left out: they follow from the macros, and keeping
+    # them squeezes every food onto a thin shell the tree searches badly.
+    w = values[:, 1:] / REFERENCE_DAY[1:]
+    norm = np.linalg.norm(w, axis=1, keepdims=True)
+    return np.where(norm > 0, w / np.maximum(norm, 1e-12), 10.0)   # empty rows never match
+
+
+class _Trees:
+    # immutable; swapped in whole when a rebuild finishes
+    def __init__(self, values: np.ndarray, epoch: int, seq: int):
+        self.rows = len(values)
+        self.epoch = epoch
+        self.seq = seq            # edits up to this sequence number are included
+        scale = values.std(axis=0) if len(values) else np.ones(4)
+        self.scale = np.where(scale > 0, scale, 1.0)
+        self.trees = {kind: cKDTree(self.points(kind, values)) for kind in ("similar", "direction")}
+
+    def points(self, kind: str, values: np.ndarray) -> np.ndarray:
+        # catalog rows -> the space the `kind` tree searches
+        return values / self.scale if kind == "similar" else _directions(values)
+
+
+class FoodRecommender:
+    def __init__(self, matrix: CatalogMatrix):
+        self.matrix = matrix
+        self._trees: _Trees | None = None
+        self._edited: dict[int, int] = {}   # row -> seq of its last in-place edit
+        self._seq = 0
+        self._pruned_for: _Trees | None = None
+        self._builder: threading.Thread | None = None
+        self._delta_key = None
+        self._delta_cache: dict = {}
+
+    @property
+    def ready(self) -> bool:
+        return self._trees is not None and self._trees.epoch == self.matrix.epoch
+
+    def build(self):
+        # blocking full build; run off the event loop at warm-up
+        self._trees = _Trees(self.matrix.values.astype(np.float64), self.matrix.epoch, self._seq)
+
+    def mark_edited(self, row: int):
+        self._seq += 1
+        self._edited[row] = self._seq
+
+    def on_update(self, food_id):
+        # a food edited in place moved a row the trees may hold
+        row = self.matrix.row_of(food_id)
+        if row is not None and self._trees is not None:
+            self.mark_edited(row)
+
+    def stats(self) -> dict:
+        trees = self._trees
+        return {
+            "rows": len(self.matrix.ids),
+            "tree_rows": trees.rows if trees else 0,
+            "delta_rows": len(self._delta(trees, "similar")[0]) if trees else 0,
+            "rebuilding": bool(self._builder and self._builder.is_alive()),
+        }
+
+    # ---------- INDEX MAINTENANCE ----------
+
+    def _current(self) -> _Trees:
+        if not self.ready:
+            self._edited.clear()   # first use, or the catalog was reloaded
+            self.build()
+        trees = self._trees
+        if self._pruned_for is not trees:
+            self._edited = {r: s for r, s in self._edited.items() if s > trees.seq}
+            self._pruned_for = trees
+        if len(self.matrix.ids) - trees.rows + len(self._edited) > REBUILD_AFTER:
+            self._rebuild_in_background()
+        return trees
+
+    def _rebuild_in_background(self):
+        if self._builder is not None and self._builder.is_alive():
+            return
+        values = self.matrix.values.astype(np.float64)   # snapshot copy
+        epoch, seq = self.matrix.epoch, self._seq
+
+        def run():
+            trees = _Trees(values, epoch, seq)
+            if epoch == self.matrix.epoch:
+                self._trees = trees
+
+        self._builder = threading.Thread(target=run, name="food-recommender-build", daemon=True)
+        self._builder.start()
+
+    def _delta(self, trees: _Trees, kind: str) -> tuple[np.ndarray, np.ndarray, set]:
+        # live rows the trees don't cover (appended since the build, or
+        # edited in place) with their points, plus the edited rows, whose
+        # tree entries are stale; rebuilt only when the catalog changes
+        key = (trees, self.matrix.version, self._seq)
+        if self._delta_key != key:
+            edited = [r for r, s in self._edited.items() if s > trees.seq and r < trees.rows]
+            rows = np.concatenate([np.arange(trees.rows, len(self.matrix.ids)),
+                                   np.array(edited, dtype=np.int64)]).astype(np.int64)
+            self._delta_cache = {"rows": rows[self.matrix.live[rows]], "stale": set(edited)}
+            self._delta_key = key
+        cache = self._delta_cache
+        if kind not in cache:
+            cache[kind] = trees.points(kind, self.matrix.values[cache["rows"]].astype(np.float64))
+        return cache["rows"], cache[kind], cache["stale"]
+
+    def _nearest(self, trees: _Trees, kind: str, point: np.ndarray,
+                 k: int, exclude=()) -> tuple[np.ndarray, np.ndarray]:
+        # k nearest live rows (rows, distances) across the trees and the delta
+        live = self.matrix.live
+        delta, points, stale = self._delta(trees, kind)
+        if exclude:
+            stale = stale | set(exclude)
+        want = k + len(exclude) + 8
+        while True:
+            n = min(want, trees.rows)
+            if n == 0:
+                dist, idx = np.empty(0), np.empty(0, dtype=np.int64)
+                break
+            dist, idx = trees.trees[kind].query(point, k=n)
+            dist, idx = np.atleast_1d(dist), np.atleast_1d(idx)
+            keep = np.array([i < trees.rows and live[i] and i not in stale for i in idx.tolist()],
+                            dtype=bool)   # i == trees.rows marks "no more points"
+            if keep.sum() >= k or n >= trees.rows:
+                dist, idx = dist[keep], idx[keep]
+                break
+            want *= 4   # many removed/edited rows near the query
+        if len(delta):
+            d = np.linalg.norm(points - point, axis=1)
+            if exclude:
+                d[np.isin(delta, list(exclude))] = np.inf
+            if len(d) > k:
+                top = np.argpartition(d, k)[:k]
+                delta, d = delta[top], d[top]
+            idx, dist = np.concatenate([idx, delta]), np.concatenate([dist, d])
+        order = np.argsort(dist, kind="stable")[:k]
+        order = order[np.isfinite(dist[order])]
+        return idx[order], dist[order]
+
+    # ---------- QUERIES ----------
+
+    def similar(self, food_id, k: int = 10) -> list[tuple] | None:
+        # [(food id, distance)], nearest first; None for an unknown food
+        row = self.matrix.row_of(food_id)
+        if row is None:
+            return None
+        trees = self._current()
+        point = trees.points("similar", self.matrix.values[row:row + 1].astype(np.float64))[0]
+        rows, dist = self._nearest(trees, "similar", point, k, exclude={row})
+        return [(self.matrix.ids[r], round(float(d), 4)) for r, d in zip(rows.tolist(), dist)]
+
+    def fill_gap(self, gap, k: int = 5, exclude_ids=()) -> list[dict]:
+        # gap: remaining (calories, protein, carbs, fats) for the day
+        g = np.asarray(gap, dtype=np.float64) / REFERENCE_DAY
+        want = np.clip(g[1:], 0, None)   # macros already over target pull nowhere
+        if not want.any():
+            return []
+        trees = self._current()
+        exclude = {r for r in map(self.matrix.row_of, exclude_ids) if r is not None}
+        # the tree ranks by direction only; re-rank a wider pool by the
+        # residual left after a clipped, rounded portion
+        rows, _ = self._nearest(trees, "direction", want / np.linalg.norm(want),
+                                max(4 * k, 32), exclude)
+        if not len(rows):
+            return []
+        per_100g = self.matrix.values[rows].astype(np.float64)
+        v = per_100g / REFERENCE_DAY
+        with np.errstate(divide="ignore", invalid="ignore"):
+            grams = 100 * (v @ g) / np.einsum("ij,ij->i", v, v)
+        grams = np.clip(np.round(np.nan_to_num(grams) / GRAM_STEP) * GRAM_STEP, MIN_GRAMS, MAX_GRAMS)
+        residual = np.linalg.norm(g - grams[:, None] * v / 100, axis=1)
+        out = []
+        for i in np.argsort(residual, kind="stable")[:k].tolist():
+            macros = per_100g[i] * grams[i] / 100
+            out.append({
+                "food_id": str(self.matrix.ids[rows[i]]),
+                "name": self.matrix.name_of(rows[i]),
+                "grams": float(grams[i]),
+                **{m: round(float(x), 1) for m, x in zip(MACROS, macros)},
+            })
+        return out
+
+
+food_recommender = FoodRecommender(catalog_matrix)
+
+
+# in-place edits move a row the trees already hold; inserts simply land
+# past the tree snapshot and deletes clear the matrix's live flag
+@on_food_commit
+def _mark_edited(food_id, food, inserted):
+    if food is not None and not inserted:
+        food_recommender.on_update(food_id)
@@ -0,0 +1,127 @@
+# nutrition/planner.py
+# Daily meal plans against calorie/macro targets: greedy selection plus
+# swap-based local search over the catalog matrix. Each step scores every
+# catalog food at its best portion in one vectorized pass, so a plan over
+# 100k foods costs a few dozen (n, 4) array ops. Runs on the CPU pool,
+# so it reads one matrix.view() while the loop keeps applying edits.
+import threading
+from collections import OrderedDict
+import numpy as np
+from .matrix import CatalogMatrix, MACROS
+
+PLAN_ITEMS = 5
+MIN_GRAMS, MAX_GRAMS, GRAM_STEP = 30, 400, 10
+LOCAL_SEARCH_PASSES = 2
+FAVORITE_BONUS = 0.9    # favorites' cost is scaled by this when picking
+CACHE_SIZE = 1024
+
+_plan_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _best_portions(per_gram: np.ndarray, residual: np.ndarray):
+    # for every food: grams minimizing |residual - grams * food|^2 (clipped
+    # and rounded to GRAM_STEP) and the resulting squared error
+    dot = per_gram @ residual
+    norm = np.einsum("ij,ij->i", per_gram, per_gram)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grams = np.where(norm > 0, dot / norm, 0)
+    grams = np.clip(np.round(grams / GRAM_STEP) * GRAM_STEP, MIN_GRAMS, MAX_GRAMS)
+    cost = residual @ residual - 2 * grams * dot + grams * grams * norm
+    return grams, cost
+
+
+def _pick(per_gram, residual, allowed, favorite):
+    grams, cost = _best_portions(per_gram, residual)
+    cost = np.where(favorite, cost * FAVORITE_BONUS, cost)
+    cost[~allowed] = np.inf
+    i = int(np.argmin(cost))
+    return (i, float(grams[i])) if np.isfinite(cost[i]) else (None, 0.0)
+
+
+def plan_meals(matrix: CatalogMatrix, targets: dict, exclude_ids=(), exclude_terms=(),
+               favorite_ids=(), items: int = PLAN_ITEMS) -> dict:
+    # targets: {"calories", "protein", "carbs", "fats"} for the day. The
+    # cache key rounds them, so a hit gets this call's targets attached,
+    # not those of the call that filled it
+    mine = {m: float(targets[m]) for m in MACROS}
+    key = (matrix.version, tuple(round(float(targets[m])) for m in MACROS),
+           frozenset(map(str, exclude_ids)), frozenset(t.lower() for t in exclude_terms),
+           frozenset(map(str, favorite_ids)), items)
+    with _cache_lock:
+        if key in _plan_cache:
+            _plan_cache.move_to_end(key)
+            return {**_plan_cache[key], "targets": mine}
+
+    ids, names, values, live = matrix.view()
+    rows = len(ids)
+    target = np.array([max(float(targets[m]), 1.0) for m in MACROS], dtype=np.float64)
+    # work in "fraction of target" units so every macro weighs the same
+    per_gram = values.astype(np.float64) / 100 / target
+    allowed = live & (values[:, 0] > 0)
+    for food_id in exclude_ids:
+        row = matrix.row_of(food_id)
+        if row is not None and row < rows:
+            allowed[row] = False
+    for term in exclude_terms:
+        allowed &= np.char.find(matrix.names[:rows], term.lower()) < 0
+    favorite = np.zeros(len(allowed), dtype=bool)
+    for food_id in favorite_ids:
+        row = matrix.row_of(food_id)
+        if row is not None and row < rows:
+            favorite[row] = True
+
+    # greedy: add the food/portion that closes the most of what's left
+    chosen: list[list] = []   # [row, grams]
+    residual = np.ones(4)
+    for _ in range(items):
+        mask = allowed.copy()
+        mask[[r for r, _ in chosen]] = False
+        row, grams = _pick(per_gram, residual, mask, favorite)
+        if row is None:
+            break
+        new_residual = residual - grams * per_gram[row]
+        if new_residual @ new_residual >= residual @ residual:
+            break   # nothing improves the plan any more
+        chosen.append([row, grams])
+        residual = new_residual
+
+    # local search: re-pick each slot given all the others
+    for _ in range(LOCAL_SEARCH_PASSES):
+        improved = False
+        for slot in range(len(chosen)):
+            row, grams = chosen[slot]
+            without = residual + grams * per_gram[row]
+            mask = allowed.copy()
+            mask[[r for i, (r, _) in enumerate(chosen) if i != slot]] = False
+            new_row, new_grams = _pick(per_gram, without, mask, favorite)
+            if new_row is None:
+                continue
+            new_residual = without - new_grams * per_gram[new_row]
+            if new_residual @ new_residual < residual @ residual - 1e-9:
+                chosen[slot] = [new_row, new_grams]
+                residual = new_residual
+                improved = True
+        if not improved:
+            break
+
+    plan_items = []
+    totals = np.zeros(4)
+    for row, grams in chosen:
+        macros = values[row].astype(np.float64) * grams / 100
+        totals += macros
+        plan_items.append({
+            "food_id": str(ids[row]),
+            "name": names[row],
+            "grams": grams,
+            **{m: round(float(v), 1) for m, v in zip(MACROS, macros)},
+        })
+    plan = {
+        "items": plan_items,
+        "totals": {m: round(float(v), 1) for m, v in zip(MACROS, totals)},
+    }
+    with _cache_lock:
+        _plan_cache[key] = plan
+        if len(_plan_cache) > CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return {**plan, "targets": mine}
@@ -0,0 +1,46 @@
+# nutrition/portions.py
+# Scanner detections -> loggable portions. Each detected item is matched
+# to a catalog food by its label and that food's per-100 g values are
+# scaled to the item's estimated grams. The caller supplies the matcher,
+# FoodSearchIndex.best_match in both the API and the job workers. A food
+# with no value for calories or a macro counts it as 0 and names it in
+# the item's `missing`.
+MACROS = ("protein", "carbs", "fats")
+
+
+def scan_nutrition(scan: dict, match) -> dict:
+    # match(label) -> food dict or None; `meal_items` can be posted to
+    # /log-meals as its `items`
+    items, meal_items = [], []
+    totals = dict.fromkeys(("grams", "calories", *MACROS), 0.0)
+    for det in scan["items"]:
+        totals["grams"] += det["grams"]
+        food = match(det["label"])
+        if food is None:
+            items.append({**det, "food_id": None, "food_name": None, "calories": None, "macros": None,
+                          "missing": None})
+            continue
+        scale = det["grams"] / 100
+        missing = [k for k in ("calories", *MACROS) if food[k] is None]
+        macros = {m: round((food[m] or 0) * scale, 1) for m in MACROS}
+        calories = round((food["calories"] or 0) * scale, 1)
+        items.append({**det, "food_id": str(food["id"]), "food_name": food["name"],
+                      "calories": calories, "macros": macros, "missing": missing})
+        meal_items.append({"food_id": str(food["id"]), "weight": det["grams"]})
+        totals["calories"] += calories
+        for m, v in macros.items():
+            totals[m] += v
+    if not items:
+        tips = "No food detected – try another angle."
+    elif not meal_items:
+        tips = "Couldn't match the detected food to the catalog – search for it instead."
+    else:
+        tips = f"Detected {', '.join(i['label'] for i in items)} – log it!"
+    return {"items": items, "totals": {k: round(v, 1) for k, v in totals.items()},
+            "meal_items": meal_items, "tips": tips}
+
+
+def scan_weight(scan: dict) -> dict:
+    # total of the scanner's per-item portion estimates
+    return {"weight": round(sum(i["grams"] for i in scan["items"]), 1),
+            "items": [{"label": i["label"], "grams": i["grams"]} for i in scan["items"]]}
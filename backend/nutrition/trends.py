@@ -0,0 +1,429 @@
+# nutrition/trends.py
+# Columnar store of per-user daily intake for long-range trends, so a year
+# of history is answered without touching the database. Users are spread
+# over TRENDS_SHARDS memory-mapped float32 files by a stable hash of their
+# id; each user is one contiguous (TRENDS_DAYS, 5) block of
+# calories/protein/carbs/fats/meals per UTC day, at slot day % TRENDS_DAYS
+# (a ring: the writer zeroes a slot when its day comes round again).
+#
+# One writer at a time (workers/analytics.py --trends, under a file lock)
+# copies daily_totals in and rewrites meta.json last; API processes map
+# the files read-only and remap when meta.json changes. A full rebuild
+# goes to new files ("build" in meta.json), so readers never see it half
+# done. Below the store: vectorized trend math over one user's series.
+import datetime as dt
+import fcntl
+import json
+import os
+import time
+import zlib
+import numpy as np
+from scipy.signal import lfilter
+
+TRENDS_DIR = os.getenv("TRENDS_DIR", "./data/trends")
+TRENDS_DAYS = int(os.getenv("TRENDS_DAYS", "400"))      # a year plus room for year-over-year weeks
+TRENDS_SHARDS = int(os.getenv("TRENDS_SHARDS", "64"))
+TRENDS_RELOAD_S = float(os.getenv("TRENDS_RELOAD_S", "5"))
+FIELDS = ("calories", "protein", "carbs", "fats", "meals")
+MACROS = FIELDS[:4]
+EPOCH = dt.date(1970, 1, 1)
+
+
+class TrendStoreLocked(Exception):
+    """Raised when another process is already writing the store."""
+
+
+def day_number(day: dt.date) -> int:
+    return (day - EPOCH).days
+
+
+def shard_of(user_id: str, shards: int) -> int:
+    # stable across processes, unlike hash()
+    return zlib.crc32(user_id.encode()) % shards
+
+
+class TrendStore:
+    def __init__(self, path: str = TRENDS_DIR, days: int = TRENDS_DAYS, shards: int = TRENDS_SHARDS):
+        self.path = path
+        self.days = days
+        self.shards = shards
+        self.meta: dict | None = None
+        self.writable = False
+        self._data: list = []          # per shard: (capacity, days, 5) float32 memmap, or None
+        self._last: list = []          # per shard: (capacity,) int32, latest day written per row
+        self._users: list[list[str]] = []
+        self._rows: list[dict[str, int]] = []
+        self._new_users: list[list[str]] = []
+        self._meta_mtime = None
+        self._checked = 0.0
+        self._lock_file = None
+        self._replaced = None          # build that commit() supersedes
+        self.counters = {"reads": 0, "unknown_users": 0, "reloads": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self.meta is not None
+
+    @property
+    def latest_day(self) -> int:
+        return self.meta["latest_day"]
+
+    def _file(self, shard: int, kind: str, build: int | None = None) -> str:
+        build = self.meta["build"] if build is None else build
+        return os.path.join(self.path, f"shard-{shard:03d}.b{build}.{kind}")
+
+    def _read_meta(self) -> dict | None:
+        try:
+            with open(os.path.join(self.path, "meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    # ---------- READERS ----------
+
+    def open(self):
+        # map whatever the writer last committed; not ready if nothing yet
+        self._checked = time.monotonic()
+        try:
+            mtime = os.stat(os.path.join(self.path, "meta.json")).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._meta_mtime:
+            return
+        meta = self._read_meta()
+        if meta is None:
+            return
+        old = self.meta
+        same_build = old is not None and old["build"] == meta["build"]
+        self.meta, self._meta_mtime = meta, mtime
+        self.days, self.shards = meta["days"], meta["shards"]
+        if not same_build:
+            self._data = [None] * self.shards
+            self._users = [[] for _ in range(self.shards)]
+            self._rows = [{} for _ in range(self.shards)]
+        for s in range(self.shards):
+            count, capacity = meta["users"][s], meta["capacity"][s]
+            if same_build and capacity == old["capacity"][s] and count == old["users"][s]:
+                continue
+            if capacity:
+                self._data[s] = np.memmap(self._file(s, "f32"), np.float32, "r",
+                                          shape=(capacity, self.days, len(FIELDS)))
+            if count > len(self._users[s]):
+                with open(self._file(s, "users")) as f:
+                    users = f.read().split("\n")[:count]
+                for row in range(len(self._users[s]), count):
+                    self._rows[s][users[row]] = row
+                self._users[s] = users
+        if old is not None:
+            self.counters["reloads"] += 1
+
+    def maybe_reload(self):
+        if time.monotonic() - self._checked >= TRENDS_RELOAD_S:
+            self.open()
+
+    def series(self, user_id: str, first: dt.date, last: dt.date) -> np.ndarray:
+        # (days, 5) float32 from first to last inclusive; zeros for days
+        # without meals, after the last refresh or past retention
+        self.maybe_reload()
+        self.counters["reads"] += 1
+        out = np.zeros(((last - first).days + 1, len(FIELDS)), dtype=np.float32)
+        s = shard_of(user_id, self.shards)
+        row = self._rows[s].get(user_id) if self.ready else None
+        if row is None:
+            self.counters["unknown_users"] += 1
+            return out
+        day = np.arange(day_number(first), day_number(last) + 1)
+        kept = (day <= self.latest_day) & (day > self.latest_day - self.days)
+        out[kept] = self._data[s][row, day[kept] % self.days]
+        return out
+
+    def stats(self) -> dict:
+        if not self.ready:
+            return {"ready": False, **self.counters}
+        size = sum(self.meta["capacity"]) * self.days * len(FIELDS) * 4
+        return {"ready": True, "build": self.meta["build"], "users": sum(self.meta["users"]),
+                "shards": self.shards, "days": self.days,
+                "latest_day": (EPOCH + dt.timedelta(days=self.latest_day)).isoformat(),
+                "refreshed_at": self.meta["refreshed_at"], "size_mb": round(size / 2**20, 1),
+                **self.counters}
+
+    # ---------- WRITER ----------
+
+    def open_writer(self, rebuild: bool = False):
+        # rebuild: start a new, empty build with the configured days/shards;
+        # it replaces the current one on commit()
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_file = open(os.path.join(self.path, "lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise TrendStoreLocked(self.path) from None
+        self.writable = True
+        meta = self._read_meta()
+        if meta is None or rebuild:
+            self.meta = {"build": meta["build"] + 1 if meta else 1, "days": self.days,
+                         "shards": self.shards, "fields": FIELDS, "latest_day": None,
+                         "users": [0] * self.shards, "capacity": [0] * self.shards,
+                         "refreshed_at": None}
+            self._replaced = meta["build"] if meta else None
+            for s in range(self.shards):   # left by a rebuild that never committed
+                for kind in ("f32", "last", "users"):
+                    if os.path.exists(self._file(s, kind)):
+                        os.remove(self._file(s, kind))
+        else:
+            self.meta, self.days, self.shards = meta, meta["days"], meta["shards"]
+            self._replaced = None
+        self._data, self._last = [None] * self.shards, [None] * self.shards
+        self._users = [[] for _ in range(self.shards)]
+        self._rows = [{} for _ in range(self.shards)]
+        self._new_users = [[] for _ in range(self.shards)]
+        for s in range(self.shards):
+            if self.meta["capacity"][s]:
+                self._map(s, self.meta["capacity"][s])
+            if self.meta["users"][s]:
+                with open(self._file(s, "users")) as f:
+                    self._users[s] = f.read().split("\n")[:self.meta["users"][s]]
+                self._rows[s] = {u: row for row, u in enumerate(self._users[s])}
+
+    def _map(self, s: int, capacity: int):
+        # (re)map shard s at `capacity` rows, growing its files with zeros
+        for kind, width, dtype in (("f32", self.days * len(FIELDS), np.float32), ("last", 1, np.int32)):
+            name = self._file(s, kind)
+            with open(name, "ab") as f:
+                f.truncate(max(os.path.getsize(name), capacity * width * 4))
+        self._data[s] = np.memmap(self._file(s, "f32"), np.float32, "r+",
+                                  shape=(capacity, self.days, len(FIELDS)))
+        self._last[s] = np.memmap(self._file(s, "last"), np.int32, "r+", shape=(capacity,))
+        self.meta["capacity"][s] = capacity
+
+    def _row(self, user_id: str) -> tuple[int, int]:
+        s = shard_of(user_id, self.shards)
+        row = self._rows[s].get(user_id)
+        if row is None:
+            row = self._rows[s][user_id] = len(self._users[s])
+            self._users[s].append(user_id)
+            self._new_users[s].append(user_id)
+            if row >= self.meta["capacity"][s]:
+                if self._data[s] is not None:
+                    self._data[s].flush()
+                self._map(s, max(256, 2 * self.meta["capacity"][s]))
+        return s, row
+
+    def advance(self, today: dt.date):
+        # make `today` the newest day, zeroing the slots of the days it
+        # passes over (they still hold the days TRENDS_DAYS earlier)
+        new = day_number(today)
+        old = self.meta["latest_day"]
+        if old is not None and new > old:
+            slots = np.arange(max(old + 1, new - self.days + 1), new + 1) % self.days
+            for s in range(self.shards):
+                if self._data[s] is not None:
+                    self._data[s][:len(self._users[s]), slots] = 0
+        if old is None or new > old:
+            self.meta["latest_day"] = new
+
+    def _by_shard(self, user_ids, days, values, lo: int, hi: int):
+        # the rows with lo <= day <= hi (and within the kept range), as
+        # (shard, rows, days, values) per shard that has any
+        days = np.asarray(days, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float32)
+        kept = (days >= max(lo, self.latest_day - self.days + 1)) & (days <= min(hi, self.latest_day))
+        users, index = np.unique(np.asarray(user_ids)[kept], return_inverse=True)
+        days, values = days[kept], values[kept]
+        located = np.array([self._row(u) for u in users.tolist()], dtype=np.int64).reshape(-1, 2)
+        shard, row = located[index, 0], located[index, 1]
+        order = np.argsort(shard, kind="stable")
+        bounds = np.searchsorted(shard[order], np.arange(self.shards + 1))
+        for s in range(self.shards):
+            part = order[bounds[s]:bounds[s + 1]]
+            if len(part):
+                yield s, row[part], days[part], values[part]
+
+    def put(self, user_ids, days, values):
+        # user_ids: n ids, days: n day numbers, values: (n, 5) in FIELDS
+        # order; days outside the kept range are skipped
+        kept = (self.latest_day - self.days + 1, self.latest_day)
+        for s, rows, days_, values_ in self._by_shard(user_ids, days, values, *kept):
+            self._data[s][rows, days_ % self.days] = values_
+            np.maximum.at(self._last[s], rows, days_)
+
+    def replace(self, first: dt.date, last: dt.date, user_ids, days, values):
+        # first..last for every user at once: these rows, zeros for
+        # everyone else who had data there (days whose meals were all
+        # deleted have no daily_totals row). Each shard's days are built
+        # aside and written in one assignment, so readers of the live
+        # files never see them emptied while the refresh streams.
+        lo, hi = day_number(first), day_number(last)
+        slots = np.arange(lo, hi + 1) % self.days
+        given = {s: (rows, days_, values_) for s, rows, days_, values_
+                 in self._by_shard(user_ids, days, values, lo, hi)}
+        for s in range(self.shards):
+            if self._data[s] is None:
+                continue
+            rows, days_, values_ = given.get(s, (np.empty(0, np.int64), np.empty(0, np.int64),
+                                                 np.empty((0, len(FIELDS)), np.float32)))
+            stale = np.flatnonzero(self._last[s][:len(self._users[s])] >= lo)
+            touched = np.union1d(stale, rows)
+            if not len(touched):
+                continue
+            block = np.zeros((len(touched), len(slots), len(FIELDS)), dtype=np.float32)
+            block[np.searchsorted(touched, rows), days_ - lo] = values_
+            self._data[s][touched[:, None], slots] = block
+            np.maximum.at(self._last[s], rows, days_)
+
+    def commit(self):
+        # data first, then the users files, then meta.json (atomically):
+        # readers only ever follow meta.json
+        for s in range(self.shards):
+            if self._data[s] is not None:
+                self._data[s].flush()
+                self._last[s].flush()
+            if self._new_users[s]:
+                with open(self._file(s, "users"), "a") as f:
+                    f.write("".join(u + "\n" for u in self._new_users[s]))
+                self._new_users[s] = []
+            self.meta["users"][s] = len(self._users[s])
+        self.meta["refreshed_at"] = dt.datetime.utcnow().isoformat(timespec="seconds")
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+        if self._replaced is not None:
+            # readers still mapping the old build keep their inodes
+            for s in range(self.meta["shards"]):
+                for kind in ("f32", "last", "users"):
+                    try:
+                        os.remove(self._file(s, kind, self._replaced))
+                    except FileNotFoundError:
+                        pass
+            self._replaced = None
+
+    def close(self):
+        self._data, self._last = [], []
+        if self._lock_file is not None:
+            self._lock_file.close()   # releases the lock
+            self._lock_file = None
+        self.writable = False
+
+
+trend_store = TrendStore()
+
+
+# ---------- TREND MATH ----------
+# x: (days, k) oldest first; logged: (days,) bool, days with any meal.
+# Days without meals are gaps, not zeros: they are left out of means.
+
+def rolling_mean(x: np.ndarray, logged: np.ndarray, window: int) -> np.ndarray:
+    # mean over the logged days of each trailing window; NaN if none
+    v = np.where(logged[:, None], x, 0.0)
+    sums = np.concatenate((np.zeros((1, x.shape[1])), np.cumsum(v, axis=0)))
+    counts = np.concatenate(([0], np.cumsum(logged)))
+    end = np.arange(1, len(x) + 1)
+    start = np.maximum(end - window, 0)
+    n = (counts[end] - counts[start])[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, (sums[end] - sums[start]) / n, np.nan)
+
+
+def ewma(x: np.ndarray, logged: np.ndarray, span: int) -> np.ndarray:
+    # exponentially weighted mean over the logged days, carried over gaps;
+    # NaN before the first logged day
+    out = np.full(x.shape, np.nan)
+    seen = x[logged].astype(np.float64)
+    if not len(seen):
+        return out
+    alpha = 2.0 / (span + 1)
+    smoothed, _ = lfilter([alpha], [1.0, alpha - 1.0], seen, axis=0, zi=(1 - alpha) * seen[:1])
+    seen_so_far = np.cumsum(logged)
+    has = seen_so_far > 0
+    out[has] = smoothed[seen_so_far[has] - 1]
+    return out
+
+
+def percentiles(x: np.ndarray, logged: np.ndarray, qs=(10, 25, 50, 75, 90)) -> np.ndarray | None:
+    # (len(qs), k) over logged days
+    return np.percentile(x[logged], qs, axis=0) if logged.any() else None
+
+
+def weekly(x: np.ndarray, logged: np.ndarray, weeks: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # the last weeks * 7 days as 7-day blocks ending on the last day:
+    # per-block mean over logged days (NaN if none), logged-day counts and
+    # change against the previous block in percent
+    n = weeks * 7
+    v = np.where(logged[-n:, None], x[-n:], 0.0).reshape(weeks, 7, -1)
+    days = logged[-n:].reshape(weeks, 7).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = v.sum(axis=1) / days[:, None]
+        change = np.full(means.shape, np.nan)
+        change[1:] = (means[1:] - means[:-1]) / means[:-1] * 100
+    change[~np.isfinite(change)] = np.nan
+    return means, days, change
+
+
+def streaks(hit: np.ndarray) -> tuple[int, int]:
+    # (current, longest) runs of True; the last day is still in progress,
+    # so a miss there doesn't end the current run
+    edges = np.diff(np.concatenate(([0], hit.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    longest = int((ends - starts).max()) if len(starts) else 0
+    tail = hit if hit[-1] else hit[:-1]
+    misses = np.flatnonzero(~tail)
+    current = len(tail) - (misses[-1] + 1 if len(misses) else 0)
+    return int(current), longest
+
+
+def _list(a, digits: int = 1) -> list:
+    # NaN -> None, for JSON
+    out = np.round(a.astype(np.float64), digits).astype(object)
+    out[np.isnan(a)] = None
+    return out.tolist()
+
+
+def trend_report(series: np.ndarray, first: dt.date, metric: str,
+                 windows: list[int], span: int) -> dict:
+    # one macro's daily values with moving averages, EWMA and percentiles
+    k = FIELDS.index(metric)
+    logged = series[:, 4] > 0
+    x = series[:, k:k + 1].astype(np.float64)
+    pct = percentiles(x, logged)
+    return {
+        "metric": metric,
+        "dates": np.datetime_as_string(np.datetime64(first) + np.arange(len(series))).tolist(),
+        "values": _list(np.where(logged, x[:, 0], np.nan)),
+        "moving_average": {str(w): _list(rolling_mean(x, logged, w)[:, 0]) for w in windows},
+        "ewma": _list(ewma(x, logged, span)[:, 0]),
+        "percentiles": {f"p{q}": round(float(v), 1) for q, v in zip((10, 25, 50, 75, 90), pct[:, 0])}
+        if pct is not None else None,
+        "logged_days": int(logged.sum()),
+        "mean": round(float(x[logged, 0].mean()), 1) if logged.any() else None,
+    }
+
+
+def weekly_report(series: np.ndarray, last: dt.date, weeks: int) -> list[dict]:
+    logged = series[:, 4] > 0
+    means, days, change = weekly(series[:, :4].astype(np.float64), logged, weeks)
+    means = dict(zip(MACROS, (_list(c) for c in means.T)))
+    change = dict(zip(MACROS, (_list(c) for c in change.T)))
+    return [{
+        "week_start": (last - dt.timedelta(days=7 * (weeks - i) - 1)).isoformat(),
+        "days_logged": int(days[i]),
+        **{m: means[m][i] for m in MACROS},
+        "change_pct": {m: change[m][i] for m in MACROS},
+    } for i in range(weeks)]
+
+
+def streak_report(series: np.ndarray, calories: float, tolerance: float) -> dict:
+    # logging streaks, and days within `tolerance` (a fraction) of the
+    # calorie target
+    logged = series[:, 4] > 0
+    on_target = logged & (np.abs(series[:, 0] - calories) <= tolerance * calories)
+    log_current, log_longest = streaks(logged)
+    hit_current, hit_longest = streaks(on_target)
+    n = int(logged.sum())
+    return {
+        "logging": {"current": log_current, "longest": log_longest, "days": n},
+        "on_target": {"current": hit_current, "longest": hit_longest, "days": int(on_target.sum()),
+                      "rate": round(int(on_target.sum()) / n, 3) if n else None},
+    }
@@ -0,0 +1,39 @@
+import datetime as dt
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+UTC = dt.timezone.utc
+
+
+def std_resp(data, status: str = "success"):
+    return {"status": status, "data": data, "server_time": dt.datetime.utcnow().isoformat()}
+
+
+# ---------- USER TIME ZONES ----------
+# time_of_meal is stored as naive UTC; a user's "day" is a half-open UTC
+# range computed from their zone, so queries stay index range scans.
+
+def get_zone(name: str) -> dt.tzinfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"Unknown time zone {name!r}") from e
+
+
+def is_utc(tz: dt.tzinfo) -> bool:
+    return str(tz) in ("UTC", "Etc/UTC")
+
+
+def local_today(tz: dt.tzinfo = UTC) -> dt.date:
+    return dt.datetime.now(tz).date()
+
+
+def local_date(when: dt.datetime, tz: dt.tzinfo = UTC) -> dt.date:
+    # naive UTC timestamp -> the user's calendar day
+    return when.replace(tzinfo=UTC).astimezone(tz).date()
+
+
+def day_range(first: dt.date, end: dt.date, tz: dt.tzinfo = UTC) -> tuple[dt.datetime, dt.datetime]:
+    # local days [first, end) -> naive UTC [start, stop)
+    def utc(day):
+        return dt.datetime.combine(day, dt.time.min, tz).astimezone(UTC).replace(tzinfo=None)
+    return utc(first), utc(end)
@@ -1,45 +1,217 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
 from celery import Celery
-from sqlalchemy.ext.asyncio import AsyncSession
-from database.config import async_session, DATABASE_URL
-from database.models import UserMeal, WeeklyAnalytics
-from sqlalchemy import select, func, and_
+from database.config import async_session
+from database.models import WeeklyAnalytics, DailyTotal
+from database.crud import dialect_insert, TOTAL_COLUMNS
+from database.user_cache import user_cache
+from sqlalchemy import select, delete, func, cast, literal_column, Date, DateTime
 import datetime as dt
+import numpy as np
+import metrics
+from nutrition.trends import TrendStore, TrendStoreLocked, day_number
 
-celery = Celery("tasks", broker="redis://localhost:6379/0",
-                backend="redis://localhost:6379/0")
+log = logging.getLogger(__name__)
 
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+celery = Celery("tasks", broker=CELERY_BROKER_URL,
+                backend=os.getenv("CELERY_RESULT_BACKEND", CELERY_BROKER_URL),
+                include=["workers.jobs"])
+# task priorities 0 (first) .. 9 on the Redis transport, used by image jobs
+celery.conf.broker_transport_options = {"queue_order_strategy": "priority",
+                                        "priority_steps": list(range(10)), "sep": ":"}
+metrics.instrument_celery()
 
-@celery.task
-def build_weekly_analytics():
-    async def _run():
-        async with async_session() as db:
-            users = await db.execute(select(UserMeal.user_id).distinct())
-            for (user_id,) in users:
-                base = dt.date.today() - dt.timedelta(days=6)
-                stmt = select(
-                    func.date(UserMeal.time_of_meal),
-                    func.sum(UserMeal.total_calories),
-                    func.sum(UserMeal.total_protein),
-                    func.sum(UserMeal.total_carbs),
-                    func.sum(UserMeal.total_fats)
-                ).where(
-                    and_(UserMeal.user_id == user_id,
-                         func.date(UserMeal.time_of_meal) >= base)
-                ).group_by(func.date(UserMeal.time_of_meal))
-                res = await db.execute(stmt)
-                for row in res:
-                    date, cal, p, c, f = row
-                    wa = WeeklyAnalytics(
-                        user_id=user_id,
-                        date=dt.datetime.combine(date, dt.time.min),
-                        total_calories=cal or 0,
-                        total_protein=p or 0,
-                        total_carbs=c or 0,
-                        total_fats=f or 0
-                    )
-                    db.add(wa)
+WINDOW_DAYS = 7
+CHUNK_USERS = int(os.getenv("ANALYTICS_CHUNK_USERS", "5000"))
+TRENDS_REFRESH_DAYS = int(os.getenv("TRENDS_REFRESH_DAYS", "2"))
+TRENDS_REFRESH_S = int(os.getenv("TRENDS_REFRESH_S", "300"))
+
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def run_async(coro):
+    # Every task of a worker process runs on this one event loop, kept
+    # across tasks: the engine's pooled connections and the Redis clients
+    # stay bound to the loop that opened them, which a fresh asyncio.run()
+    # per task would close under them. (Assumes the prefork or solo pool.)
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+
+def _sql_uuid(dialect: str):
+    # weekly_analytics.id has only a Python-side default, which
+    # INSERT ... SELECT never runs
+    if dialect == "sqlite":
+        return func.lower(func.hex(func.randomblob(16)))   # Uuid's CHAR(32) form
+    return func.gen_random_uuid()
+
+
+def _day_start(dialect: str, col):
+    # DATE -> midnight DATETIME; on SQLite, in the exact text format the
+    # DateTime type stores, so equality and range checks line up
+    if dialect == "sqlite":
+        return func.strftime("%Y-%m-%d %H:%M:%f000", col)
+    return cast(col, DateTime)
+
+
+def _day_of(dialect: str, col):
+    # DATETIME -> DATE, the inverse of _day_start; applied to the outer
+    # row so the daily_totals side stays a primary-key lookup
+    if dialect == "sqlite":
+        return func.date(col)
+    return cast(col, Date)
+
+
+async def refresh_weekly_analytics(today: dt.date | None = None, chunk_users: int = CHUNK_USERS,
+                                   dry_run: bool = False) -> dict:
+    # Rebuild the last WINDOW_DAYS of weekly_analytics from daily_totals,
+    # one user-id range per transaction: INSERT ... SELECT upserts every
+    # (user, day) of the range in one statement, and days in the range that
+    # no longer have meals are deleted. The ranges tile the whole user-id
+    # space, so users whose meals in the window are all gone are covered
+    # too. Finally rows older than the window go. Re-running is idempotent.
+    today = today or dt.datetime.utcnow().date()
+    base = today - dt.timedelta(days=WINDOW_DAYS - 1)
+    base_dt = dt.datetime.combine(base, dt.time.min)
+    stats = {"chunks": 0, "users": 0, "upserted": 0, "deleted": 0, "dry_run": dry_run}
+    started = time.perf_counter()
+    last_user = None
+
+    async with async_session() as db:
+        dialect = db.get_bind().dialect.name
+        live = select(literal_column("1")).where(
+            DailyTotal.user_id == WeeklyAnalytics.user_id,
+            DailyTotal.date == _day_of(dialect, WeeklyAnalytics.date))
+
+        async def drop(*where) -> int:
+            if dry_run:
+                return await db.scalar(select(func.count()).select_from(WeeklyAnalytics).where(*where))
+            res = await db.execute(delete(WeeklyAnalytics).where(*where)
+                                   .execution_options(synchronize_session=False))
+            return res.rowcount
+
+        def emptied(after, upto):
+            # days in the window without meals, for users in (after, upto]
+            where = [WeeklyAnalytics.date >= base_dt, ~live.exists()]
+            if after is not None:
+                where.append(WeeklyAnalytics.user_id > after)
+            if upto is not None:
+                where.append(WeeklyAnalytics.user_id <= upto)
+            return where
+
+        while True:
+            # keyset-walk the distinct users that have data in the window
+            ids = select(DailyTotal.user_id).where(DailyTotal.date >= base).distinct() \
+                .order_by(DailyTotal.user_id).limit(chunk_users)
+            if last_user is not None:
+                ids = ids.where(DailyTotal.user_id > last_user)
+            users = (await db.execute(ids)).scalars().all()
+            if not users:
+                break
+            lo, hi = users[0], users[-1]
+            src = select(
+                _sql_uuid(dialect), DailyTotal.user_id, _day_start(dialect, DailyTotal.date),
+                *(getattr(DailyTotal, c) for c in TOTAL_COLUMNS)
+            ).where(DailyTotal.date >= base, DailyTotal.user_id >= lo, DailyTotal.user_id <= hi)
+
+            if dry_run:
+                upserted = await db.scalar(select(func.count()).select_from(src.subquery()))
+            else:
+                ins = dialect_insert(db, WeeklyAnalytics).from_select(
+                    ["id", "user_id", "date", *TOTAL_COLUMNS], src)
+                res = await db.execute(ins.on_conflict_do_update(
+                    index_elements=["user_id", "date"],
+                    set_={c: getattr(ins.excluded, c) for c in TOTAL_COLUMNS}))
+                upserted = res.rowcount
+            stats["deleted"] += await drop(*emptied(last_user, hi))
+            if not dry_run:
+                await db.commit()
+
+            stats["chunks"] += 1
+            stats["users"] += len(users)
+            stats["upserted"] += upserted
+            elapsed = time.perf_counter() - started
+            log.info("weekly analytics: chunk %d users %s..%s, %d users total, "
+                     "%d upserted, %.1f users/s",
+                     stats["chunks"], lo, hi, stats["users"], stats["upserted"],
+                     stats["users"] / elapsed)
+            last_user = hi
+
+        # users past the last chunk, then rows that slid out of the window
+        stats["deleted"] += await drop(*emptied(last_user, None))
+        stats["deleted"] += await drop(WeeklyAnalytics.date < base_dt)
+        if dry_run:
+            await db.rollback()
+        else:
             await db.commit()
-    asyncio.run(_run())
+    if not dry_run:
+        await user_cache.bump_all()   # cached /weekly-analytics responses are stale now
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+async def refresh_trends(full: bool = False, today: dt.date | None = None,
+                         batch_rows: int = 50_000) -> dict:
+    # Copy daily_totals into the trend store (nutrition/trends.py): the
+    # last TRENDS_REFRESH_DAYS days, re-read so late and deleted meals
+    # land, or with full=True every day the store keeps, into a new build.
+    # Re-running is idempotent.
+    today = today or dt.datetime.utcnow().date()
+    store = TrendStore()
+    store.open_writer(rebuild=full)
+    stats = {"full": full, "rows": 0}
+    started = time.perf_counter()
+    try:
+        first = today - dt.timedelta(days=(store.days if full else TRENDS_REFRESH_DAYS) - 1)
+        store.advance(today)
+        cols = [DailyTotal.user_id, DailyTotal.date, *(getattr(DailyTotal, c) for c in TOTAL_COLUMNS),
+                DailyTotal.meal_count]
+
+        def columns(rows):
+            return ([r[0] for r in rows], np.fromiter((day_number(r[1]) for r in rows), np.int64, len(rows)),
+                    np.array([r[2:] for r in rows], dtype=np.float32).reshape(len(rows), len(cols) - 2))
+
+        # a refresh rewrites days that readers have mapped: its rows are
+        # swapped in at the end, in one pass; a full rebuild writes files
+        # nobody reads until commit()
+        pending = []
+        async with async_session() as db:
+            res = await db.stream(select(*cols).where(DailyTotal.date >= first, DailyTotal.date <= today)
+                                  .execution_options(yield_per=batch_rows))
+            async for rows in res.partitions():
+                if full:
+                    store.put(*columns(rows))
+                else:
+                    pending.extend(rows)
+                stats["rows"] += len(rows)
+                log.info("trends: %d rows copied", stats["rows"])
+        if not full:
+            store.replace(first, today, *columns(pending))
+        store.commit()
+        stats["users"] = sum(store.meta["users"])
+    finally:
+        store.close()
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+@celery.task
+def build_weekly_analytics(dry_run: bool = False):
+    return run_async(refresh_weekly_analytics(dry_run=dry_run))
+
+
+@celery.task
+def build_trends(full: bool = False):
+    try:
+        return run_async(refresh_trends(full=full))
+    except TrendStoreLocked:
+        return {"skipped": "previous refresh still running"}
 
 
 # celery beat schedule (run once at midnight)
@@ -47,5 +219,25 @@ celery.conf.beat_schedule = {
     "analytics-midnight": {
         "task": "workers.analytics.build_weekly_analytics",
         "schedule": 60 * 60 * 24,  # seconds
-    }
+    },
+    "trends-refresh": {
+        "task": "workers.analytics.build_trends",
+        "schedule": TRENDS_REFRESH_S,
+    },
 }
+
+
+if __name__ == "__main__":
+    # python -m workers.analytics [--dry-run] [--chunk-users N]
+    # python -m workers.analytics --trends [--full]
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--chunk-users", type=int, default=CHUNK_USERS)
+    ap.add_argument("--trends", action="store_true", help="refresh the trend store instead")
+    ap.add_argument("--full", action="store_true", help="with --trends: rebuild all kept days")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.trends:
+        print(asyncio.run(refresh_trends(full=args.full)))
+    else:
+        print(asyncio.run(refresh_weekly_analytics(chunk_users=args.chunk_users, dry_run=args.dry_run)))
@@ -0,0 +1,87 @@
+# workers/jobs.py
+# Celery side of the async image jobs (ml/jobs.py). The API stores the
+# upload in Redis and enqueues run_image_job(job_id) at the job's
+# priority; the task decodes the image and runs the model in this
+# worker, writes the result to the job record and pushes it to the
+# user's websockets over Redis. Start workers with
+#
+#   CELERY_BROKER_URL=redis://... celery -A workers.analytics worker
+#
+# (-c sets the processes; each loads the detector once and keeps its own
+# copy of the catalog search index for matching scans.)
+import os
+import time
+import redis.asyncio as redis
+from database.config import REDIS_URL, async_session
+from database.search import food_index
+from database.websocket import ConnectionManager
+from ml import scanner
+from ml.classify import classify_food
+from ml.jobs import CELERY_TASK, JobFailed, JobQueue, JobStore, JobStoreUnavailable
+from ml.preprocess import decode_image
+from nutrition.portions import scan_nutrition, scan_weight
+from workers.analytics import celery, run_async
+
+SCANNER_THREADS = int(os.getenv("SCANNER_THREADS", "1"))
+JOB_CATALOG_RELOAD_S = float(os.getenv("JOB_CATALOG_RELOAD_S", "300"))
+
+_jobs: JobQueue | None = None
+_catalog_loaded = 0.0
+
+
+def _worker_jobs() -> JobQueue:
+    # runs on the worker's shared loop (run_async), like the analytics
+    # tasks, so the Redis and DB pools are only ever used from that loop
+    global _jobs
+    if _jobs is None:
+        client = redis.from_url(REDIS_URL)
+        _jobs = JobQueue(JobStore(client, local=False), mode="celery")
+        _jobs.notify = ConnectionManager(client).send_personal   # publishes only
+        scanner.init_worker(SCANNER_THREADS)
+    return _jobs
+
+
+async def _catalog():
+    # the API's matcher (FoodSearchIndex.best_match) over this process's
+    # own copy of the catalog, re-read every JOB_CATALOG_RELOAD_S: this
+    # worker does not follow the API's catalog pub/sub between tasks
+    global _catalog_loaded
+    if not food_index.loaded or time.monotonic() - _catalog_loaded >= JOB_CATALOG_RELOAD_S:
+        async with async_session() as db:
+            await food_index.load(db)
+        _catalog_loaded = time.monotonic()
+    return food_index
+
+
+async def compute(kind: str, data: bytes) -> dict:
+    try:
+        image = decode_image(data)
+    except OSError:
+        raise JobFailed("Unreadable image")
+    if kind == "classify":
+        name, conf = classify_food(image)
+        return {"food_name": name, "confidence": conf}
+    scan = scanner.scan_food(image)
+    if kind == "weight":
+        return scan_weight(scan)
+    return scan_nutrition(scan, (await _catalog()).best_match)
+
+
+@celery.task(bind=True, name=CELERY_TASK, acks_late=True, ignore_result=True)
+def run_image_job(self, job_id: str):
+    jobs = _worker_jobs()
+
+    async def attempt() -> bool:
+        record, data = await jobs.get(job_id), await jobs.store.get(f"data:{job_id}")
+        if record is None or data is None or record["status"] in ("done", "failed"):
+            return True   # expired, or settled by an earlier delivery
+        return await jobs.run(job_id, lambda: compute(record["kind"], data))
+
+    try:
+        settled = run_async(attempt())
+    except JobStoreUnavailable:
+        settled = False   # Redis is down: the result could not be recorded
+    if not settled:
+        # the job record counts attempts, so no Celery-side limit
+        raise self.retry(countdown=jobs.retry_delay(self.request.retries + 1), max_retries=None,
+                         priority=(self.request.delivery_info or {}).get("priority"))